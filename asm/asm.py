@@ -13,9 +13,16 @@
 #  DB 0x0a   ; a hex byte
 #  DB 12   ; a decimal byte
 #  DB 0b0001 ; a binary byte
+#
+#  BANK 3   ; everything after this goes in bank 3 of banked memory
+#  Table:
+#  DB 7
+#  LDI R0,BANK(Table)  ; the bank a label is in
+#  LDI R1,Table        ; and its address in the bank window
 
 import sys
 import re
+import struct
 
 # Opcodes
 OPCODES = {
@@ -57,16 +64,49 @@ OPCODES = {
 
 # Regex for matching lines
 # Capturing groups: label, opcode, operandA, operandB
-REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
+REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+(?:\(\w+\))?))?)?)?"
 
 # Regex for capturing DS and DB data
 REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
 REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
 
+# Precompiled versions of the above, used by assemble()
+LINE_PATTERN = re.compile(REGEX)
+DS_PATTERN = re.compile(REGEX_DS, re.IGNORECASE)
+DB_PATTERN = re.compile(REGEX_DB, re.IGNORECASE)
+REGISTER_PATTERN = re.compile(r"R([0-7])")
+BANK_PATTERN = re.compile(r"BANK\((\w+)\)")
+
+# Opcode name -> (type, machine code byte)
+OPCODE_INFO = {name: (info["type"], int(info["code"], 2))
+               for name, info in OPCODES.items()}
+
+# Register name -> register number
+REGISTERS = {f"R{i}": i for i in range(8)}
+
+# Text line for every byte value
+BYTE_LINES = [f"{b:08b}\n" for b in range(256)]
+
+# Header of binary .ls8b images. Must match ls8/image.py:
+# magic, version, entry, load address, reserved, code length, symbol count,
+# symbol table offset
+IMAGE_MAGIC = b"LS8B"
+IMAGE_VERSION = 1
+IMAGE_HEADER = struct.Struct("<4sBBBBHHI")
+
+# Where BANK sections are assembled and how big they can be. Must match
+# ls8/banks.py
+BANK_WINDOW = 0x80
+BANK_SIZE = 0x40
+
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [-O] [--no-listing] [inputfile] [outputfile]
+
+    An outputfile ending in .ls8b is written as a binary image. --no-listing
+    leaves the label lines and comments out of .ls8 text output. -O runs the
+    peephole optimizer in optimize.py and reports its changes on stderr.
     """
 
     if len(argv) == 1:
@@ -82,7 +122,8 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [-O] [--no-listing] [infile.asm] [outfile.ls8|outfile.ls8b]",
+              file=sys.stderr)
         sys.exit(1)
 
     return inputfile, outputfile
@@ -101,6 +142,8 @@ def open_files(inputfile, outputfile):
 
     if outputfile == "-":
         outputfile = sys.stdout
+    elif outputfile.endswith(".ls8b"):
+        outputfile = open(outputfile, "wb")
     else:
         outputfile = open(outputfile, "w")
 
@@ -129,7 +172,8 @@ def p8(v):
 
 def pass1(inputfile, sym, code):
     """
-    Pass 1
+    Pass 1 of the original two pass assembler. main() uses assemble() now,
+    pass1() and pass2() are kept for comparison in bench_asm.py.
 
     * Read the source code lines
     * Parse labels, opcodes, and operands
@@ -381,22 +425,424 @@ def pass2(outputfile, sym, code):
         outputfile.write(f"{c}\n")
 
 
+def statements(inputfile):
+    """
+    Parse and check source lines. Yields one tuple per line that isn't blank:
+
+        (line_num, label, opcode, op_a, op_b, a, b, data)
+
+    label and opcode are upper case, or None. For an instruction op_a and op_b
+    are its operands as written (upper case) and a and b their values -
+    register numbers, and for LDI the immediate as a byte or the label
+    reference as a string. For DS and DB op_a is the argument as written and
+    data its bytes. For BANK a is the bank number.
+
+    Both assemble() and the optimizer read their source through here, so a
+    line means the same and fails with the same message in either.
+    """
+
+    # Bound once, these are called for every line
+    match_line = LINE_PATTERN.match
+    opcode_info = OPCODE_INFO.get
+    registers = REGISTERS.get
+
+    line_num = 0
+
+    def get_reg(op):
+        """Get a register number from a string, e.g. "R2" -> 2"""
+
+        reg = registers(op)
+
+        if reg is None:
+            m = REGISTER_PATTERN.match(op)
+
+            if m is None:
+                print(f"Line {line_num}: unknown register {op}",
+                      file=sys.stderr)
+                sys.exit(1)
+
+            reg = int(m.group(1))
+
+        return reg
+
+    for line in inputfile:
+        line_num += 1
+
+        # Strip comments
+        comment_index = line.find(';')
+        if comment_index != -1:
+            line = line[:comment_index]
+
+        # Normalize
+        line = line.strip()
+
+        # Ignore blank lines
+        if not line:
+            continue
+
+        label, opcode, op_a, op_b = match_line(line).groups()
+
+        if label is not None:
+            label = label.upper()
+
+        if opcode is None:
+            yield line_num, label, None, None, None, None, None, None
+            continue
+
+        opcode = opcode.upper()
+        op_info = opcode_info(opcode)
+
+        if op_info is not None:
+            op_type = op_info[0]
+
+            if op_a is not None:
+                op_a = op_a.upper()
+            if op_b is not None:
+                op_b = op_b.upper()
+
+            # Check operand count
+            found = (op_a is not None) + (op_b is not None)
+            desired = 2 if op_type == 8 else op_type
+
+            if found < desired:
+                print(f"Line {line_num}: missing operand to {opcode}",
+                      file=sys.stderr)
+                sys.exit(1)
+            elif found > desired:
+                print(f"Line {line_num}: unexpected operand to {opcode}",
+                      file=sys.stderr)
+                sys.exit(1)
+
+            if op_type == 0:
+                a = b = None
+
+            elif op_type == 1:
+                a, b = get_reg(op_a), None
+
+            elif op_type == 2:
+                a, b = get_reg(op_a), get_reg(op_b)
+
+            else:
+                # LDI r,i or LDI r,label
+                a = get_reg(op_a)
+
+                try:
+                    b = int(op_b, 0) & 0xff
+                except ValueError:
+                    # If it's not a value it's a label reference, see resolve()
+                    b = op_b
+
+            yield line_num, label, opcode, op_a, op_b, a, b, None
+
+        elif opcode == 'DS':
+            m = DS_PATTERN.match(line)
+
+            if m is None or m.group(2) is None:
+                print(f"line {line_num}: missing argument to DS", file=sys.stderr)
+                sys.exit(2)
+
+            text = m.group(2)
+            yield line_num, label, opcode, text, None, None, None, bytes(ord(c) & 0xff for c in text)
+
+        elif opcode == 'DB':
+            m = DB_PATTERN.match(line)
+
+            if m is None or m.group(2) is None:
+                print(f"line {line}: missing argument to DB", file=sys.stderr)
+                sys.exit(2)
+
+            text = m.group(2)
+
+            try:
+                val = int(text, 0)
+
+            except ValueError:
+                print(f"line {line_num}: invalid integer argument to DB",
+                      file=sys.stderr)
+                sys.exit(2)
+
+            # Force to byte size
+            yield line_num, label, opcode, text, None, None, None, bytes((val & 0xff,))
+
+        elif opcode == 'BANK':
+            try:
+                bank = int(op_a, 0)
+            except (TypeError, ValueError):
+                bank = -1
+
+            if not 0 <= bank <= 0xff or op_b is not None:
+                print(f"line {line_num}: BANK needs a bank number from 0 to 255",
+                      file=sys.stderr)
+                sys.exit(2)
+
+            yield line_num, label, opcode, op_a, None, bank, None, None
+
+        else:
+            print(f"line {line_num}: unknown opcode {opcode}", file=sys.stderr)
+            sys.exit(2)
+
+
+def resolve(s, sym, sym_banks, line_num):
+    """
+    The byte a label reference stands for - the label's address, or for
+    BANK(label) the bank it is in. Exits with an error if there is no such
+    label, or it isn't in a bank.
+    """
+
+    m = BANK_PATTERN.fullmatch(s)
+
+    if m is not None:
+        s = m.group(1)
+
+        if s in sym and s not in sym_banks:
+            print(f"line {line_num}: {s} is not in a bank", file=sys.stderr)
+            sys.exit(2)
+
+    if s not in sym:
+        print(f"unknown symbol: {s}", file=sys.stderr)
+        sys.exit(2)
+
+    return (sym_banks[s] if m is not None else sym[s]) & 0xff
+
+
+def assemble(inputfile, listing=False, banks=None):
+    """
+    Single pass assembler
+
+    * Stream the source code lines
+    * Emit machine code bytes straight into a bytearray
+    * Record label offsets, and a fixup for every LDI that names a label
+    * Patch the fixups once the whole source has been read
+
+    Returns (machine_code, sym, notes). notes is None unless listing is true,
+    in which case it is (labels, comments): the labels defined at each offset
+    and the comment for the byte at each offset, as written in .ls8 files.
+
+    Everything after a BANK n directive goes into bank n instead of
+    machine_code, assembled at BANK_WINDOW. banks is a dict that gets a
+    bytearray for every bank - without one a BANK directive is an error. In the
+    notes the offsets of banked bytes are (bank, offset) pairs.
+    """
+
+    machine_code = bytearray()
+    sym = {}
+
+    # Bank of every label defined after a BANK directive
+    sym_banks = {}
+
+    # (code, offset, symbol, line number) for every byte that waits for a label
+    fixups = []
+
+    labels = {} if listing else None
+    comments = {} if listing else None
+
+    # The bytes being assembled - machine_code, or the current bank's - and
+    # the address the first of them ends up at
+    code = machine_code
+    bank = None
+    base = 0
+
+    # Bound once, these are called for every line
+    opcode_info = OPCODE_INFO.get
+    append = code.append
+    extend = code.extend
+
+    def key(offset):
+        """Where the notes keep the byte at offset of the current code"""
+
+        return offset if bank is None else (bank, offset)
+
+    for line_num, label, opcode, op_a, op_b, a, b, data in statements(inputfile):
+        # Track label address
+        if label is not None:
+            sym[label] = base + len(code)
+
+            if bank is not None:
+                sym_banks[label] = bank
+
+            if listing:
+                labels.setdefault(key(len(code)), []).append(label)
+
+        if opcode is None:
+            continue
+
+        op_info = opcode_info(opcode)
+
+        if op_info is not None:
+            op_type, op_byte = op_info
+
+            if listing:
+                if op_type == 0:
+                    comments[key(len(code))] = opcode
+                elif op_type == 1:
+                    comments[key(len(code))] = f"{opcode} {op_a}"
+                else:
+                    comments[key(len(code))] = f"{opcode} {op_a},{op_b}"
+
+            if op_type == 0:
+                append(op_byte)
+
+            elif op_type == 1:
+                extend((op_byte, a))
+
+            elif op_type == 2:
+                extend((op_byte, a, b))
+
+            elif b.__class__ is int:
+                extend((op_byte, a, b))
+
+            else:
+                # A label, patched in at the end
+                extend((op_byte, a))
+                fixups.append((code, len(code), b, line_num))
+                append(0)
+
+        elif opcode == 'BANK':
+            if banks is None:
+                print(f"line {line_num}: BANK sections can only be written as .ls8 text",
+                      file=sys.stderr)
+                sys.exit(2)
+
+            # Switch to the bank's bytes, picking up where an earlier BANK left off
+            bank = a
+            code = banks.setdefault(bank, bytearray())
+            base = BANK_WINDOW
+            append = code.append
+            extend = code.extend
+
+        else:
+            # DS or DB
+            if listing:
+                if opcode == 'DS':
+                    for i, print_char in enumerate(op_a, len(code)):
+                        comments[key(i)] = '[space]' if print_char == ' ' else print_char
+                else:
+                    comments[key(len(code))] = op_a
+
+            extend(data)
+
+    # Backpatch every label reference now that all labels are known
+    for code, offset, s, line_num in fixups:
+        code[offset] = resolve(s, sym, sym_banks, line_num)
+
+    if banks:
+        # Switching banks would swap out any code in the window
+        if len(machine_code) > BANK_WINDOW:
+            print(f"the code before the first BANK runs into the bank window at {BANK_WINDOW:02X}",
+                  file=sys.stderr)
+            sys.exit(2)
+
+        for n, data in banks.items():
+            if len(data) > BANK_SIZE:
+                print(f"bank {n} is {len(data)} bytes, a bank holds {BANK_SIZE}",
+                      file=sys.stderr)
+                sys.exit(2)
+
+    notes = (labels, comments) if listing else None
+
+    return machine_code, sym, notes
+
+
+def write_text(outputfile, machine_code, notes=None, banks=None):
+    """
+    Output the machine code as an .ls8 text file, one byte per line. With notes
+    from assemble(listing=True) the label lines and comments are included.
+    The banks from assemble() follow the main code, each one as a BANK n line
+    and its bytes.
+    """
+
+    sections = sorted(banks.items()) if banks else []
+
+    if notes is None:
+        outputfile.write("".join(BYTE_LINES[b] for b in machine_code))
+
+        for bank, code in sections:
+            outputfile.write(f"BANK {bank}\n" + "".join(BYTE_LINES[b] for b in code))
+        return
+
+    labels, comments = notes
+    lines = []
+
+    for bank, code in [(None, machine_code)] + sections:
+        base = 0
+
+        if bank is not None:
+            base = BANK_WINDOW
+            lines.append(f"BANK {bank}\n")
+
+        # Offset len(code) is for labels after the last byte
+        for offset in range(len(code) + 1):
+            key = offset if bank is None else (bank, offset)
+
+            for label in labels.get(key, ()):
+                lines.append(f"# {label} (address {base + offset}):\n")
+
+            if offset == len(code):
+                break
+
+            b = code[offset]
+            comment = comments.get(key)
+            if comment is None:
+                lines.append(BYTE_LINES[b])
+            else:
+                lines.append(f"{b:08b} # {comment}\n")
+
+    outputfile.write("".join(lines))
+
+
+def write_binary(outputfile, machine_code, sym):
+    """
+    Output the machine code as a binary .ls8b image. The labels are kept in
+    the image's symbol table.
+    """
+
+    table = bytearray()
+    for name, address in sym.items():
+        encoded = name.encode("ascii")
+        table += bytes([address & 0xff, len(encoded)]) + encoded
+
+    symbol_offset = IMAGE_HEADER.size + len(machine_code) if sym else 0
+
+    outputfile.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, 0, 0, 0,
+                                       len(machine_code), len(sym),
+                                       symbol_offset))
+    outputfile.write(machine_code)
+    outputfile.write(table)
+
+
 def main(argv):
     # Parse command line
+    options = [a for a in argv[1:] if a.startswith("-") and a != "-"]
+    argv = [a for a in argv if a not in options]
+
+    for option in options:
+        if option not in ("--no-listing", "-O"):
+            print(f"unknown option {option}", file=sys.stderr)
+            sys.exit(1)
+
+    listing = "--no-listing" not in options
+
     inputfile, outputfile = parse_commandline(argv)
 
     # Open files
     inputfile, outputfile = open_files(inputfile, outputfile)
 
-    # Set up the symbol table
-    sym = {}
+    binary = getattr(outputfile, "mode", None) == "wb"
 
-    # Set up the machine code output
-    code = []
+    # Assemble - the listing only matters for text output, and only text
+    # output can hold banks
+    banks = None if binary else {}
 
-    # Assemble
-    pass1(inputfile, sym, code)
-    pass2(outputfile, sym, code)
+    if "-O" in options:
+        import optimize
+        machine_code, sym, notes = optimize.assemble(inputfile, listing and not binary)
+    else:
+        machine_code, sym, notes = assemble(inputfile, listing and not binary, banks)
+
+    if binary:
+        write_binary(outputfile, machine_code, sym)
+    else:
+        write_text(outputfile, machine_code, notes, banks)
 
     return 0
 
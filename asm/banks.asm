@@ -0,0 +1,79 @@
+; Banked memory
+;
+; Prints two strings that are kept in different banks, then stores a number in
+; a bank that starts out empty, switches away and back again and prints it.
+;
+; Expected output:
+; Hello from bank 1
+; and from bank 2
+; 42
+
+	LDI R0,BANK(First)   ; bank the first string is in
+	LDI R1,First         ; and its address in the bank window
+	LDI R2,PrintBanked   ; address of PrintBanked
+	CALL R2
+
+	LDI R0,BANK(Second)
+	LDI R1,Second
+	CALL R2
+
+	LDI R4,0xF5          ; bank select port
+	LDI R0,9
+	ST R4,R0             ; switch to bank 9, nothing has been written to it
+
+	LDI R0,0x80          ; start of the bank window
+	LDI R1,42
+	ST R0,R1             ; the first write to bank 9
+
+	LDI R1,1
+	ST R4,R1             ; away to bank 1...
+	LDI R1,9
+	ST R4,R1             ; ...and back
+
+	LD R1,R0
+	PRN R1               ; still 42
+	HLT
+
+; Subroutine: PrintBanked
+; R0 the bank of the string, R1 its address - the string ends with a 0 byte
+; Changes R0, R1 and R3
+
+PrintBanked:
+
+	LDI R3,0xF5
+	ST R3,R0             ; map the string's bank in
+	LDI R0,0             ; 0 for the CMP
+
+PrintBankedLoop:
+
+	LD R3,R1             ; next character
+	CMP R3,R0
+	LDI R3,PrintBankedEnd
+	JEQ R3               ; done at the 0 byte
+
+	LD R3,R1
+	PRA R3               ; print it
+	INC R1
+
+	LDI R3,PrintBankedLoop
+	JMP R3
+
+PrintBankedEnd:
+
+	RET
+
+	BANK 1
+
+First:
+
+	ds Hello from bank 1
+	db 0x0a
+	db 0
+
+	BANK 2
+
+Second:
+
+	ds and from bank 2
+	db 0x0a
+	db 0
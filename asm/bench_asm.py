@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Assembler throughput benchmark
+#
+# Generates a large assembly source and times the original two pass assembler
+# (pass1 + pass2) against the single pass assemble(), with and without the
+# listing comments.
+#
+#  python bench_asm.py [lines] [repeat]
+
+import io
+import random
+import sys
+import time
+
+import asm
+
+
+def generate_source(lines, seed=8):
+    """Generate roughly lines lines of assembly that use every kind of statement"""
+
+    rng = random.Random(seed)
+    two = ["ADD", "AND", "CMP", "MUL", "OR", "SUB", "XOR", "MOD", "SHL", "SHR"]
+    one = ["PRN", "PUSH", "POP", "INC", "DEC", "NOT", "PRA"]
+
+    out = []
+    label = 0
+
+    while len(out) < lines:
+        kind = rng.random()
+
+        if kind < 0.05:
+            out.append(f"Label{label}:")
+            label += 1
+        elif kind < 0.15:
+            # mostly forward references, which need backpatching
+            out.append(f"    LDI R{rng.randrange(8)},Label{label + rng.randrange(1, 20)}")
+        elif kind < 0.30:
+            out.append(f"    LDI R{rng.randrange(8)},{rng.randrange(256)}   ; load a value")
+        elif kind < 0.65:
+            out.append(f"    {rng.choice(two)} R{rng.randrange(8)},R{rng.randrange(8)}")
+        elif kind < 0.90:
+            out.append(f"    {rng.choice(one)} R{rng.randrange(8)}")
+        elif kind < 0.95:
+            out.append("; a comment line")
+        elif kind < 0.98:
+            out.append(f"    DB 0x{rng.randrange(256):02x}")
+        else:
+            out.append("    DS Hello, world!")
+
+    # make sure every forward reference has a target
+    for extra in range(label, label + 20):
+        out.append(f"Label{extra}:")
+
+    out.append("    HLT")
+
+    return "\n".join(out) + "\n"
+
+
+def legacy(source):
+    sym = {}
+    code = []
+    asm.pass1(io.StringIO(source), sym, code)
+    asm.pass2(io.StringIO(), sym, code)
+
+
+def single_pass(source, listing):
+    machine_code, sym, notes = asm.assemble(io.StringIO(source), listing)
+    asm.write_text(io.StringIO(), machine_code, notes)
+
+
+def best_of(repeat, f, *args):
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(*args)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def main(argv):
+    lines = int(argv[1]) if len(argv) > 1 else 100000
+    repeat = int(argv[2]) if len(argv) > 2 else 3
+
+    source = generate_source(lines)
+    line_count = source.count("\n")
+
+    print(f"{line_count} lines, best of {repeat}")
+
+    baseline = best_of(repeat, legacy, source)
+    results = [
+        ("two pass (pass1 + pass2)", baseline),
+        ("single pass, listing", best_of(repeat, single_pass, source, True)),
+        ("single pass, no listing", best_of(repeat, single_pass, source, False)),
+    ]
+
+    for name, elapsed in results:
+        print(f"{name:<26} {elapsed:8.3f}s {line_count / elapsed:12.0f} lines/s "
+              f"{baseline / elapsed:6.2f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+# Incremental build of the example programs
+#
+# Assembles every .asm source in one process (or a worker pool with -j) and
+# writes the results to the examples directory. A manifest of content hashes
+# next to the outputs lets unchanged sources be skipped, and an output is only
+# rewritten when its bytes actually changed.
+#
+#  python build.py [-j jobs] [--binary] [--force] [sources...] [-o outdir]
+
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import asm
+import optimize
+
+MANIFEST = ".build-manifest.json"
+
+
+def assembler_hash():
+    """A hash over the source of every module that goes into a build."""
+
+    digest = hashlib.sha256()
+    for module in (asm, optimize):
+        with open(module.__file__, "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+# Changing the assembler - the parser or the optimizer - invalidates every output it built
+ASSEMBLER_HASH = assembler_hash()
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def assemble_source(source, binary):
+    """
+    Assemble one source file. Returns (source, output bytes, binary), or
+    (source, None, binary) if the assembler rejected it. A source with BANK
+    sections comes back as .ls8 text even when binary is asked for, since
+    .ls8b images can't hold banks - binary says which it is.
+    """
+
+    banks = {}
+
+    try:
+        with open(source) as inputfile:
+            machine_code, sym, notes = asm.assemble(inputfile, not binary, banks)
+
+        if binary and banks:
+            # again with the listing, as a text build would have it
+            banks = {}
+            binary = False
+            with open(source) as inputfile:
+                machine_code, sym, notes = asm.assemble(inputfile, True, banks)
+
+    except SystemExit:
+        # asm.py has already explained the problem on stderr
+        return source, None, binary
+
+    if binary:
+        out = io.BytesIO()
+        asm.write_binary(out, machine_code, sym)
+        return source, out.getvalue(), binary
+
+    out = io.StringIO()
+    asm.write_text(out, machine_code, notes, banks)
+    return source, out.getvalue().encode(), binary
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def build(sources, outdir, jobs=1, binary=False, force=False):
+    """
+    Rebuild the outputs of sources in outdir. Returns (built, written, skipped,
+    failed, text) lists of source files, text being the sources with banks that
+    were written as .ls8 text instead of .ls8b images.
+    """
+
+    extension = ".ls8b" if binary else ".ls8"
+    manifest_path = os.path.join(outdir, MANIFEST)
+    manifest = load_manifest(manifest_path)
+
+    def output_path(source, extension=extension):
+        name = os.path.splitext(os.path.basename(source))[0]
+        return os.path.join(outdir, name + extension)
+
+    # Work out what is stale before paying for any assembling
+    stale = []
+    skipped = []
+    source_hashes = {}
+
+    for source in sources:
+        with open(source, "rb") as f:
+            source_hashes[source] = sha256(f.read())
+
+        # the entry names the file it was written to, which for a source with banks
+        # built with --binary is the .ls8 rather than the .ls8b
+        entry = manifest.get(os.path.basename(output_path(source)))
+        up_to_date = (
+            not force
+            and entry is not None
+            and entry["source"] == source_hashes[source]
+            and entry["assembler"] == ASSEMBLER_HASH
+            and os.path.exists(os.path.join(outdir, entry.get("file", os.path.basename(output_path(source)))))
+        )
+
+        if up_to_date:
+            skipped.append(source)
+        else:
+            stale.append(source)
+
+    if jobs > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(assemble_source, stale, [binary] * len(stale)))
+    else:
+        results = [assemble_source(source, binary) for source in stale]
+
+    built = []
+    written = []
+    failed = []
+    text = []
+
+    for source, data, as_binary in results:
+        if data is None:
+            failed.append(source)
+            continue
+
+        built.append(source)
+        path = output_path(source)
+
+        if binary and not as_binary:
+            text.append(source)
+            path = output_path(source, ".ls8")
+
+        # Leave the file (and its timestamp) alone if nothing changed
+        try:
+            with open(path, "rb") as f:
+                unchanged = f.read() == data
+        except FileNotFoundError:
+            unchanged = False
+
+        if not unchanged:
+            with open(path, "wb") as f:
+                f.write(data)
+            written.append(source)
+
+        manifest[os.path.basename(output_path(source))] = {
+            "source": source_hashes[source],
+            "assembler": ASSEMBLER_HASH,
+            "file": os.path.basename(path),
+            "output": sha256(data),
+        }
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    return built, written, skipped, failed, text
+
+
+def main(argv):
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="Assemble the LS-8 examples")
+    parser.add_argument("sources", nargs="*", help="sources to build (default: every .asm here)")
+    parser.add_argument("-o", "--outdir", default=os.path.join(here, "..", "ls8", "examples"))
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="worker processes")
+    parser.add_argument("--binary", action="store_true", help="write .ls8b images instead of .ls8 text")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and rebuild everything")
+    args = parser.parse_args(argv[1:])
+
+    sources = args.sources or sorted(glob.glob(os.path.join(here, "*.asm")))
+
+    built, written, skipped, failed, text = build(sources, args.outdir, args.jobs,
+                                                  args.binary, args.force)
+
+    print(f"{len(built)} assembled, {len(written)} written, "
+          f"{len(skipped)} up to date, {len(failed)} failed")
+
+    for source in text:
+        print(f"{source} has BANK sections, which .ls8b images can't hold - written as .ls8 text",
+              file=sys.stderr)
+
+    for source in failed:
+        print(f"failed: {source}", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,86 @@
+; Memory mapped devices
+;
+; Run with ls8.py --devices. Prints a string by storing it to the console
+; port, then sets the timer going and prints a line on three timer interrupts.
+;
+; Expected output:
+; Hello, devices
+; tick
+; tick
+; tick
+
+	LDI R0,Hello
+	LDI R1,Print         ; address of Print
+	CALL R1
+
+	LDI R0,0xF8          ; the timer's interrupt vector
+	LDI R1,Tick
+	ST R0,R1
+	LDI R5,1             ; unmask the timer
+
+	LDI R0,0xF7          ; timer port
+	LDI R1,4
+	ST R0,R1             ; an interrupt every 4 * 256 cycles from here on
+
+	LDI R0,Wait
+Wait:
+	JMP R0               ; nothing to do until the timer fires
+
+; Interrupt handler: prints a tick and halts after the last one. The registers
+; are restored by IRET so the count is kept in memory
+
+Tick:
+	LDI R0,TickText
+	LDI R1,Print
+	CALL R1
+
+	LDI R2,Count
+	LD R3,R2
+	DEC R3
+	ST R2,R3             ; one tick fewer to go
+
+	LDI R0,0
+	CMP R3,R0
+	LDI R0,Done
+	JEQ R0
+	IRET
+
+Done:
+	HLT
+
+; Subroutine: Print
+; R0 the address of a string that ends with a 0 byte
+; Changes R0, R1, R2 and R3
+
+Print:
+	LDI R2,0             ; 0 for the CMP
+	LDI R3,0xF6          ; console port
+
+PrintLoop:
+	LD R1,R0             ; next character
+	CMP R1,R2
+	LDI R1,PrintEnd
+	JEQ R1               ; done at the 0 byte
+
+	LD R1,R0
+	ST R3,R1             ; print it
+	INC R0
+
+	LDI R1,PrintLoop
+	JMP R1
+
+PrintEnd:
+	RET
+
+Count:
+	db 3
+
+Hello:
+	ds Hello, devices
+	db 0x0a
+	db 0
+
+TickText:
+	ds tick
+	db 0x0a
+	db 0
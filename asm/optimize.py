@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+
+# Peephole optimizer for LS-8 assembler source, used by asm.py -O
+#
+# The single pass assembler emits bytes as it reads them. The optimizer needs
+# to move code around, so it parses the source into a list of Items instead -
+# one per instruction or DS/DB - runs its passes over the list and only then
+# lays the code out and resolves the labels, at their new addresses.
+#
+# Passes:
+#
+#  * Unreachable code: instructions after HLT or JMP are removed up to the next
+#    label that some LDI refers to. DS and DB data is never touched.
+#  * Redundant LDI: an LDI is removed when its register already holds the
+#    value. Register contents are only tracked within straight-line code, any
+#    label or CALL forgets them, so the result holds on every path.
+#  * MUL by a power of two becomes SHL, when a register holding the shift count
+#    is at hand or the LDI that set the multiplier can be changed to load the
+#    shift count instead without anything noticing.
+#
+# The optimizer assumes the program doesn't read or modify its own code, and
+# that the addresses of its labels only go to jumps and calls - a program that
+# prints one or jumps to a number sees it change. It keeps the code after a RET
+# or IRET, which a return with nothing to return from can fall into, but such a
+# return that lands anywhere else can land somewhere different once the code
+# has moved.
+
+import sys
+
+import asm
+
+# Instructions after which execution never falls through to the next one. Not
+# RET or IRET - they take the pc off the stack, and without a CALL or an
+# interrupt to return from that can be the address of the very next instruction
+UNCONDITIONAL = {"HLT", "JMP"}
+
+# Instructions that write their first operand register
+WRITES_A = {"ADD", "SUB", "MUL", "DIV", "MOD", "AND", "OR", "XOR", "SHL",
+            "SHR", "NOT", "INC", "DEC", "LD", "POP"}
+
+# Instructions that change the stack pointer as well
+WRITES_SP = {"PUSH", "POP"}
+
+# Instructions after which nothing is known about any register - a
+# subroutine or interrupt handler can change all of them
+WRITES_ALL = {"CALL", "RET", "IRET", "INT"}
+
+# Instructions that read their first and second operand registers
+READS_A = {"ADD", "SUB", "MUL", "DIV", "MOD", "AND", "OR", "XOR", "SHL",
+           "SHR", "NOT", "INC", "DEC", "CMP", "ST", "PUSH", "PRN", "PRA",
+           "JMP", "JEQ", "JNE", "JGT", "JGE", "JLT", "JLE", "CALL", "INT"}
+READS_B = {"ADD", "SUB", "MUL", "DIV", "MOD", "AND", "OR", "XOR", "SHL",
+           "SHR", "CMP", "ST", "LD"}
+
+SP = 7
+
+
+class Item:
+    """One instruction, or the bytes of a DS or DB, plus the labels on it."""
+
+    def __init__(self, opcode, a=None, b=None, data=None, comment=None, line_num=0):
+        self.labels = []
+        self.opcode = opcode
+        self.a = a
+        self.b = b
+        self.data = data
+        self.comment = comment
+        self.line_num = line_num
+
+        # an LDI operand as written in the source, for the listing
+        self.b_text = None
+
+    def is_data(self):
+        return self.data is not None
+
+    def size(self):
+        if self.is_data():
+            return len(self.data)
+
+        op_type = asm.OPCODE_INFO[self.opcode][0]
+        return 3 if op_type == 8 else 1 + op_type
+
+    def text(self):
+        op_type = asm.OPCODE_INFO[self.opcode][0]
+
+        if op_type == 0:
+            return self.opcode
+        if op_type == 1:
+            return f"{self.opcode} R{self.a}"
+        if op_type == 2:
+            return f"{self.opcode} R{self.a},R{self.b}"
+
+        return f"{self.opcode} R{self.a},{self.b if self.b_text is None else self.b_text}"
+
+
+def parse(inputfile):
+    """
+    Read source into a list of Items. Returns (items, end_labels), end_labels
+    being the labels after the last item.
+
+    Every label reference is checked here, before any pass can remove the
+    code that holds it.
+    """
+
+    items = []
+    labels = []
+
+    for line_num, label, opcode, op_a, op_b, a, b, data in asm.statements(inputfile):
+        if label is not None:
+            labels.append(label)
+
+        if opcode is None:
+            continue
+
+        if opcode == 'BANK':
+            print(f"line {line_num}: the optimizer doesn't handle BANK sections, assemble without -O",
+                  file=sys.stderr)
+            sys.exit(2)
+
+        if data is not None:
+            # DS or DB, op_a is the argument as written
+            item = Item(opcode, data=data, comment=op_a, line_num=line_num)
+        else:
+            item = Item(opcode, a, b, line_num=line_num)
+
+            # a number, or the name of a label resolved during layout
+            if opcode == 'LDI' and isinstance(b, int):
+                item.b_text = op_b
+
+        item.labels = labels[:]
+        labels.clear()
+        items.append(item)
+
+    defined = {label: 0 for item in items for label in item.labels}
+    defined.update((label, 0) for label in labels)
+
+    for item in items:
+        if item.opcode == 'LDI' and isinstance(item.b, str):
+            asm.resolve(item.b, defined, {}, item.line_num)
+
+    return items, labels
+
+
+def remove(items, index):
+    """Remove an item, handing its labels on to the next one. Returns the labels left over at the end."""
+
+    item = items.pop(index)
+
+    if index < len(items):
+        items[index].labels[:0] = item.labels
+        return []
+
+    return item.labels
+
+
+def remove_unreachable(items, end_labels, report):
+    """Drop code that nothing can reach. Returns True if anything changed."""
+
+    changed = False
+
+    referenced = {item.b for item in items
+                  if item.opcode == "LDI" and isinstance(item.b, str)}
+
+    reachable = True
+    index = 0
+
+    while index < len(items):
+        item = items[index]
+
+        if any(label in referenced for label in item.labels):
+            reachable = True
+
+        if item.is_data():
+            # running into data is allowed to carry on into whatever follows it
+            reachable = True
+
+        elif not reachable:
+            report.append(f"line {item.line_num}: removed unreachable {item.text()}")
+            end_labels[:0] = remove(items, index)
+            changed = True
+            continue
+
+        elif item.opcode in UNCONDITIONAL:
+            reachable = False
+
+        index += 1
+
+    return changed
+
+
+def register_dead_after(items, index, reg):
+    """True if reg is written before it is read again, within straight-line code after items[index]."""
+
+    for item in items[index + 1:]:
+        if item.labels or item.is_data() or item.opcode in WRITES_ALL:
+            return False
+
+        reads = (item.opcode in READS_A and item.a == reg) or \
+                (item.opcode in READS_B and item.b == reg) or \
+                (reg == SP and item.opcode in WRITES_SP)
+
+        if reads:
+            return False
+
+        if item.opcode == "LDI" and item.a == reg:
+            return True
+
+        if item.opcode in WRITES_A and item.a == reg:
+            return True
+
+        # every way out of straight-line code could read the register
+        if item.opcode in UNCONDITIONAL or item.opcode.startswith("J"):
+            return False
+
+    return False
+
+
+def propagate_constants(items, report):
+    """Remove redundant LDIs and turn MUL by a power of two into SHL. Returns True if anything changed."""
+
+    changed = False
+
+    # register -> value (number or label name), and the index of the LDI that set it
+    known = {}
+    defined_at = {}
+
+    index = 0
+
+    while index < len(items):
+        item = items[index]
+        opcode = item.opcode
+
+        # anything could jump to a label, so nothing is known there
+        if item.labels or item.is_data():
+            known.clear()
+            defined_at.clear()
+
+        if item.is_data():
+            index += 1
+            continue
+
+        if opcode == "LDI":
+            if item.a in known and known[item.a] == item.b:
+                report.append(f"line {item.line_num}: removed {item.text()}, R{item.a} already holds {item.b}")
+                remove(items, index)
+                changed = True
+                continue
+
+            known[item.a] = item.b
+            defined_at[item.a] = index
+            index += 1
+            continue
+
+        if opcode == "MUL" and item.a != item.b and isinstance(known.get(item.b), int):
+            value = known[item.b]
+
+            if value and value & (value - 1) == 0:
+                shift = value.bit_length() - 1
+
+                # a register that already holds the shift count
+                holder = next((reg for reg, v in known.items() if v == shift and reg != item.a), None)
+
+                if holder is not None:
+                    report.append(f"line {item.line_num}: {item.text()} -> SHL R{item.a},R{holder}, R{holder} holds {shift}")
+                    item.opcode, item.b = "SHL", holder
+                    changed = True
+
+                elif item.b in defined_at and register_dead_after(items, index, item.b):
+                    ldi = items[defined_at[item.b]]
+                    report.append(f"line {item.line_num}: {item.text()} -> SHL R{item.a},R{item.b}, "
+                                  f"line {ldi.line_num} loads {shift} instead of {value}")
+                    ldi.b, ldi.b_text = shift, None
+                    known[item.b] = shift
+                    item.opcode = "SHL"
+                    changed = True
+
+        # reads of a register pin the value its LDI loaded
+        if opcode in READS_A:
+            defined_at.pop(item.a, None)
+        if opcode in READS_B:
+            defined_at.pop(item.b, None)
+
+        if opcode in WRITES_ALL:
+            known.clear()
+            defined_at.clear()
+
+        else:
+            if opcode in WRITES_A:
+                known.pop(item.a, None)
+                defined_at.pop(item.a, None)
+
+            if opcode in WRITES_SP:
+                known.pop(SP, None)
+                defined_at.pop(SP, None)
+
+        index += 1
+
+    return changed
+
+
+def optimize(items, end_labels):
+    """Run the passes until none of them finds anything more. Returns the report."""
+
+    report = []
+
+    changed = True
+    while changed:
+        changed = remove_unreachable(items, end_labels, report)
+        changed = propagate_constants(items, report) or changed
+
+    return report
+
+
+def layout(items, end_labels, listing=False):
+    """
+    Give every item its address, resolve the labels and emit the machine
+    code. Returns (machine_code, sym, notes) like asm.assemble().
+    """
+
+    sym = {}
+    address = 0
+
+    for item in items:
+        for label in item.labels:
+            sym[label] = address
+        address += item.size()
+
+    for label in end_labels:
+        sym[label] = address
+
+    machine_code = bytearray()
+    labels = {} if listing else None
+    comments = {} if listing else None
+
+    for item in items:
+        if listing:
+            if item.labels:
+                labels[len(machine_code)] = item.labels
+
+            if item.opcode == "DS":
+                for i, print_char in enumerate(item.comment, len(machine_code)):
+                    comments[i] = '[space]' if print_char == ' ' else print_char
+            elif item.is_data():
+                comments[len(machine_code)] = item.comment
+            else:
+                comments[len(machine_code)] = item.text()
+
+        if item.is_data():
+            machine_code += item.data
+            continue
+
+        op_type, op_byte = asm.OPCODE_INFO[item.opcode]
+        machine_code.append(op_byte)
+
+        if op_type == 1:
+            machine_code.append(item.a)
+
+        elif op_type == 2:
+            machine_code += bytes((item.a, item.b))
+
+        elif op_type == 8:
+            b = item.b
+
+            if isinstance(b, str):
+                b = asm.resolve(b, sym, {}, item.line_num)
+
+            machine_code += bytes((item.a, b & 0xff))
+
+    if listing and end_labels:
+        labels[len(machine_code)] = end_labels
+
+    notes = (labels, comments) if listing else None
+
+    return machine_code, sym, notes
+
+
+def assemble(inputfile, listing=False, report_file=sys.stderr):
+    """
+    Assemble with the optimizer, printing what it changed to report_file.
+    Returns (machine_code, sym, notes) like asm.assemble().
+    """
+
+    items, end_labels = parse(inputfile)
+    before = sum(item.size() for item in items)
+
+    report = optimize(items, end_labels)
+    machine_code, sym, notes = layout(items, end_labels, listing)
+
+    if report_file is not None:
+        for line in report:
+            print(f"optimizer: {line}", file=report_file)
+        print(f"optimizer: {before} -> {len(machine_code)} bytes", file=report_file)
+
+    return machine_code, sym, notes
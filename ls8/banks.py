@@ -0,0 +1,131 @@
+"""Banked memory for the LS-8."""
+
+# With 8 bit addresses the LS-8 can only see 256 bytes. Banked memory gives it
+# more: a window of the address space - 80-BF unless configured otherwise -
+# shows one of 256 pages at a time, and storing a page number to the bank
+# select port at F5 (a reserved address in the spec) picks which one.
+#
+#   cpu = CPU()
+#   BankedMemory(cpu)
+#   cpu.load("examples/banks.ls8")
+#   cpu.run()
+#
+#   LDI R0,0xF5
+#   LDI R1,3
+#   ST R0,R1        ; bank 3 is at 80-BF from here on
+#
+# The page that is mapped in lives in the window of cpu.ram itself, and a bank
+# switch copies the window out to its page and the new page in. Everything else
+# - LD, ST, the stack, the decode caches, the translator - keeps seeing a plain
+# bytearray, so an access is still a single index and nothing costs more unless
+# it switches banks. The port is a device on the cpu's memory bus (see bus.py),
+# so stores to it are noticed through the code map that ram_write already
+# checks and the write path has no extra test either.
+#
+# Pages start out as zeros and take no memory until a bank is switched away from
+# with something written in it, so memory grows with the pages actually used
+# rather than with the 256 that can be addressed.
+#
+# Snapshots and forks hold the bank mapped in and every page that has been
+# allocated along with the 256 bytes the cpu can see, see snapshot.py.
+
+from bus import connect
+
+# where the bank number is stored to
+BANK_SELECT = 0xF5
+
+# the part of the address space that is banked, must match BANK_WINDOW and BANK_SIZE in asm/asm.py
+WINDOW = 0x80
+PAGE_SIZE = 0x40
+
+BANKS = 0x100
+
+
+class BankedMemory:
+    """Pages of memory switched into a window of a CPU's ram."""
+
+    def __init__(self, cpu, window=WINDOW, size=PAGE_SIZE, port=BANK_SELECT):
+        if size <= 0 or window + size > len(cpu.ram) or window <= port < window + size:
+            raise ValueError(f"a {size} byte window at {window:02X} doesn't fit around the port at {port:02X}")
+
+        self.cpu = cpu
+        self.start = window
+        self.end = window + size
+        self.size = size
+        self.port = port
+
+        # bank -> bytearray for every bank that has been written to. the page of the bank
+        # mapped in is out of date - its bytes are in the window - until it is switched out
+        self.pages = {}
+        self.blank = bytes(size)
+
+        # the bank mapped in, as of the last store to the port
+        self.bank = cpu.ram[port]
+        self.switches = 0
+
+        connect(cpu).attach(self, port, write=self.written)
+        cpu.banks = self
+
+    def written(self, value, address):
+        self.switch(value)
+
+    def switch(self, bank):
+        """Map bank into the window."""
+
+        if bank == self.bank:
+            return
+
+        cpu = self.cpu
+        ram = cpu.ram
+        start, end = self.start, self.end
+
+        # the page going out keeps what was written to it - the first write allocates it
+        page = self.pages.get(self.bank)
+        if page is not None:
+            page[:] = ram[start:end]
+        elif ram[start:end] != self.blank:
+            self.pages[self.bank] = ram[start:end]
+
+        incoming = self.pages.get(bank, self.blank)
+
+        # any cached code built from the window is about to change under it
+        if 1 in cpu.code_map[start:end]:
+            for address in range(start, end):
+                if cpu.code_map[address] and ram[address] != incoming[address - start]:
+                    cpu.invalidate(address)
+
+        ram[start:end] = incoming
+        self.bank = bank
+        self.switches += 1
+
+    def preload(self, bank, data):
+        """Put data at the start of bank's page, as the loader does for a program's BANK sections."""
+
+        if len(data) > self.size:
+            raise ValueError(f"{len(data)} bytes don't fit in a {self.size} byte page")
+
+        if bank == self.bank:
+            for offset, value in enumerate(data):
+                self.cpu.ram_write(value, self.start + offset)
+            return
+
+        page = self.pages.setdefault(bank, bytearray(self.size))
+        page[:len(data)] = data
+
+    def read(self, bank, address):
+        """The byte at address (in the window) of bank, whether it is mapped in or not."""
+
+        if bank == self.bank:
+            return self.cpu.ram[address]
+
+        page = self.pages.get(bank)
+        return 0 if page is None else page[address - self.start]
+
+    def stats(self):
+        return {
+            "bank": self.bank,
+            "switches": self.switches,
+            "pages": len(self.pages),
+            "bytes": len(self.pages) * self.size,
+            "capacity": BANKS * self.size,
+        }
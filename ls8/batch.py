@@ -0,0 +1,128 @@
+"""Run many LS-8 programs in parallel and summarize the results."""
+
+import csv
+import glob
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cpu import CPU
+from devices import KeyboardDevice, OutputDevice
+
+# columns of the summary, in the order they are written to csv
+FIELDS = ["program", "status", "cycles", "wall_time", "pc", "fl", "registers", "error", "output"]
+
+
+def expand_programs(patterns):
+    """
+    Turn the command line arguments into a list of program files. Each argument
+    is either a file or a glob such as examples/*.ls8.
+    """
+
+    programs = []
+
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+
+        if not matches and os.path.exists(pattern):
+            matches = [pattern]
+
+        programs.extend(matches)
+
+    return programs
+
+
+def run_program(program, max_cycles=None, timeout=None, input_file=None, watchdog=False):
+    """
+    Run one program to completion in the current process and return a summary
+    dict. Stops the program after max_cycles instructions or timeout seconds,
+    or with watchdog when its stack runs into its code. The contents of
+    input_file, if given, are typed on the keyboard.
+    """
+
+    # output is captured straight into memory, never going near sys.stdout
+    output = io.BytesIO()
+    cpu = CPU(OutputDevice(output, threshold=1 << 16, interval=float("inf")))
+    error = ""
+
+    keyboard = None
+    if input_file is not None:
+        keyboard = KeyboardDevice(cpu, open(input_file, "rb"))
+
+    start = time.perf_counter()
+
+    try:
+        if not os.path.exists(program):
+            raise FileNotFoundError(program)
+
+        cpu.load(program)
+
+        # the run loop only looks at the clock between slices, so a runaway program
+        # costs nothing extra per instruction and can't hold on to its worker
+        deadline = None if timeout is None else time.monotonic() + timeout
+        result = cpu.run(max_cycles, deadline, watchdog)
+        status = result.reason
+        if result.error is not None:
+            error = f"{type(result.error).__name__}: {result.error}"
+
+    except Exception as e:
+        status = "error"
+        error = f"{type(e).__name__}: {e}"
+
+    finally:
+        if keyboard is not None:
+            keyboard.source.close()
+
+    wall_time = time.perf_counter() - start
+
+    return {
+        "program": program,
+        "status": status,
+        "cycles": cpu.cycles,
+        "wall_time": round(wall_time, 6),
+        "pc": cpu.pc,
+        "fl": cpu.fl,
+        "registers": list(cpu.reg),
+        "error": error,
+        "output": output.getvalue().decode("latin-1"),
+    }
+
+
+def run_batch(programs, jobs=None, max_cycles=None, timeout=None, input_file=None, watchdog=False):
+    """Run every program in a process pool. Results come back in input order."""
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_program, program, max_cycles, timeout, input_file, watchdog)
+                   for program in programs]
+
+        return [future.result() for future in futures]
+
+
+def write_summary(results, filename):
+    """Write the results as json, or as csv if the filename ends in .csv"""
+
+    with open(filename, "w", newline="") as file:
+        if filename.endswith(".csv"):
+            writer = csv.DictWriter(file, fieldnames=FIELDS)
+            writer.writeheader()
+
+            for result in results:
+                row = dict(result)
+                row["registers"] = " ".join(f"{r:02X}" for r in result["registers"])
+                writer.writerow(row)
+        else:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+
+
+def print_table(results):
+    """Print a one line report per program."""
+
+    for result in results:
+        print(f"{result['status']:<14} {result['cycles']:>12} cycles "
+              f"{result['wall_time']:>10.4f}s  {result['program']}")
+
+        if result["error"]:
+            print(f"{'':<14} {result['error']}")
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+"""Emulator benchmarks with baseline regression tracking."""
+
+# Micro benchmarks exercise one class of instruction each (ALU, stack,
+# branches, CALL/RET) in a long loop. Macro benchmarks take the programs in
+# asm/ and run them over and over until they have executed a fixed number of
+# instructions. Every benchmark is run on each execution engine and reported
+# as instructions per second, next to program load time and startup time.
+# The memory and device micro benchmarks run a second time with the memory
+# mapped devices attached (the "+bus" figures), which shows what the bus costs
+# plain ram accesses and what a device access costs over a plain one.
+#
+#   python benchmark.py                       # run and print
+#   python benchmark.py -o results.json       # also save the results
+#   python benchmark.py --baseline base.json --threshold 0.1
+#
+# With --baseline, any figure more than threshold worse than the baseline is
+# reported and the exit status is 1.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from cpu import CPU
+from devices import ConsoleDevice, CounterDevice, NullSink, OutputDevice, TimerDevice
+from translator import BlockTranslator
+from journal import Journal
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ASM_DIR = os.path.join(HERE, "..", "asm")
+
+sys.path.insert(0, ASM_DIR)
+import asm  # noqa: E402
+
+# The counting loop shared by the micro benchmarks. R4 counts the outer loop up
+# from 256 - outer to 0, R0 counts the inner loop through all 256 values. {body}
+# is the code under test and must leave R0, R1, R2, R4 and R6 alone.
+LOOP = """
+    LDI R1,1
+    LDI R2,0
+    LDI R4,{start}
+    LDI R6,Outer
+Outer:
+    LDI R0,0
+Inner:
+{body}
+    ADD R0,R1
+    CMP R0,R2
+    LDI R3,Inner
+    JNE R3
+    ADD R4,R1
+    CMP R4,R2
+    JNE R6
+    HLT
+{subroutines}
+"""
+
+MICRO = {
+    "alu": ("""
+    LDI R5,3
+    MUL R5,R5
+    AND R5,R0
+    OR R5,R1
+    XOR R5,R0
+    SHL R5,R1
+    SHR R5,R1
+    NOT R5
+""", ""),
+    "stack": ("""
+    PUSH R0
+    PUSH R1
+    POP R5
+    POP R3
+    PUSH R4
+    POP R5
+""", ""),
+    "branch": ("""
+    LDI R5,Skip
+    CMP R0,R1
+    JEQ R5
+    JMP R5
+Skip:
+""", ""),
+    "call": ("""
+    LDI R5,Leaf
+    CALL R5
+    CALL R5
+""", """
+Leaf:
+    RET
+"""),
+    "memory": ("""
+    LDI R5,0x80
+    ST R5,R0
+    LD R3,R5
+    ST R5,R4
+    LD R3,R5
+""", ""),
+    # the console and the counter with the devices attached, plain ram without
+    "devices": ("""
+    LDI R5,0xF6
+    ST R5,R0
+    LDI R5,0xF7
+    LD R3,R5
+""", ""),
+}
+
+# micro benchmarks that are also run with the devices on the memory bus
+BUS_MICRO = ["memory", "devices"]
+
+# programs from asm/ used as macro benchmarks
+MACRO = ["call", "mult", "stack", "sctest"]
+
+# engine name -> function that sets the engine up on a cpu and returns its run function
+ENGINES = {
+    "interpreter": lambda cpu: cpu.run,
+    "blocks": lambda cpu: BlockTranslator(cpu).run,
+    "journal": lambda cpu: Journal(cpu).run,
+}
+
+
+def assemble_source(source):
+    """Assemble source text into bytes"""
+    machine_code, sym, notes = asm.assemble(source.splitlines())
+    return bytes(machine_code)
+
+
+def micro_program(name, outer):
+    body, subroutines = MICRO[name]
+    return assemble_source(LOOP.format(start=256 - outer, body=body, subroutines=subroutines))
+
+
+def macro_program(name):
+    with open(os.path.join(ASM_DIR, name + ".asm")) as f:
+        return assemble_source(f.read())
+
+
+def measure(image, engine, min_instructions, devices=False):
+    """
+    Run image over and over on one machine until min_instructions have run, and
+    return instructions per second. Between runs the registers and ram are put
+    back to their power on state, but the engine keeps its warm caches as long
+    as the program's code is unchanged - so short programs turn into one long
+    running loop. With devices the machine has the console, timer and counter
+    on its memory bus.
+    """
+
+    instructions = 0
+    elapsed = 0.0
+    cpu = None
+
+    while instructions < min_instructions:
+        if cpu is None or cpu.ram[:len(image)] != image:
+            cpu = CPU(OutputDevice(NullSink()))
+            # no host timer - starting and joining its thread on every short rerun would be most of what gets measured
+            cpu.interrupts.timer_interval = None
+            if devices:
+                ConsoleDevice(cpu)
+                TimerDevice(cpu)
+                CounterDevice(cpu)
+            run = ENGINES[engine](cpu)
+
+        cpu.ram[:] = bytes(len(cpu.ram))
+        cpu.ram[:len(image)] = image
+        cpu.reg[:] = bytes(8)
+        cpu.reg[7] = 0xF4
+        cpu.pc = 0
+        cpu.fl = 0
+        cpu.cycles = 0
+        cpu.running = True
+
+        start = time.perf_counter()
+        run()
+        elapsed += time.perf_counter() - start
+
+        instructions += cpu.cycles
+
+    return instructions / elapsed
+
+
+def measure_load(repeat=200):
+    """Seconds to load a program, as text and as a binary image"""
+
+    import tempfile
+    from image import write_image
+
+    image = macro_program("printstr")
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        text = os.path.join(tmp, "program.ls8")
+        binary = os.path.join(tmp, "program.ls8b")
+
+        with open(text, "w") as f:
+            asm.write_text(f, image)
+        write_image(binary, image)
+
+        for name, path in (("load_text", text), ("load_binary", binary)):
+            cpu = CPU()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                cpu.load(path)
+            results[name] = (time.perf_counter() - start) / repeat
+
+    return results
+
+
+def measure_startup(repeat=5):
+    """Seconds for a fresh interpreter process to run print8.ls8"""
+
+    program = os.path.join(HERE, "examples", "print8.ls8")
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(HERE, "ls8.py"), program],
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def run_benchmarks(min_instructions, outer, engines):
+    results = {"ips": {}, "time": {}}
+
+    for engine in engines:
+        for name in MICRO:
+            results["ips"][f"micro/{name}/{engine}"] = measure(micro_program(name, outer), engine, min_instructions)
+
+        for name in BUS_MICRO:
+            results["ips"][f"micro/{name}+bus/{engine}"] = measure(micro_program(name, outer), engine, min_instructions, True)
+
+        for name in MACRO:
+            results["ips"][f"macro/{name}/{engine}"] = measure(macro_program(name), engine, min_instructions)
+
+    results["time"].update(measure_load())
+    results["time"]["startup"] = measure_startup()
+
+    results["python"] = platform.python_version()
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a list of regressions - lower ips or higher times than baseline allows"""
+
+    regressions = []
+
+    for name, ips in results["ips"].items():
+        old = baseline.get("ips", {}).get(name)
+        if old and ips < old * (1 - threshold):
+            regressions.append(f"{name}: {ips:,.0f} ips, baseline {old:,.0f} ({ips / old - 1:+.1%})")
+
+    for name, seconds in results["time"].items():
+        old = baseline.get("time", {}).get(name)
+        if old and seconds > old * (1 + threshold):
+            regressions.append(f"{name}: {seconds * 1000:.3f} ms, baseline {old * 1000:.3f} ms ({seconds / old - 1:+.1%})")
+
+    return regressions
+
+
+def print_results(results):
+    for name, ips in results["ips"].items():
+        print(f"{name:<28} {ips:>14,.0f} instructions/s")
+
+    for name, seconds in results["time"].items():
+        print(f"{name:<28} {seconds * 1000:>14.3f} ms")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the LS-8 emulator")
+    parser.add_argument("-o", "--output", help="save results as json")
+    parser.add_argument("--baseline", help="json results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown as a fraction (default 0.10)")
+    parser.add_argument("--instructions", type=int, default=1_000_000, help="instructions per benchmark")
+    parser.add_argument("--outer", type=int, default=16, help="outer loop count of the micro benchmarks")
+    parser.add_argument("--engine", action="append", choices=sorted(ENGINES), help="engines to run (default all)")
+    args = parser.parse_args(argv[1:])
+
+    results = run_benchmarks(args.instructions, args.outer, args.engine or list(ENGINES))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold)
+
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+
+        print(f"\nno regressions beyond {args.threshold:.0%}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,137 @@
+"""Memory mapped I/O for the LS-8."""
+
+# Devices take over addresses of the cpu's memory through a MemoryBus. Each one
+# gives the address range it answers on and a function for stores, for loads,
+# or both:
+#
+#   bus = connect(cpu)
+#   bus.attach(device, 0xF6, write=device.write)
+#   bus.attach(other, 0xF7, read=other.read)
+#
+#   LDI R0,0xF6
+#   LDI R1,65
+#   ST R0,R1        ; device.write(65, 0xF6)
+#
+# The bus keeps a 256 entry table per direction with the device function for
+# every address, None where the address is plain ram. Nothing is looked up on
+# the way to plain ram that wasn't already:
+#
+# - stores: a device's addresses are marked in cpu.code_map, the bitmap
+#   ram_write checks anyway, and only a marked store goes on to the bus.
+# - loads: LD is the only instruction a device can answer - instruction fetch,
+#   the stack and the vector table always see ram. Until a device that answers
+#   loads is attached the cpu's own LD runs untouched; after that the bus puts
+#   its LD in the branchtable, which costs one table lookup per load.
+#
+# Whatever a device returns is also stored in ram, so memory dumps, snapshots
+# and the translator see the last value read. Devices aren't part of a snapshot
+# and a fork has none attached.
+
+from opcodes import OPCODES
+
+# the opcode the bus takes over once a device answers loads
+LD = next(IR for IR, opcode in OPCODES.items() if opcode.name == "LD")
+
+
+class MemoryBus:
+    """Routes loads and stores at device addresses to the devices."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+
+        # (device, start, end) for everything attached, in order
+        self.devices = []
+
+        # address -> the function a load or a store there goes to, None for plain ram
+        self.readers = [None] * len(cpu.ram)
+        self.writers = [None] * len(cpu.ram)
+        # addresses of devices that neither load nor store through the bus
+        self.reserved = set()
+
+        self.reads = 0
+        self.writes = 0
+
+        cpu.bus = self
+
+    def attach(self, device, start, end=None, read=None, write=None):
+        """
+        Map device onto start..end (exclusive, just start if end isn't given).
+        A load there returns read(address) and a store calls write(value, address)
+        after the value is in ram. One device can answer loads and another stores
+        at the same address. A device with neither only reserves the addresses,
+        so nothing else can be attached there.
+        """
+
+        cpu = self.cpu
+        end = start + 1 if end is None else end
+
+        if not 0 <= start < end <= len(cpu.ram):
+            raise ValueError(f"{start:02X}-{end - 1:02X} is outside of memory")
+
+        for address in range(start, end):
+            if (address in self.reserved
+                    or (read is not None or write is None) and self.readers[address] is not None
+                    or (write is not None or read is None) and self.writers[address] is not None):
+                raise ValueError(f"{type(device).__name__} overlaps a device already at {address:02X}")
+
+        for address in range(start, end):
+            if read is not None:
+                self.readers[address] = read
+            if write is not None:
+                self.writers[address] = write
+                cpu.code_map[address] = 1
+            if read is None and write is None:
+                self.reserved.add(address)
+
+        self.devices.append((device, start, end))
+
+        if read is not None and cpu.branchtable[LD] != self.LD:
+            cpu.branchtable[LD] = self.LD
+
+            # everything decoded so far holds the cpu's own LD - the translator hears about it
+            # through the code listeners
+            cpu.decoded[:] = [None] * len(cpu.decoded)
+            cpu.fused[:] = [None] * len(cpu.fused)
+            for address in range(len(cpu.ram)):
+                if cpu.code_map[address]:
+                    cpu.invalidate(address)
+
+    # called by ram_write for addresses marked in the code map, which is code as well as devices
+    def write(self, value, address):
+        writer = self.writers[address]
+        if writer is not None:
+            self.writes += 1
+            writer(value, address)
+
+    def read(self, address):
+        """What a load from address gets, from the device there or from ram."""
+
+        reader = self.readers[address]
+        if reader is None:
+            return self.cpu.ram[address]
+
+        self.reads += 1
+        value = reader(address) & 0xFF
+        self.cpu.ram[address] = value
+        return value
+
+    # takes the cpu's place in the branchtable once a device answers loads
+    def LD(self, register_a, register_b):
+        cpu = self.cpu
+        address = cpu.reg[register_b]
+        if self.readers[address] is None:
+            cpu.reg[register_a] = cpu.ram[address]
+        else:
+            cpu.reg[register_a] = self.read(address)
+
+    def stats(self):
+        return {
+            "devices": [(type(device).__name__, start, end) for device, start, end in self.devices],
+            "reads": self.reads,
+            "writes": self.writes,
+        }
+
+
+def connect(cpu):
+    """The cpu's bus, which is made the first time a device asks for it."""
+    return cpu.bus if cpu.bus is not None else MemoryBus(cpu)
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+
+"""Control flow graph and basic block analysis of LS-8 programs."""
+
+# Every jump on the LS-8 goes through a register, so the targets are not in the
+# instructions themselves. The analysis follows the code from the entry point
+# and tracks what each register holds at every instruction - starting from the
+# power on state, where every register is known - so LDI R2,Label; JMP R2 has a
+# known target. Where paths meet with different values the register becomes
+# unknown, so everything found holds on every path. Handlers stored in the
+# interrupt vector table with ST are followed as well.
+#
+# After a CALL only the registers the subroutine (or anything it calls) writes
+# are forgotten. Those sets are found by repeating the whole analysis until they
+# stop growing. R6 holds the interrupt status, which the hardware sets at any
+# time, so it is never known.
+#
+#   python cfg.py examples/sctest.ls8 -o sctest.json --dot sctest.dot
+#
+# The emulator takes the block map back at load time, so its caches are warm
+# before the first instruction:
+#
+#   cpu.load("examples/sctest.ls8", blocks=load_block_map("sctest.json"))
+#   BlockTranslator(cpu, blocks=load_block_map("sctest.json"))
+
+import argparse
+import json
+import sys
+
+from interrupts import VECTOR_TABLE
+from opcodes import OPCODES
+
+CONDITIONAL = {"JEQ", "JNE", "JGT", "JGE", "JLT", "JLE"}
+
+# instructions that never fall through to the next one
+STOPS = {"HLT", "JMP", "RET", "IRET"}
+
+# register results of the instructions the analysis can evaluate, masked like the cpu does
+EVALUATE = {
+    "ADD": lambda x, y: (x + y) & 0xFF,
+    "MUL": lambda x, y: (x * y) & 0xFF,
+    "AND": lambda x, y: x & y,
+    "OR":  lambda x, y: x | y,
+    "XOR": lambda x, y: x ^ y,
+    "SHL": lambda x, y: (x << y) & 0xFF,
+    "SHR": lambda x, y: x >> y,
+    "SUB": lambda x, y: (x - y) & 0xFF,
+    "DIV": lambda x, y: x // y if y else None,
+    "MOD": lambda x, y: x % y if y else None,
+}
+
+# registers after the power on reset - all clear and the stack pointer at F4
+RESET = (0, 0, 0, 0, 0, 0, None, 0xF4)
+UNKNOWN = (None,) * 8
+EVERYTHING = frozenset(range(8))
+
+
+def meet(x, y):
+    """Registers that hold the same value on both paths, None for the rest."""
+    return tuple(a if a == b else None for a, b in zip(x, y))
+
+
+class ControlFlowGraph:
+    """Basic blocks, edges and loops of one program."""
+
+    def __init__(self, ram, entry=0):
+        self.ram = bytes(ram)
+        self.entry = entry
+
+        # address -> (name, operand_a, operand_b, size) for every instruction reached
+        self.instructions = {}
+        # address -> registers known before the instruction runs
+        self.states = {}
+        # address -> [(target, kind)], kind being fall, jump, branch, call or return
+        self.edges = {}
+        # addresses of jumps and calls whose target register isn't known
+        self.unresolved = set()
+        # vector table address -> handler address
+        self.interrupts = {}
+        # addresses that hold bytes the cpu would reject
+        self.invalid = set()
+        # subroutine address -> registers it can change before returning
+        self.clobbers = {}
+
+        # the sets are only ever grown, so the rounds stop once no call changes anything new.
+        # a subroutine that clobbers the register it was called through is no longer a call
+        # target in the next round, so targets are kept once seen - dropping them would
+        # bring back the round before and go round forever
+        while True:
+            self.explore()
+            clobbers = dict(self.clobbers)
+            for target in self.call_targets():
+                clobbers[target] = self.clobbered(target) | clobbers.get(target, frozenset())
+            if clobbers == self.clobbers:
+                break
+            self.clobbers = clobbers
+
+        self.blocks = self.build_blocks()
+        self.loops = self.find_loops()
+
+    # -- disassembly and constant propagation -- #
+
+    def decode(self, address):
+        opcode = OPCODES.get(self.ram[address])
+
+        if opcode is None:
+            return None
+
+        # operands wrap round to the start of ram like the cpu's do
+        name, size = opcode.name, opcode.size
+        a = self.ram[(address + 1) & 0xFF] if size > 1 else 0
+        b = self.ram[(address + 2) & 0xFF] if size > 2 else 0
+
+        # and the cpu won't run an instruction naming a register past R7 either
+        if opcode.registers and (a > 7 or opcode.registers > 1 and b > 7):
+            return None
+
+        return name, a, b, size
+
+    def explore(self):
+        self.instructions, self.states, self.edges = {}, {}, {}
+        self.unresolved, self.interrupts, self.invalid = set(), {}, set()
+
+        worklist = [(self.entry, RESET)]
+
+        while worklist:
+            address, state = worklist.pop()
+
+            if address >= len(self.ram):
+                continue
+
+            old = self.states.get(address)
+            if old is not None:
+                state = meet(old, state)
+                if state == old:
+                    continue
+            self.states[address] = state
+
+            instruction = self.decode(address)
+            if instruction is None:
+                self.invalid.add(address)
+                continue
+
+            self.instructions[address] = instruction
+
+            successors = self.transfer(address, instruction, state)
+            self.edges[address] = [(target, kind) for target, kind, _ in successors]
+
+            for target, _, target_state in successors:
+                worklist.append((target, target_state))
+
+    def transfer(self, address, instruction, state):
+        """Returns [(target, kind, registers at the target)] for one instruction."""
+
+        name, a, b, size = instruction
+        following = (address + size) & 0xFF
+
+        reg = list(state)
+
+        if name == "LDI":
+            reg[a] = b
+
+        elif name in EVALUATE:
+            x, y = reg[a], reg[b]
+            reg[a] = None if x is None or y is None else EVALUATE[name](x, y)
+
+        elif name == "NOT":
+            reg[a] = None if reg[a] is None else ~reg[a] & 0xFF
+
+        elif name in ("INC", "DEC"):
+            step = 1 if name == "INC" else -1
+            reg[a] = None if reg[a] is None else (reg[a] + step) & 0xFF
+
+        elif name == "LD":
+            reg[a] = None
+
+        elif name == "PUSH":
+            reg[7] = None if reg[7] is None else (reg[7] - 1) & 0xFF
+
+        elif name == "POP":
+            reg[a] = None
+            if a != 7:
+                reg[7] = None if reg[7] is None else (reg[7] + 1) & 0xFF
+
+        elif name == "ST":
+            # storing a known address in the vector table installs an interrupt handler
+            if reg[a] is not None and reg[a] >= VECTOR_TABLE and reg[b] is not None:
+                self.interrupts[reg[a]] = reg[b]
+                return [(following, "fall", tuple(reg[:8])), (reg[b], "interrupt", UNKNOWN)]
+
+        reg[6] = None
+        target = reg[a]
+
+        if name in ("HLT", "RET", "IRET"):
+            return []
+
+        if name == "JMP":
+            if target is None:
+                self.unresolved.add(address)
+                return []
+            return [(target, "jump", tuple(reg[:8]))]
+
+        if name in CONDITIONAL:
+            if target is None:
+                self.unresolved.add(address)
+                return [(following, "fall", tuple(reg[:8]))]
+            return [(target, "branch", tuple(reg[:8])), (following, "fall", tuple(reg[:8]))]
+
+        if name == "CALL":
+            if target is None:
+                self.unresolved.add(address)
+                return [(following, "return", UNKNOWN)]
+
+            # a subroutine not seen yet is assumed to change nothing until the next round
+            returned = list(reg)
+            for register in self.clobbers.get(target, ()):
+                returned[register] = None
+            return [(target, "call", UNKNOWN), (following, "return", tuple(returned[:8]))]
+
+        return [(following, "fall", tuple(reg[:8]))]
+
+    def call_targets(self):
+        return {target for edges in self.edges.values() for target, kind in edges if kind == "call"}
+
+    def clobbered(self, start):
+        """Registers the subroutine at start can change, including in the ones it calls."""
+
+        registers = {7}
+        seen = set()
+        stack = [start]
+
+        while stack:
+            address = stack.pop()
+            if address in seen:
+                continue
+            seen.add(address)
+
+            if address not in self.instructions or address in self.unresolved:
+                return EVERYTHING
+
+            name, a, _, _ = self.instructions[address]
+            if name in EVALUATE or name in ("LDI", "LD", "NOT", "INC", "DEC", "POP"):
+                registers.add(a)
+
+            for target, kind in self.edges[address]:
+                if kind == "call":
+                    registers |= self.clobbers.get(target, set())
+                elif kind != "interrupt":
+                    stack.append(target)
+
+        return frozenset(registers)
+
+    # -- blocks -- #
+
+    def build_blocks(self):
+        """Returns {start: [instruction addresses]} for every basic block."""
+
+        leaders = {self.entry} & self.instructions.keys()
+
+        for address, edges in self.edges.items():
+            name = self.instructions[address][0]
+            for target, kind in edges:
+                if kind != "fall" or name in CONDITIONAL:
+                    leaders.add(target)
+
+        leaders &= self.instructions.keys()
+
+        blocks = {}
+        for start in sorted(leaders):
+            addresses = []
+            address = start
+
+            while True:
+                addresses.append(address)
+                name, _, _, size = self.instructions[address]
+                edges = self.edges[address]
+
+                following = address + size
+                falls = [target for target, kind in edges if kind == "fall"]
+
+                if name in STOPS or name in CONDITIONAL or name == "CALL" or not falls:
+                    break
+                if following in leaders or following not in self.instructions:
+                    break
+
+                address = following
+
+            blocks[start] = addresses
+
+        return blocks
+
+    def block_end(self, start):
+        last = self.blocks[start][-1]
+        return last + self.instructions[last][3]
+
+    def successors(self, start):
+        """[(target block, kind)] of a block."""
+        # an ST can install a handler from the middle of a block, everything else ends one
+        edges = [edge for address in self.blocks[start][:-1] for edge in self.edges[address] if edge[1] == "interrupt"]
+        edges += self.edges[self.blocks[start][-1]]
+        return [(target, kind) for target, kind in edges if target in self.blocks]
+
+    def block_map(self):
+        """[(start, end)] of every block, what CPU.load and BlockTranslator take."""
+        return [(start, self.block_end(start)) for start in self.blocks]
+
+    # -- loops -- #
+
+    def dominators(self):
+        """{block: set of blocks that dominate it}, over the blocks reachable from the roots."""
+
+        roots = [self.entry] + [h for h in self.interrupts.values() if h in self.blocks]
+        roots += [t for s in self.blocks for t, kind in self.successors(s) if kind == "call"]
+        roots = [r for r in dict.fromkeys(roots) if r in self.blocks]
+
+        predecessors = {start: set() for start in self.blocks}
+        for start in self.blocks:
+            for target, kind in self.successors(start):
+                if kind not in ("call", "interrupt"):
+                    predecessors[target].add(start)
+
+        every = set(self.blocks)
+        dominators = {start: set(every) for start in self.blocks}
+        for root in roots:
+            dominators[root] = {root}
+
+        changed = True
+        while changed:
+            changed = False
+            for start in sorted(self.blocks):
+                if start in roots or not predecessors[start]:
+                    continue
+                new = set.intersection(*(dominators[p] for p in predecessors[start])) | {start}
+                if new != dominators[start]:
+                    dominators[start] = new
+                    changed = True
+
+        return dominators, predecessors
+
+    def find_loops(self):
+        """Natural loops as [{"header", "blocks", "back_edges"}], one per header."""
+
+        dominators, predecessors = self.dominators()
+        loops = {}
+
+        for start in self.blocks:
+            for target, kind in self.successors(start):
+                if kind in ("call", "interrupt") or target not in dominators[start]:
+                    continue
+
+                # a back edge - everything that reaches its tail without passing the header is in the loop
+                loop = loops.setdefault(target, {"header": target, "blocks": {target}, "back_edges": []})
+                loop["back_edges"].append((start, target))
+
+                stack = [start]
+                while stack:
+                    block = stack.pop()
+                    if block not in loop["blocks"]:
+                        loop["blocks"].add(block)
+                        stack.extend(predecessors[block])
+
+        return [dict(loop, blocks=sorted(loop["blocks"])) for _, loop in sorted(loops.items())]
+
+    # -- output -- #
+
+    def text(self, address):
+        name, a, b, size = self.instructions[address]
+        if name == "LDI":
+            return f"LDI R{a},0x{b:02X}"
+        if size == 3:
+            return f"{name} R{a},R{b}"
+        if size == 2:
+            return f"{name} R{a}"
+        return name
+
+    def to_json(self):
+        return {
+            "entry": self.entry,
+            "blocks": [
+                {
+                    "start": start,
+                    "end": self.block_end(start),
+                    "instructions": [[address, self.text(address)] for address in addresses],
+                    "successors": [{"target": target, "kind": kind} for target, kind in self.successors(start)],
+                }
+                for start, addresses in sorted(self.blocks.items())
+            ],
+            "loops": [
+                {"header": loop["header"], "blocks": loop["blocks"], "back_edges": [list(e) for e in loop["back_edges"]]}
+                for loop in self.loops
+            ],
+            "interrupts": {f"0x{vector:02X}": handler for vector, handler in sorted(self.interrupts.items())},
+            "unresolved": sorted(self.unresolved),
+            "invalid": sorted(self.invalid),
+        }
+
+    def to_dot(self):
+        headers = {loop["header"] for loop in self.loops}
+        lines = ["digraph cfg {", '    node [shape=box fontname="monospace"];']
+
+        for start, addresses in sorted(self.blocks.items()):
+            label = "".join(f"{address:02X}: {self.text(address)}\\l" for address in addresses)
+            style = " style=bold" if start in headers else ""
+            lines.append(f'    b{start:02X} [label="{label}"{style}];')
+
+        for start in sorted(self.blocks):
+            for target, kind in self.successors(start):
+                style = " style=dashed" if kind in ("call", "interrupt", "return") else ""
+                lines.append(f'    b{start:02X} -> b{target:02X} [label="{kind}"{style}];')
+
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+
+def analyze(filename):
+    """Load a program like the cpu does and return its ControlFlowGraph."""
+    from cpu import CPU
+
+    cpu = CPU()
+    cpu.load(filename)
+    return ControlFlowGraph(cpu.ram, cpu.pc)
+
+
+def load_block_map(filename):
+    """Read the block map out of a json file written by this module."""
+    with open(filename) as file:
+        return [(block["start"], block["end"]) for block in json.load(file)["blocks"]]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Control flow graph of an LS-8 program")
+    parser.add_argument("program")
+    parser.add_argument("-o", "--json", help="write the graph as json")
+    parser.add_argument("--dot", help="write the graph for graphviz")
+    args = parser.parse_args(argv[1:])
+
+    graph = analyze(args.program)
+
+    print(f"{len(graph.instructions)} instructions in {len(graph.blocks)} blocks, {len(graph.loops)} loops")
+    for loop in graph.loops:
+        print(f"  loop at {loop['header']:02X}: blocks {' '.join(f'{b:02X}' for b in loop['blocks'])}")
+    if graph.unresolved:
+        print(f"  unresolved targets at {' '.join(f'{a:02X}' for a in sorted(graph.unresolved))}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(graph.to_json(), file, indent=2)
+            file.write("\n")
+
+    if args.dot:
+        with open(args.dot, "w") as file:
+            file.write(graph.to_dot())
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,19 +1,53 @@
 """CPU functionality."""
 
+import asyncio
 import sys
 import time
+from collections import namedtuple
+
+import fusion
+import snapshot
+from banks import BankedMemory
+from cfg import ControlFlowGraph
+from image import load_into
+from devices import OutputDevice
+from interrupts import TIMER, InterruptController
+from opcodes import OPCODES, InvalidInstruction, UnknownOpcode, UnknownRegister
+from watchdog import StackWatchdog
+
+# longest stretch of instructions the run loop executes between looking at its budgets and timers
+SLICE = 1 << 16
+
+# first slice run_async() gives a program woken from idle, doubled every slice after that
+# so an interrupt handler that is done in a few instructions doesn't spin for a whole slice
+WAKE_SLICE = 1 << 6
+
+# why run() or step() returned
+HALTED = "halted"
+CYCLE_LIMIT = "cycle_limit"
+TIMEOUT = "timeout"
+STACK_OVERFLOW = "stack_overflow"
+ERROR = "error"
+
+# what run() and step() return - why they stopped, how many instructions they ran in how many seconds,
+# the pc, flags and registers the cpu was left with, and for an error the InvalidInstruction raised
+RunResult = namedtuple("RunResult", "reason cycles seconds ips pc fl registers error", defaults=(None,))
 
 class CPU:
     """Main CPU class."""
 
-    def __init__(self):
-        """Construct a new CPU."""
+    def __init__(self, output=None, interrupts=None):
+        """
+        Construct a new CPU, printing through output (an OutputDevice) and
+        taking interrupts through interrupts (an InterruptController) if given.
+        """
         # pc is the program counter and keeps track of where we are in the 
         self.pc = 0
-        self.ram = [0x00] * 0xFF # <-- stores 256 bytes
+        # ram and registers are bytearrays so every value they hold is a real 8 bit byte
+        self.ram = bytearray(0x100) # <-- stores 256 bytes
         self.running = True
 
-        self.reg = [0] * 8 # <-- total of 8 registers
+        self.reg = bytearray(8) # <-- total of 8 registers
 
         # register 7 is reserved for the stack pointer and the initial place where the SP points is at F4
         self.reg[7] = 0xF4
@@ -21,31 +55,51 @@ class CPU:
         # flags register
         self.fl = 0b00000000
 
+        # number of instructions executed so far
+        self.cycles = 0
+
+        # the only thing the run loop checks between instructions. HLT, INT, IRET and the
+        # interrupt controller set it whenever the loop has to stop and look at something
+        self.attention = False
+
         # branchtable provides O(1) access to handler functions - 
-        # prevents us from having to check the opcode value against EVERY possible function - (O(n) time complexity)
-        self.branchtable = {
-            0b00000001: self.HLT,
-            0b10000010: self.LDI,
-            0b01000111: self.PRN,
-            0b10100010: self.MUL,
-            0b01000101: self.PUSH,
-            0b01000110: self.POP,
-            0b00010001: self.RET,
-            0b01010000: self.CALL,
-            0b10100000: self.ADD,
-            0b10000100: self.ST,
-            0b10100111: self.CMP,
-            0b01010100: self.JMP,
-            0b01010110: self.JNE,
-            0b01010101: self.JEQ,
-            0b10101000 : self.AND,
-            0b10101010 : self.OR,
-            0b01101001 : self.NOT,
-            0b10100100 : self.MOD,
-            0b10101100 : self.SHL,
-            0b10101101 : self.SHR,
-            0b10101011 : self.XOR,
-        }
+        # prevents us from having to check the opcode value against EVERY possible function - (O(n) time complexity).
+        # it is built from the opcode table, every opcode is handled by the method of the same name
+        self.branchtable = {IR: getattr(self, opcode.name) for IR, opcode in OPCODES.items()}
+
+        # PRN and PRA write into a buffered output device instead of calling print() for every instruction
+        self.output = output if output is not None else OutputDevice()
+
+        # timer and device interrupts, see interrupts.py - by default the timer fires once a second
+        self.interrupts = interrupts if interrupts is not None else InterruptController(self)
+
+        # decode cache - one entry per ram address holding the pre-decoded instruction found there
+        # (handler, operand_a, operand_b, instruction length, sets pc). entries are filled the first
+        # time an address is executed and cleared again by ram_write so self-modifying code stays correct
+        self.decoded = [None] * len(self.ram)
+
+        # marks every ram address that some cached code was built from, so ram_write only has to
+        # invalidate when it actually lands on code. other execution engines (see translator.py) cache
+        # code too and register a callback in code_listeners to hear about those writes
+        self.code_map = bytearray(len(self.ram))
+        self.code_listeners = []
+
+        # what the run loop actually dispatches - the decoded instruction, or a whole sequence of them
+        # fused into one call where the code matches one of fusion.PATTERNS. fusion_hits counts the runs
+        # of each pattern, which is also how the run loop knows how many instructions a dispatch was
+        self.fused = [None] * len(self.ram)
+        self.fusion_hits = [0] * len(fusion.PATTERNS)
+
+        # the BankedMemory switching pages into part of ram, if the machine has one - see banks.py
+        self.banks = None
+
+        # the MemoryBus routing loads and stores at device addresses, made when the first device is attached - see bus.py
+        self.bus = None
+
+        # the address after the last byte of the program load() put in ram, for the stack watchdog
+        self.image_end = None
+        # where the stack ran into it, if a StackWatchdog stopped the cpu for that
+        self.stack_overflow = None
 
     def XOR(self, regA, regB):
         self.reg[regA] = self.reg[regA] ^ self.reg[regB]
@@ -54,17 +108,24 @@ class CPU:
         self.reg[regA] = self.reg[regA] >> self.reg[regB]
 
     def SHL(self, regA, regB):
-        self.reg[regA] = self.reg[regA] << self.reg[regB]
+        self.reg[regA] = (self.reg[regA] << self.reg[regB]) & 0xFF
+
+    def DIV(self, regA, regB):
+        if self.reg[regB] == 0:
+            self.output.write_text("ERROR: Cannot divide by 0\n")
+            self.HLT(regA, regB)
+        else:
+            self.reg[regA] = self.reg[regA] // self.reg[regB]
 
     def MOD(self, regA, regB):
         if self.reg[regB] == 0:
-            print("ERROR: Cannot divide by 0")
-            self.HLT()
+            self.output.write_text("ERROR: Cannot divide by 0\n")
+            self.HLT(regA, regB)
         else:
             self.reg[regA] = self.reg[regA] % self.reg[regB] 
 
     def NOT(self, register, _):
-        self.reg[register] = ~self.reg[register]
+        self.reg[register] = ~self.reg[register] & 0xFF
 
     def OR(self, regA, regB):
         self.reg[regA] = self.reg[regA] | self.reg[regB]
@@ -74,31 +135,37 @@ class CPU:
     
     # handler functions to store inside the branchtable #
     # HLT exits the program regardless of what is happening
-    def HLT(self):
+    def HLT(self, _a, _b):
         self.running = False
+        self.attention = True
+        self.output.flush()
 
-    def ST(self):
-        register_a = self.ram_read(self.pc + 1)
-        register_b = self.ram_read(self.pc + 2)
+    def ST(self, register_a, register_b):
         b_value = self.reg[register_b]
         a_address = self.reg[register_a]
 
         self.ram_write(b_value, a_address)
 
+    # loads register a with the value at the address held in register b
+    def LD(self, register_a, register_b):
+        self.reg[register_a] = self.ram[self.reg[register_b]]
+
     # takes a value and stores it inside a register
-    def LDI(self):
-        operand_a = self.ram_read(self.pc + 1) # the register number
-        operand_b = self.ram_read(self.pc + 2) # the value to store
+    def LDI(self, operand_a, operand_b):
+        # operand_a is the register number and operand_b the value to store
         self.reg[operand_a] = operand_b
     
     # Prints the value located at the register
-    def PRN(self):
-        operand_a = self.ram_read(self.pc + 1) # the register number
-        print(self.reg[operand_a])
+    def PRN(self, operand_a, _):
+        self.output.write_number(self.reg[operand_a])
+
+    # Prints the character whose ascii value is in the register
+    def PRA(self, operand_a, _):
+        self.output.write_byte(self.reg[operand_a])
 
     # Multiplies to register values together and assigns the result to a register
     def MUL(self, register_a, register_b):
-        self.reg[register_a] = self.reg[register_a] * self.reg[register_b]
+        self.reg[register_a] = (self.reg[register_a] * self.reg[register_b]) & 0xFF
     
     # compares the values in register a with the value in register b
     def CMP(self, register_a, register_b):
@@ -122,64 +189,129 @@ class CPU:
             self.fl = 0b00000000
 
     # pushes the value of the given register to the stack
-    def PUSH(self):
-        reg_num = self.ram_read(self.pc + 1)
-        self.reg[7] -= 1
+    def PUSH(self, reg_num, _):
+        self.reg[7] = (self.reg[7] - 1) & 0xFF
         SP = self.reg[7]
         value = self.reg[reg_num]
 
         self.ram_write(value, SP)
 
-    def POP(self):
-        reg_num = self.ram_read(self.pc + 1)
+    def POP(self, reg_num, _):
         SP = self.reg[7]
         self.reg[reg_num] = self.ram_read(SP)
-        self.reg[7] += 1
+        self.reg[7] = (self.reg[7] + 1) & 0xFF
 
-    def RET(self):
+    def RET(self, _a, _b):
         SP = self.reg[7]
         return_address = self.ram_read(SP)
-        self.reg[7] += 1
+        self.reg[7] = (SP + 1) & 0xFF
 
         self.pc = return_address
     
-    def CALL(self):
+    def CALL(self, reg_num, _):
         # set where we need to return to
-        next_instructions = self.pc + 2
-        self.reg[7] -= 1
+        next_instructions = (self.pc + 2) & 0xFF
+        self.reg[7] = (self.reg[7] - 1) & 0xFF
         SP = self.reg[7]
         # return_address = self.ram_read(self.pc + 2)
         self.ram_write(next_instructions, SP)
 
         # set the pc where the function we are calling is
-        reg_num = self.ram_read(self.pc + 1)
         self.pc = self.reg[reg_num]
     
     def ADD(self, register_a, register_b):
-        self.reg[register_a] += self.reg[register_b]
+        self.reg[register_a] = (self.reg[register_a] + self.reg[register_b]) & 0xFF
+
+    def SUB(self, register_a, register_b):
+        self.reg[register_a] = (self.reg[register_a] - self.reg[register_b]) & 0xFF
+
+    def INC(self, register, _):
+        self.reg[register] = (self.reg[register] + 1) & 0xFF
+
+    def DEC(self, register, _):
+        self.reg[register] = (self.reg[register] - 1) & 0xFF
+
+    def NOP(self, _a, _b):
+        pass
     
-    def JMP(self):
-        register = self.ram_read(self.pc + 1)
+    # sets the bit of the interrupt number in the register in IS, the interrupt happens before the next instruction
+    def INT(self, register, _):
+        self.reg[6] |= 1 << (self.reg[register] & 0b111)
+        self.attention = True
+        self.pc = (self.pc + 2) & 0xFF
+
+    # returns from an interrupt handler - the reverse of what the interrupt controller pushed
+    def IRET(self, _a, _b):
+        for register in range(6, -1, -1):
+            self.reg[register] = self.pop_value()
+        self.fl = self.pop_value()
+        self.pc = self.pop_value()
+
+        # interrupts are back on, and any that came in during the handler can go now
+        self.interrupts.enabled = True
+        self.attention = True
+
+    def JMP(self, register, _):
         self.pc = self.reg[register]
     
-    def JNE(self):
-        register = self.ram_read(self.pc + 1)
+    def JNE(self, register, _):
         if self.fl & 0b00000001 == False:
             self.pc = self.reg[register]
         else:
-            self.pc += 2
+            self.pc = (self.pc + 2) & 0xFF
 
-    def JEQ(self):
-        register = self.ram_read(self.pc + 1)
+    def JEQ(self, register, _):
         if self.fl & 0b00000001:
             self.pc = self.reg[register]
         else:
-            self.pc += 2
+            self.pc = (self.pc + 2) & 0xFF
 
+    # the flags are 00000LGE - less than, greater than, equal
+    def JGT(self, register, _):
+        if self.fl & 0b00000010:
+            self.pc = self.reg[register]
+        else:
+            self.pc = (self.pc + 2) & 0xFF
+
+    def JGE(self, register, _):
+        if self.fl & 0b00000011:
+            self.pc = self.reg[register]
+        else:
+            self.pc = (self.pc + 2) & 0xFF
+
+    def JLT(self, register, _):
+        if self.fl & 0b00000100:
+            self.pc = self.reg[register]
+        else:
+            self.pc = (self.pc + 2) & 0xFF
+
+    def JLE(self, register, _):
+        if self.fl & 0b00000101:
+            self.pc = self.reg[register]
+        else:
+            self.pc = (self.pc + 2) & 0xFF
 
 
     #                       #                     #
 
+    # stack helpers for the interrupt sequence and IRET
+    def push_value(self, value):
+        self.reg[7] = (self.reg[7] - 1) & 0xFF
+        self.ram_write(value, self.reg[7])
+
+    def pop_value(self):
+        value = self.ram_read(self.reg[7])
+        self.reg[7] = (self.reg[7] + 1) & 0xFF
+        return value
+
+    # called by the run loops when attention is set: stops for HLT, otherwise lets the
+    # interrupt controller deliver whatever is pending
+    def attend(self):
+        self.attention = False
+
+        if self.running:
+            self.interrupts.service()
+
     # returns a location in the ram based on the address passed to it
     def ram_read(self, address):
         return self.ram[address]
@@ -187,23 +319,153 @@ class CPU:
     # sets a value to the location in ram based on the address and value passed to it
     def ram_write(self, value, address):
         self.ram[address] = value
+        if self.code_map[address]:
+            self.invalidate(address)
+            # device addresses are marked in the code map too, see bus.py
+            if self.bus is not None:
+                self.bus.write(value, address)
+
+    # drops any cached decode that reads the byte at address - an instruction is at most 3 bytes
+    # long so the instruction starting at the address and the two before it are the only ones affected.
+    # fused entries cover up to fusion.MAX_FUSED_BYTES, so those go back further. an instruction at
+    # FE or FF reads its operands from the start of ram, and the negative indexes wrap round to it
+    def invalidate(self, address):
+        decoded = self.decoded
+        for start in range(address - 2, address + 1):
+            decoded[start] = None
+
+        fused = self.fused
+        for start in range(address - fusion.MAX_FUSED_BYTES + 1, address + 1):
+            fused[start] = None
+
+        for listener in self.code_listeners:
+            listener(address)
+
+    # decodes the instruction at address once and stores the result in the decode cache
+    def decode(self, address):
+        # format of opcode is AABCDDDD
+        # AA - Number of operands for this opcode, 0-2
+        # B - 1 if this is an ALU operation
+        # C - 1 if this instruction sets the PC
+        # DDDD - Instruction identifier
+        IR = self.ram[address]
+        opcode = OPCODES.get(IR)
+
+        if opcode is None:
+            raise UnknownOpcode(IR, address)
+
+        # addresses wrap round at the end of ram like the pc does
+        operand_a = self.ram_read((address + 1) & 0xFF) if opcode.size > 1 else 0
+        operand_b = self.ram_read((address + 2) & 0xFF) if opcode.size > 2 else 0
+
+        # there are only 8 registers, an operand naming one past R7 can't be executed
+        if opcode.registers and (operand_a > 7 or opcode.registers > 1 and operand_b > 7):
+            raise UnknownRegister(IR, address, operand_a if operand_a > 7 else operand_b)
+
+        # ALU handlers are stored in the same branchtable so every handler is bound directly here,
+        # with its operands fetched once
+        entry = (self.branchtable[IR], operand_a, operand_b, opcode.size, opcode.pc_set)
+        self.decoded[address] = entry
+
+        for offset in range(opcode.size):
+            self.code_map[(address + offset) & 0xFF] = 1
+
+        return entry
+
+    # the run loop's entry for address, fused with the instructions after it where possible
+    def fuse(self, address):
+        entry = fusion.fuse(self, address)
+        self.fused[address] = entry
+        return entry
+
+    def stats(self):
+        """Counters for the run so far - cycles and how many of them ran fused."""
+
+        fused = fusion.fused_instructions(self.fusion_hits) + sum(self.fusion_hits)
+
+        return {
+            "cycles": self.cycles,
+            "fused_instructions": fused,
+            "fusion_rate": fused / self.cycles if self.cycles else 0.0,
+            "fusions": {"+".join(pattern): hits for pattern, hits in zip(fusion.PATTERNS, self.fusion_hits) if hits},
+        }
 
 
+    # read only views straight onto the ram and registers - snapshots and memory dumps can use these
+    # without copying anything, e.g. bytes(cpu.memory()[0xF0:]) or cpu.registers().hex()
+    def memory(self):
+        return memoryview(self.ram).toreadonly()
+
+    def registers(self):
+        return memoryview(self.reg).toreadonly()
+
+    # the whole machine state as one bytes blob, see snapshot.py
+    def snapshot(self):
+        return snapshot.capture(self)
+
+    # goes back to a blob from snapshot(), copying into the existing ram and registers
+    def restore(self, blob):
+        snapshot.restore_into(self, blob)
+
+    def fork(self, output=None):
+        """
+        Return a new CPU in exactly this state, printing through output if given or
+        else to the same sink as this one. The fork has the same timer settings
+        but no input devices attached.
+        """
+
+        if output is None:
+            output = OutputDevice(self.output.sink, self.output.threshold, self.output.interval)
+
+        clone = CPU(output)
+        clone.interrupts = InterruptController(clone, self.interrupts.timer_interval, self.interrupts.timer_cycles)
+        clone.restore(self.snapshot())
+
+        return clone
+
     # lets us programatically load the commands in from another file
-    def load(self):
-        """Load a program into memory."""
+    def load(self, filename=None, blocks=None, check=False):
+        """
+        Load a program into memory. blocks is an optional block map from cfg.py,
+        [(start, end)] - the dispatch cache is filled for those ahead of time.
+        With check the program is rejected if it could run into a byte that
+        isn't an instruction, see check().
+        """
 
         address = 0
 
-        # the input from the user should be of length 2 or more if it was entered correctly
-        if len(sys.argv) < 2:
-            print("No path to file given.")
-            print("e.g - filename path/to/file")
-            sys.exit()
+        # bytes after a BANK n line go into bank n's page rather than into ram
+        sections = {}
+        section = None
+
+        # anything decoded from a previous program is stale now
+        self.decoded[:] = [None] * len(self.decoded)
+        self.fused[:] = [None] * len(self.fused)
+
+        # without an explicit filename the path comes from the command line
+        if filename is None:
+            # the input from the user should be of length 2 or more if it was entered correctly
+            if len(sys.argv) < 2:
+                print("No path to file given.")
+                print("e.g - filename path/to/file")
+                sys.exit()
+
+            filename = sys.argv[1]
+
+        # binary images are copied straight into ram, no parsing needed
+        if filename.endswith(".ls8b"):
+            try:
+                self.pc, self.image_end = load_into(self.ram, filename)
+            except FileNotFoundError:
+                print(f'{sys.argv[0]}: {filename} not found')
+            if check:
+                self.check()
+            self.predecode(blocks or [])
+            return
 
         try:
             # Open the file
-            with open(sys.argv[1]) as file:
+            with open(filename) as file:
                 # loop over the lines in the file
                 for line in file:
                     # return a list from the lines in the file wherever a comment # appears
@@ -220,25 +482,58 @@ class CPU:
                     if possible_num[0] == "1" or possible_num[0] == "0":
                         # if it is we know the length of each opcode should be 8 so we slice to the 8th index
                         num = possible_num[:8]
+
+                        if section is not None:
+                            section.append(int(num, 2))
+                            continue
+
                         # this will store the opcode/num in the ram at the address location
                         self.ram[address] = int(num, 2)
 
                         # increase the address
                         address += 1
-        except FileNotFoundError:
-            print(f'{sys.argv[0]}: {sys.argv[1]} not found')
 
+                    elif possible_num.startswith("BANK"):
+                        section = sections.setdefault(int(possible_num.split()[1], 0), bytearray())
+        except FileNotFoundError:
+            print(f'{sys.argv[0]}: {filename} not found')
+
+        self.image_end = address
+
+        # a program with banked data gets banked memory whether it asked for it or not
+        if sections:
+            banks = self.banks if self.banks is not None else BankedMemory(self)
+            for bank, data in sections.items():
+                banks.preload(bank, data)
+
+        if check:
+            self.check()
+        self.predecode(blocks or [])
+
+    # follows the code from the entry point the way cfg.py does, so a program that can run into
+    # a byte that isn't an instruction is rejected when it is loaded rather than when it gets there.
+    # the graph takes every branch it can't rule out, so this can reject a program that would never
+    # get to the byte - decode() is what decides when the program runs, and this is only a lint
+    def check(self):
+        invalid = ControlFlowGraph(self.ram, self.pc).invalid
+        if invalid:
+            # decode() raises whichever error the instruction there has
+            self.decode(min(invalid))
+
+    # fills the dispatch cache along every block of a block map, the same entries the
+    # run loop would build as it got to them, so it starts without decoding anything
+    def predecode(self, blocks):
+        for start, end in blocks:
+            address = start
+            while address < min(end, len(self.ram)):
+                if self.fused[address] is None:
+                    try:
+                        self.fuse(address)
+                    except Exception:
+                        # a stale map can point at bytes that aren't code - the run loop decides
+                        break
+                address += self.fused[address][3]
 
-    # this runs for certain functions that the alu should handle
-    def alu(self, op, reg_a, reg_b):
-        """ALU operations."""
-        try:
-            self.branchtable[op](reg_a, reg_b) # <-- these functions take in arguments
-        # if op == "ADD":
-        #     self.reg[reg_a] += self.reg[reg_b]
-        #elif op == "SUB": etc
-        except:
-            raise Exception("Unsupported ALU operation")
 
     def trace(self):
         """
@@ -251,8 +546,8 @@ class CPU:
             #self.fl,
             #self.ie,
             self.ram_read(self.pc),
-            self.ram_read(self.pc + 1),
-            self.ram_read(self.pc + 2)
+            self.ram_read((self.pc + 1) & 0xFF),
+            self.ram_read((self.pc + 2) & 0xFF)
         ), end='')
 
         for i in range(8):
@@ -260,70 +555,254 @@ class CPU:
 
         print()
 
-    def run(self):
-        """Run the CPU."""
+    def run(self, max_cycles=None, deadline=None, watchdog=False, hook=None):
+        """
+        Run the CPU until it halts, or until max_cycles instructions have run or
+        time.monotonic() passes deadline. The budgets are only looked at between
+        slices of instructions. With watchdog the run also stops when the stack
+        runs into the program, see watchdog.py. hook is called for every
+        instruction, see execute(). Returns a RunResult, with the reason "error"
+        if the program ran into bytes that aren't an instruction it can execute -
+        the pc is left at them.
+        """
+
+        self.interrupts.start()
+
+        try:
+            return self.bounded(max_cycles, deadline, watchdog, hook)
+        finally:
+            self.interrupts.stop()
+            self.output.flush()
+
+    def step(self, count=1, watchdog=False):
+        """
+        Execute count instructions, or fewer if the program halts, and return a
+        RunResult - for debuggers. Interrupts that are pending are taken, but the
+        timer and devices aren't started.
+        """
+
+        try:
+            return self.bounded(count, None, watchdog, None)
+        finally:
+            self.output.flush()
+
+    # execute() with the watchdog and the bookkeeping for the RunResult around it
+    def bounded(self, max_cycles, deadline, watchdog, hook):
+        # an overflow from before doesn't count once the cpu is running again, after a restore say
+        if self.running:
+            self.stack_overflow = None
+
+        guard = StackWatchdog(self) if watchdog else None
+        cycles = self.cycles
+        start = time.perf_counter()
+        error = None
+
+        try:
+            self.execute(max_cycles, deadline, hook)
+        except InvalidInstruction as e:
+            error = e
+        finally:
+            if guard is not None:
+                guard.detach()
+
+        seconds = time.perf_counter() - start
+        cycles = self.cycles - cycles
+
+        if error is not None:
+            reason = ERROR
+        elif self.stack_overflow is not None:
+            reason = STACK_OVERFLOW
+        elif not self.running:
+            reason = HALTED
+        elif cycles == max_cycles:
+            reason = CYCLE_LIMIT
+        else:
+            reason = TIMEOUT
+
+        return RunResult(reason, cycles, seconds, cycles / seconds if seconds else 0.0,
+                         self.pc, self.fl, bytes(self.reg), error)
+
+    async def run_async(self, slice_size=SLICE, max_cycles=None):
+        """
+        Run the CPU as a coroutine, giving the event loop a turn after every
+        slice_size instructions so many machines can share one thread. A program
+        spinning on a jump to itself is waiting for an interrupt and sleeps until
+        a device or the timer wakes it, instead of burning slices.
+        """
+
+        loop = asyncio.get_running_loop()
+        interrupts = self.interrupts
+
+        # wake() can come from the keyboard's thread as well as from the loop itself
+        woken = asyncio.Event()
+        def listener():
+            loop.call_soon_threadsafe(woken.set)
+        interrupts.wake_listeners.append(listener)
+
+        # the timer runs on the event loop rather than on a thread per machine
+        timer = None
+        def fire():
+            nonlocal timer
+            interrupts.request(TIMER)
+            timer = loop.call_later(interrupts.timer_interval, fire)
+        if interrupts.timer_cycles is None and interrupts.timer_interval is not None:
+            timer = loop.call_later(interrupts.timer_interval, fire)
+
+        limit = None if max_cycles is None else self.cycles + max_cycles
+        burst = slice_size
+
+        interrupts.start(host_timer=False)
+
+        try:
+            while self.running and self.cycles != limit:
+                budget = burst if limit is None else min(burst, limit - self.cycles)
+                burst = min(burst * 2, slice_size)
+                self.execute(budget)
+
+                interrupts.recheck()
+                if not self.running or self.attention or not self.idle():
+                    await asyncio.sleep(0)
+                    continue
+
+                if interrupts.deadline is not None:
+                    # nothing changes while spinning, so skip straight to the cycle the timer fires on
+                    self.cycles = interrupts.deadline if limit is None else min(interrupts.deadline, limit)
+                    await asyncio.sleep(0)
+                    continue
+
+                # whatever was printed before the program went quiet goes out now
+                self.output.flush()
+
+                woken.clear()
+                if not self.attention:
+                    await woken.wait()
+                burst = min(WAKE_SLICE, slice_size)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            interrupts.wake_listeners.remove(listener)
+            interrupts.stop()
+            self.output.flush()
+
+    # True when the instruction at pc is a JMP to itself, which can only be left by an interrupt
+    def idle(self):
+        entry = self.decoded[self.pc]
+        return entry is not None and entry[0] == self.JMP and self.reg[entry[1]] == self.pc
+
+    def execute(self, max_cycles=None, deadline=None, hook=None):
+        """
+        Execute instructions until the CPU halts, max_cycles have run or
+        time.monotonic() passes deadline. Unlike run() this leaves the timer and
+        devices alone, for callers that drive them themselves.
+
+        hook, if given, is called as hook(cycles, pc, entry) before every
+        instruction - the cycle count so far, the address and the decoded entry
+        about to run - and as hook(cycles, None, None) before the cpu attends to
+        an interrupt. Instructions then run one at a time, without fusion.
+        Everything an instruction does is done by the next call, or by the time
+        execute() returns for the last one.
+        """
         # format of opcode is AABCDDDD
         # AA - Number of operands for this opcode, 0-2
         # B - 1 if this is an ALU operation
         # C - 1 if this instruction sets the PC
         # DDDD - Instruction identifier
         
-        # set up timer
-        # time_start = time.time()
-
-        # the while loop will run through all the instructions that need to be ran using the pc as a guide for where it is
-        while self.running:
-            # check and see if the IS register is set and interrupts are enabled
-            # if self.reg[6]:
-            #     masked_interrupts = self.reg[5] & self.reg[6]
-            #     interrupt_happened = 0
-            #     for i in range(8):
-            #         interrupt_happened = ((masked_interrupts >> i) & 1) == 1
-            #         if interrupt_happened:
-            #             break
-                
-            #     if interrupt_happened:
-            #         self.reg[6] = 0
-
-
-            # check each to see if a second has elapsed or not
-            # if time.time() - time_start >= 1:
-            #     # set bit 0 of the IS register
-            #     self.reg[6] = 0b00000001 
-            #     time_start = time.time() # restet the time
-
-            IR = self.ram[self.pc] # gets the instruction from the location in the ram
-            # bitshift the instruction to the left 6 this will leave me with just the 2 digits left and from that i can
-            # find out how many operands will be needed in combinartion with the initial one
-            num_of_ops = IR >> 6 
-            
-            is_alu_op = IR >> 5 & 0b001 # 0 if false, 1 if true
-            pc_set = IR >> 4 & 0b0001 # 1 if instruction sets pc, 0 if it doesnt
-
-
-            # if the operation is an alu operation we should handle it there
-            # otherwise we can use the branchtable directly from here
-            if is_alu_op:
-                operand_a = self.ram_read(self.pc + 1)
-                operand_b = self.ram_read(self.pc + 2)
-                self.alu(IR, operand_a, operand_b)
-            else:
-                # What is stored in the branchatable are functions which is why we can invoke this
-<<<<<<< HEAD
-                self.branchtable[IR]() 
-
-            # pc needs to increment by 1 (for the current operation) + however many extra operands there will be
-            self.pc += 1 + num_of_ops 
-=======
-                try:
-                    self.branchtable[IR]()
-                except:
-                    print("opcode: ", bin(self.ram[self.pc]))
-            # some instructions set the pc themself, in those cases we should increment the pc
-            if pc_set == 0:
-                # pc needs to increment by 1 (for the current operation) + however many extra operands there will be
-                self.pc += 1 + num_of_ops
->>>>>>> 067dadd85b590d29e2e03f49af9ea38df468a85a
-
+        interrupts = self.interrupts
+        hits = self.fusion_hits
+        cycles = self.cycles
+        limit = None if max_cycles is None else cycles + max_cycles
 
+        try:
+            # the while loop will run through all the instructions that need to be ran using the pc as a guide for where it is,
+            # one slice at a time. budgets and the cycle timer are only looked at between slices, inside a slice the only
+            # check is the attention flag
+            while self.running and cycles != limit:
+                if self.attention:
+                    # devices serviced here can look at the cycle count
+                    self.cycles = cycles
+                    if hook is not None:
+                        hook(cycles, None, None)
+                    self.attend()
+                    continue
+
+                self.output.expire()
+                interrupts.recheck()
+                if self.attention:
+                    continue
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+
+                # instructions left before the budget or the cycle timer, if either is close
+                room = None if limit is None else limit - cycles
+
+                if interrupts.deadline is not None:
+                    if cycles >= interrupts.deadline:
+                        interrupts.tick(cycles)
+                        continue
+                    room = interrupts.deadline - cycles if room is None else min(room, interrupts.deadline - cycles)
+
+                # a fused dispatch runs up to MAX_FUSED_INSTRUCTIONS, so close to a budget the slice is cut
+                # down to what can't overshoot it, and the last few instructions are dispatched one by one
+                decoded, decode = self.fused, self.fuse
+                slice_size = SLICE
+                if room is not None and room < SLICE * fusion.MAX_FUSED_INSTRUCTIONS:
+                    slice_size = room // fusion.MAX_FUSED_INSTRUCTIONS
+                    if slice_size == 0:
+                        decoded, decode, slice_size = self.decoded, self.decode, room
+
+                fused_before = fusion.fused_instructions(hits)
+                done = 0
+                try:
+                    if hook is not None:
+                        # the hook sees every instruction, so nothing is fused. a loop of its own keeps
+                        # the check out of the one below
+                        decoded = self.decoded
+                        slice_size = SLICE if room is None else min(room, SLICE)
+
+                        for done in range(slice_size):
+                            if self.attention:
+                                break
+
+                            pc = self.pc
+                            entry = decoded[pc]
+                            if entry is None:
+                                entry = self.decode(pc)
+
+                            hook(cycles + done, pc, entry)
+
+                            handler, operand_a, operand_b, size, pc_set = entry
+                            handler(operand_a, operand_b)
+
+                            if not pc_set:
+                                self.pc = (pc + size) & 0xFF
+                        else:
+                            done = slice_size
+                        continue
 
+                    for done in range(slice_size):
+                        if self.attention:
+                            break
+
+                        # the decode cache already holds the handler and operands for every instruction we have run before,
+                        # so only the first visit to an address pays for shifting the opcode apart and reading the operands
+                        entry = decoded[self.pc]
+                        if entry is None:
+                            entry = decode(self.pc)
+
+                        handler, operand_a, operand_b, size, pc_set = entry
+                        handler(operand_a, operand_b)
+
+                        # some instructions set the pc themself, in those cases we should not increment the pc
+                        if not pc_set:
+                            # pc needs to increment by 1 (for the current operation) + however many extra operands there will be,
+                            # and wraps round to 0 past the end of ram
+                            self.pc = (self.pc + size) & 0xFF
+                    else:
+                        done = slice_size
+                finally:
+                    cycles += done + fusion.fused_instructions(hits) - fused_before
+        finally:
+            # the count is kept in a local while running and stored once we stop
+            self.cycles = cycles
@@ -0,0 +1,288 @@
+"""I/O devices for the LS-8."""
+
+import os
+import queue
+import selectors
+import sys
+import threading
+import time
+
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+
+from bus import connect
+from interrupts import KEYBOARD
+
+# where the most recently pressed key is stored
+KEY_ADDRESS = 0xF4
+
+# memory mapped devices in the addresses the spec reserves, after the bank select port at F5.
+# F7 is two devices - stores set the timer, loads read the counter
+CONSOLE_ADDRESS = 0xF6
+TIMER_ADDRESS = 0xF7
+COUNTER_ADDRESS = 0xF7
+
+# cycles per unit of the period stored to the timer
+TIMER_UNIT = 0x100
+
+
+class StdoutSink:
+    """
+    Writes to whatever sys.stdout is at the time of the write, so
+    contextlib.redirect_stdout keeps working.
+    """
+
+    def write(self, data):
+        stdout = sys.stdout
+        buffer = getattr(stdout, "buffer", None)
+
+        if buffer is None:
+            # a text-only stream such as io.StringIO - every byte maps to one character
+            stdout.write(data.decode("latin-1"))
+        else:
+            # anything already written to the text layer has to come out first
+            stdout.flush()
+            buffer.write(data)
+
+    def flush(self):
+        stdout = sys.stdout
+        getattr(stdout, "buffer", stdout).flush()
+
+
+class NullSink:
+    """Throws all output away, for benchmarks."""
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+class OutputDevice:
+    """
+    Buffered console output for PRN and PRA.
+
+    Output collects in memory and goes to the sink in bulk - when the buffer
+    reaches threshold bytes, when interval seconds have passed since the last
+    flush, and when the program halts. The sink is anything with a
+    write(bytes) method: StdoutSink(), a file opened in binary mode,
+    io.BytesIO() or NullSink().
+    """
+
+    def __init__(self, sink=None, threshold=4096, interval=0.05):
+        self.sink = sink if sink is not None else StdoutSink()
+        self.threshold = threshold
+        self.interval = interval
+
+        self.buffer = bytearray()
+        self.last_flush = time.monotonic()
+
+    # PRN - the decimal value and a newline
+    def write_number(self, value):
+        self.buffer += b"%d\n" % value
+        self.written()
+
+    # PRA - the byte itself
+    def write_byte(self, value):
+        self.buffer.append(value)
+        self.written()
+
+    def write_text(self, text):
+        self.buffer += text.encode()
+        self.written()
+
+    def written(self):
+        if len(self.buffer) >= self.threshold or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    # called by the run loop now and then, so output isn't held back forever
+    # by a program that has gone quiet - say, one waiting for a key
+    def expire(self):
+        if self.buffer and time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.sink.write(bytes(self.buffer))
+            self.buffer.clear()
+
+        flush = getattr(self.sink, "flush", None)
+        if flush is not None:
+            flush()
+
+        self.last_flush = time.monotonic()
+
+
+class KeyboardDevice:
+    """
+    Keyboard input on interrupt 1.
+
+    A background thread waits on the input with a selector and queues every
+    byte that arrives, then wakes the cpu - nothing in the run loop ever polls
+    the input. When the cpu services interrupts, the next queued key is written
+    to 0xF4 and interrupt 1 is raised in IS, one key per interrupt.
+
+    source is a file descriptor or anything with fileno() - sys.stdin, a pipe,
+    a file of scripted input. Bytes can also be handed over with feed().
+    """
+
+    def __init__(self, cpu, source=None):
+        self.cpu = cpu
+        self.source = source
+
+        self.keys = queue.SimpleQueue()
+
+        self.thread = None
+        self.stop_reading = threading.Event()
+        self.saved_terminal = None
+
+        cpu.interrupts.attach(self)
+
+        # the key is plain ram, so on a machine with memory mapped devices the bus
+        # only has to keep the others off the address
+        if cpu.bus is not None:
+            cpu.bus.attach(self, KEY_ADDRESS)
+
+    def feed(self, data):
+        """Queue bytes as if they had been typed. Safe to call from any thread."""
+        for key in data:
+            self.keys.put(key)
+
+        self.cpu.interrupts.wake()
+
+    def poll(self):
+        # a key that the program hasn't taken its interrupt for yet stays in 0xF4
+        if self.cpu.reg[6] & (1 << KEYBOARD) or self.keys.empty():
+            return
+
+        self.cpu.ram_write(self.keys.get(), KEY_ADDRESS)
+        self.cpu.reg[6] |= 1 << KEYBOARD
+
+    def fileno(self):
+        if self.source is None:
+            return None
+        return self.source if isinstance(self.source, int) else self.source.fileno()
+
+    def start(self):
+        fd = self.fileno()
+        if fd is None:
+            return
+
+        # without line buffering every key arrives as soon as it is pressed
+        if os.isatty(fd) and termios is not None:
+            self.saved_terminal = termios.tcgetattr(fd)
+            tty.setcbreak(fd)
+
+        self.stop_reading.clear()
+        self.thread = threading.Thread(target=self.read, args=(fd,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_reading.set()
+            self.thread.join()
+            self.thread = None
+
+        if self.saved_terminal is not None:
+            termios.tcsetattr(self.fileno(), termios.TCSADRAIN, self.saved_terminal)
+            self.saved_terminal = None
+
+    def read(self, fd):
+        with selectors.DefaultSelector() as selector:
+            try:
+                selector.register(fd, selectors.EVENT_READ)
+            except (PermissionError, ValueError):
+                # regular files can't be selected on, but they never block either
+                selector = None
+
+            while not self.stop_reading.is_set():
+                # the timeout is only there to notice stop() - input wakes the select straight away
+                if selector is not None and not selector.select(timeout=0.1):
+                    continue
+
+                data = os.read(fd, 4096)
+                if not data:
+                    break
+
+                self.feed(data)
+
+
+class ConsoleDevice:
+    """
+    Console output at 0xF6 on the memory bus. A byte stored there is printed
+    as PRA would, so a program can write through a pointer.
+    """
+
+    def __init__(self, cpu, address=CONSOLE_ADDRESS):
+        self.output = cpu.output
+        connect(cpu).attach(self, address, write=self.write)
+
+    def write(self, value, address):
+        self.output.write_byte(value)
+
+
+class TimerDevice:
+    """
+    The timer interrupt under program control, stored to at 0xF7 on the memory
+    bus. A store of n makes interrupt 0 fire every n * unit cycles, counted
+    from the store, and a store of 0 stops it. The timer runs on the cpu's cycle
+    count - once the device is attached the host timer is off.
+    """
+
+    def __init__(self, cpu, address=TIMER_ADDRESS, unit=TIMER_UNIT):
+        self.cpu = cpu
+        self.unit = unit
+
+        # the last period stored, until poll() has set the timer to it
+        self.period = None
+
+        cpu.interrupts.timer_interval = None
+        cpu.interrupts.attach(self)
+        connect(cpu).attach(self, address, write=self.write)
+
+    # the cycle count is only up to date once the run loop stops to service interrupts
+    def write(self, value, address):
+        self.period = value
+        self.cpu.interrupts.wake()
+
+    def poll(self):
+        if self.period is None:
+            return
+
+        interrupts = self.cpu.interrupts
+        if self.period:
+            interrupts.timer_cycles = self.period * self.unit
+            interrupts.deadline = self.cpu.cycles + interrupts.timer_cycles
+        else:
+            interrupts.timer_cycles = None
+            interrupts.deadline = None
+
+        self.period = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class CounterDevice:
+    """
+    A free running high resolution counter, loaded from at 0xF7 on the memory
+    bus. It counts ticks of resolution nanoseconds on the host's clock and a
+    load gives the low byte, so the difference between two loads times
+    anything shorter than 256 ticks. The cpu's own cycle count is only brought
+    up to date between slices and blocks, which is too coarse to time with.
+    """
+
+    def __init__(self, cpu, address=COUNTER_ADDRESS, resolution=1000):
+        self.resolution = resolution
+        self.start = time.perf_counter_ns()
+        connect(cpu).attach(self, address, read=self.read)
+
+    def read(self, address):
+        return (time.perf_counter_ns() - self.start) // self.resolution
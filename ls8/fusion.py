@@ -0,0 +1,140 @@
+"""Superinstruction fusion for the interpreter."""
+
+# Assembled LS-8 code is full of the same few sequences - a branch target loaded
+# with LDI right before the jump, CMP right before a conditional jump, PUSH
+# right before CALL. When the interpreter decodes an address that starts one of
+# PATTERNS it compiles the whole sequence into one function, so the run loop
+# dispatches it once instead of once per instruction.
+#
+# A fused entry has the same shape as a decoded one and always sets the pc.
+# Every run of a pattern bumps its counter in cpu.fusion_hits, which is how the
+# run loop counts the instructions it ran beyond the one dispatch - registers,
+# flags, ram and cycle counts come out exactly as if nothing had been fused.
+
+# the sequences that get fused, longest first so they win over their own prefixes
+PATTERNS = [
+    ("CMP", "LDI", "JEQ"),
+    ("CMP", "LDI", "JNE"),
+    ("LDI", "CMP", "JEQ"),
+    ("LDI", "CMP", "JNE"),
+    ("LDI", "JMP"),
+    ("LDI", "JEQ"),
+    ("LDI", "JNE"),
+    ("LDI", "CALL"),
+    ("CMP", "JEQ"),
+    ("CMP", "JNE"),
+    ("PUSH", "CALL"),
+]
+
+MAX_FUSED_INSTRUCTIONS = max(len(pattern) for pattern in PATTERNS)
+
+# bytes covered by the longest pattern - a write can land on a fused entry
+# starting this many bytes minus one before it
+MAX_FUSED_BYTES = 8
+
+# the same semantics as the cpu's handlers. {a} and {b} are the operands,
+# {next} is the address after the instruction (wrapped round to 0 past the end
+# of ram) and {start} where the fused sequence starts
+TEMPLATES = {
+    "LDI": ["reg[{a}] = {b}"],
+    "CMP": [
+        "x = reg[{a}]",
+        "y = reg[{b}]",
+        "cpu.fl = 0b00000001 if x == y else (0b00000010 if x > y else 0b00000100)",
+    ],
+    # a push can overwrite the rest of the sequence, or stop the cpu when the
+    # stack watchdog catches it, in which case only the push counts and the
+    # run loop takes over from the next instruction
+    "PUSH": [
+        "reg[7] = (reg[7] - 1) & 0xFF",
+        "write(reg[{a}], reg[7])",
+        "if cpu.attention or fused[{start}] is None:",
+        "    cpu.pc = {next}",
+        "    return",
+    ],
+    "JMP": ["cpu.pc = reg[{a}]"],
+    "JEQ": ["cpu.pc = reg[{a}] if cpu.fl & 0b00000001 else {next}"],
+    "JNE": ["cpu.pc = {next} if cpu.fl & 0b00000001 else reg[{a}]"],
+    "CALL": [
+        "reg[7] = (reg[7] - 1) & 0xFF",
+        "write({next} & 0xFF, reg[7])",
+        "cpu.pc = reg[{a}]",
+    ],
+}
+
+# generated source -> code object, shared by every cpu
+code_cache = {}
+
+
+def match(names):
+    """Index of the longest pattern that names starts with, or None."""
+    for index, pattern in enumerate(PATTERNS):
+        if names[:len(pattern)] == pattern:
+            return index
+    return None
+
+
+def fuse(cpu, address):
+    """
+    Return the entry for the run loop at address - a fused superinstruction if
+    the code there starts one of PATTERNS, otherwise the decoded instruction.
+    """
+
+    instructions = []
+    position = address
+
+    while len(instructions) < MAX_FUSED_INSTRUCTIONS and position < len(cpu.ram):
+        entry = cpu.decoded[position]
+
+        if entry is None:
+            try:
+                entry = cpu.decode(position)
+            except Exception:
+                # a bad opcode is only an error once the run loop gets there
+                if not instructions:
+                    raise
+                break
+
+        instructions.append((position, entry))
+        position += entry[3]
+
+        if entry[4]:
+            break
+
+    names = tuple(entry[0].__name__ for _, entry in instructions)
+    index = match(names)
+
+    if index is None:
+        return instructions[0][1]
+
+    pattern = PATTERNS[index]
+    lines = [f"def fused_{address:02X}(_a, _b):"]
+
+    for position, (handler, operand_a, operand_b, size, pc_set) in instructions[:len(pattern)]:
+        for line in TEMPLATES[handler.__name__]:
+            lines.append("    " + line.format(a=operand_a, b=operand_b, next=(position + size) & 0xFF, start=address))
+
+    lines.append(f"    hits[{index}] += 1")
+    source = "\n".join(lines) + "\n"
+
+    code = code_cache.get(source)
+    if code is None:
+        code = compile(source, f"<ls8 fused {address:02X}>", "exec")
+        code_cache[source] = code
+
+    namespace = {
+        "cpu": cpu,
+        "reg": cpu.reg,
+        "write": cpu.ram_write,
+        "fused": cpu.fused,
+        "hits": cpu.fusion_hits,
+    }
+    exec(code, namespace)
+
+    last_position, last = instructions[len(pattern) - 1]
+    return (namespace[f"fused_{address:02X}"], 0, 0, last_position + last[3] - address, 1)
+
+
+def fused_instructions(hits):
+    """Instructions run inside fused entries beyond the one dispatch each."""
+    return sum(count * (len(PATTERNS[index]) - 1) for index, count in enumerate(hits))
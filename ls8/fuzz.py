@@ -0,0 +1,815 @@
+"""Coverage guided fuzzing of the LS-8 cpu and assembler."""
+
+# The fuzzer keeps a corpus of inputs, mutates them and runs the results in a
+# process pool. Every run reports which edges it covered - for the cpu, pairs of
+# consecutive instructions each tagged with how it went (the CMP result, a jump
+# taken or not, the stack pointer jumping, a halt) - and inputs that cover an
+# edge nothing has covered before join the corpus.
+#
+#   python ls8.py --fuzz --seconds 60 -j 8
+#   python ls8.py --fuzz --asm --runs 20000 --out findings
+#
+# Each image runs on the plain decode loop (which collects the coverage) and on
+# the fused interpreter, and programs that halt run once more on the block
+# translator. A Python exception other than an invalid instruction is a crash,
+# and engines that disagree about the final state are a mismatch. Then the
+# engines run the image again with the stack watchdog, which has to stop all of
+# them at the same store. In --asm mode generated assembly goes through
+# assemble(), the original pass1/pass2 and the optimizer, which have to agree
+# with each other.
+#
+# Each finding is minimized and saved to the output directory as a .ls8 (or
+# .asm) reproducer, with what went wrong in its header comment.
+
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from cpu import CPU
+from devices import OutputDevice
+from opcodes import BY_NAME, OPCODES, InvalidInstruction
+from translator import BlockTranslator
+from watchdog import StackWatchdog
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ASM_DIR = os.path.join(HERE, "..", "asm")
+EXAMPLES = os.path.join(HERE, "examples")
+
+# instructions an input gets before it counts as running forever
+MAX_CYCLES = 10_000
+
+# sources that once made a finding, which every --asm run starts with so they stay fixed
+ASM_REGRESSIONS = [
+    # -O dropped the HLT as unreachable, but a return with nothing to return from can fall through to it
+    "IRET\nHLT\n",
+    "RET\nHLT\n",
+]
+
+# seconds a single input gets on the block translator, which has no cycle cap
+TIMEOUT = 2.0
+
+# seconds a whole input gets in a worker - anything slower is a hang
+HANG_TIMEOUT = 10.0
+
+# inputs sent to a worker at once
+BATCH = 32
+
+CMP = BY_NAME["CMP"].code
+CALL = BY_NAME["CALL"].code
+JMP = BY_NAME["JMP"].code
+LD = BY_NAME["LD"].code
+RETURNS = {BY_NAME["RET"].code, BY_NAME["IRET"].code}
+
+# stands in for the whole of ram when a program never halts or a bad opcode is hit
+MAX_IMAGE = 0x100
+
+
+class Timeout(Exception):
+    """Raised by alarm() when the code under it runs past its time limit."""
+
+
+# -- running one cpu input -- #
+
+def machine(image):
+    """A CPU with image loaded, no host timer, and output kept in memory."""
+
+    output = io.BytesIO()
+    cpu = CPU(OutputDevice(output, threshold=1 << 16, interval=float("inf")))
+    cpu.interrupts.timer_interval = None
+    cpu.ram[:len(image)] = image
+
+    return cpu, output
+
+
+def covered_run(cpu, max_cycles, edges):
+    """
+    Run like CPU.execute with plain decode dispatch, adding an edge to edges for
+    every pair of instructions executed.
+    """
+
+    ram = cpu.ram
+    reg = cpu.reg
+
+    previous = 0
+    # pc, opcode, stack pointer and size of the instruction that ran last, looked at once it is done
+    last = None
+
+    def covered(cycles, pc, entry):
+        nonlocal previous, last
+
+        if last is not None:
+            ran, IR, sp, size = last
+
+            # what happened - the flags after a CMP, otherwise a jump taken, the stack pointer
+            # moving by more than a push or pop (a wrap around, or a load), and a halt
+            if IR == CMP:
+                feature = IR << 3 | cpu.fl
+            else:
+                feature = (IR << 3 | (cpu.pc != (ran + size) & 0xFF) << 2 |
+                           (abs(reg[7] - sp) > 1) << 1 | (not cpu.running))
+
+            edges.add(previous << 11 | feature)
+            previous = feature
+            last = None
+
+        if pc is not None:
+            last = (pc, ram[pc], reg[7], entry[3])
+
+    try:
+        cpu.execute(max_cycles, hook=covered)
+    except InvalidInstruction:
+        # decode() raises these, so the instruction before did run
+        covered(cpu.cycles, None, None)
+        raise
+
+    covered(cpu.cycles, None, None)
+
+
+def failure(e):
+    """A short signature for an exception - its type and where it was raised."""
+
+    frame = traceback.extract_tb(e.__traceback__)[-1]
+    return f"{type(e).__name__} in {os.path.basename(frame.filename)}:{frame.name}"
+
+
+def final_state(cpu, output, status):
+    cpu.output.flush()
+    return (status, cpu.pc, cpu.fl, bytes(cpu.reg), bytes(cpu.ram), cpu.cycles, output.getvalue())
+
+
+def engine_run(image, max_cycles, engine, watchdog=False):
+    """
+    Run image on the plain decode loop, the fused interpreter or the translator,
+    with a stack watchdog over the image if watchdog is true. Returns the final
+    state, or the error type.
+    """
+
+    cpu, output = machine(image)
+
+    if watchdog:
+        StackWatchdog(cpu, len(image))
+
+    try:
+        if engine == "decode":
+            covered_run(cpu, max_cycles, set())
+        elif engine == "interpreter":
+            cpu.execute(max_cycles)
+        else:
+            BlockTranslator(cpu).run()
+    except Timeout:
+        return ("timeout",)
+    except InvalidInstruction:
+        return ("error",)
+    except Exception as e:
+        return ("crash", type(e).__name__)
+
+    if cpu.stack_overflow is not None:
+        status = "stack_overflow"
+    else:
+        status = "halted" if not cpu.running else "cycle_limit"
+
+    return final_state(cpu, output, status)
+
+
+def run_image(image, max_cycles=MAX_CYCLES):
+    """
+    Run one image on every engine. Returns a dict with status (halted,
+    cycle_limit, error or crash), the failure signature of a crash, a mismatch
+    description if the engines disagree, and the edges covered.
+    """
+
+    edges = set()
+    cpu, output = machine(image)
+    result = {"status": None, "failure": None, "mismatch": None}
+
+    # stores at the stack pointer inside the image, the ones a stack watchdog would stop at
+    caught = []
+    def written(address):
+        if address == cpu.reg[7]:
+            caught.append(address)
+    cpu.code_map[:len(image)] = b'\x01' * len(image)
+    cpu.code_listeners.append(written)
+
+    try:
+        covered_run(cpu, max_cycles, edges)
+        status = "halted" if not cpu.running else "cycle_limit"
+        reference = final_state(cpu, output, status)
+    except InvalidInstruction:
+        status, reference = "error", ("error",)
+    except Exception as e:
+        status, reference = "crash", ("crash", type(e).__name__)
+        result["failure"] = failure(e)
+
+    result["status"] = status
+    result["edges"] = list(edges)
+
+    engines = ["interpreter"] + (["translator"] if status == "halted" else [])
+
+    for engine in engines:
+        with alarm(TIMEOUT if engine == "translator" else None):
+            state = engine_run(image, max_cycles, engine)
+
+        if state != reference:
+            result["mismatch"] = f"{engine} {describe(reference, state)}"
+            return result
+
+    if status == "crash" or not caught:
+        return result
+
+    # the watchdog stops the cpu in the middle of an instruction, which every engine has to get right
+    reference = engine_run(image, max_cycles, "decode", True)
+    engines = ["interpreter"] + (["translator"] if reference[0] in ("halted", "stack_overflow") else [])
+
+    for engine in engines:
+        with alarm(TIMEOUT if engine == "translator" else None):
+            state = engine_run(image, max_cycles, engine, True)
+
+        if state != reference:
+            result["mismatch"] = f"{engine} with the watchdog {describe(reference, state)}"
+            break
+
+    return result
+
+
+def describe(expected, found):
+    """Which part of the final state two engines disagree on."""
+
+    if expected[0] != found[0] or len(expected) != len(found):
+        return f"ends with {' '.join(map(str, found))} instead of {' '.join(map(str, expected))}"
+
+    for name, a, b in zip(["status", "pc", "fl", "registers", "ram", "cycles", "output"], expected, found):
+        if a != b:
+            return f"{name} differ"
+
+    return "differs"
+
+
+@contextlib.contextmanager
+def alarm(seconds):
+    """
+    Raise Timeout in the block if it takes longer than seconds. Only on the main
+    thread. An alarm already running outside keeps counting down, and goes off
+    in here if it is due first.
+    """
+
+    import signal
+
+    if seconds is None or not hasattr(signal, "setitimer"):
+        yield
+        return
+
+    def timed_out(signum, frame):
+        raise Timeout()
+
+    outer = signal.getitimer(signal.ITIMER_REAL)[0]
+    started = time.monotonic()
+
+    previous = signal.signal(signal.SIGALRM, timed_out)
+    signal.setitimer(signal.ITIMER_REAL, min(seconds, outer) if outer else seconds)
+
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        if outer:
+            # a tiny delay rather than 0, which would cancel the outer alarm instead of firing it
+            signal.setitimer(signal.ITIMER_REAL, max(outer - (time.monotonic() - started), 1e-3))
+
+
+# -- running one assembler input -- #
+
+def load_assembler():
+    if ASM_DIR not in sys.path:
+        sys.path.insert(0, ASM_DIR)
+
+    import asm
+    import optimize
+
+    return asm, optimize
+
+
+def assemble_quietly(function, *args):
+    """Call an assembler function with its complaints on stderr swallowed. Returns (status, result)."""
+
+    with contextlib.redirect_stderr(io.StringIO()):
+        try:
+            return "ok", function(*args)
+        except SystemExit as e:
+            return "rejected", e.code
+
+
+def two_pass(asm, lines):
+    sym, code = {}, []
+    asm.pass1(lines, sym, code)
+
+    text = io.StringIO()
+    asm.pass2(text, sym, code)
+    # a byte in binary per line, some with the source after them, and comment lines for the labels.
+    # pass1 does not range check immediates, so an LDI of 285 writes nine bits - assemble() keeps
+    # the low byte of those, and so does this
+    return [int(line.split()[0], 2) & 0xFF for line in text.getvalue().splitlines()
+            if line.strip() and not line.startswith("#")]
+
+
+def traced(edges, files):
+    """A sys.settrace function adding (previous line, line) edges for code in files."""
+
+    previous = [0]
+
+    def local(frame, event, arg):
+        if event == "line":
+            line = frame.f_lineno
+            edges.add(previous[0] << 16 | line)
+            previous[0] = line
+        return local
+
+    def tracer(frame, event, arg):
+        if frame.f_code.co_filename in files:
+            return local
+        return None
+
+    return tracer
+
+
+def run_source(source, max_cycles=MAX_CYCLES):
+    """
+    Assemble source three ways and run the results. Returns the same kind of
+    dict as run_image, with line edges inside the assembler as coverage.
+    """
+
+    asm, optimize = load_assembler()
+    lines = source.splitlines(keepends=True)
+    result = {"status": None, "failure": None, "mismatch": None}
+    edges = set()
+
+    sys.settrace(traced(edges, {asm.__file__, optimize.__file__}))
+    try:
+        try:
+            status, single = assemble_quietly(asm.assemble, lines)
+            _, double = assemble_quietly(two_pass, asm, lines)
+            _, optimized = assemble_quietly(optimize.assemble, lines, False, None)
+        except Exception as e:
+            result["status"] = "crash"
+            result["failure"] = failure(e)
+            return result
+    finally:
+        sys.settrace(None)
+        result["edges"] = list(edges)
+
+    result["status"] = status
+
+    if status == "rejected":
+        if isinstance(double, list) or isinstance(optimized, tuple):
+            result["mismatch"] = "assemble() rejects what another assembler accepts"
+        return result
+
+    image = bytes(single[0])
+    if not isinstance(double, list) or double != list(image):
+        result["mismatch"] = "pass1/pass2 disagrees with assemble()"
+        return result
+
+    if not isinstance(optimized, tuple):
+        result["mismatch"] = "the optimizer rejects what assemble() accepts"
+        return result
+
+    if len(image) > MAX_IMAGE:
+        return result
+
+    # the optimized program has to print the same things and stop the same way - as long as it keeps
+    # to what the optimizer assumes. one that jumps somewhere other than a label, returns to whatever
+    # the stack holds, reads its own code or behaves differently when everything moves up a byte (it
+    # prints a label's address, say) may change too. the regressions are held to it anyway
+    strays = []
+    plain = run_program(image, max_cycles, (set(single[1].values()), code_bytes(optimize, lines), strays))
+    if plain[0] == "halted" and (source in ASM_REGRESSIONS or
+                                 not strays and run_moved(asm, lines, max_cycles) == plain):
+        better = run_program(bytes(optimized[0]), max_cycles)
+        if better != plain:
+            result["mismatch"] = "the optimized program behaves differently"
+
+    return result
+
+
+def run_moved(asm, lines, max_cycles):
+    """run_program() for the source assembled one byte further up, after a NOP."""
+
+    _, moved = assemble_quietly(asm.assemble, ["NOP\n"] + lines)
+    return run_program(bytes(moved[0]), max_cycles)
+
+
+def code_bytes(optimize, lines):
+    """The addresses of the instruction bytes in the unoptimized program."""
+
+    with contextlib.redirect_stderr(io.StringIO()):
+        items, _ = optimize.parse(lines)
+
+    code = set()
+    address = 0
+    for item in items:
+        if not item.is_data():
+            code.update(range(address, address + item.size()))
+        address += item.size()
+
+    return code
+
+
+def run_program(image, max_cycles, checked=None):
+    """
+    Run an assembled program. Returns its status and output. checked is an
+    optional (label addresses, code addresses, strays) - the address of every
+    instruction that sends the pc somewhere other than the next instruction or
+    a label, that returns anywhere but where its CALL or interrupt left off or
+    that loads a byte of code is added to strays.
+    """
+
+    cpu, output = machine(image)
+    hook = None if checked is None else transfers_checked(cpu, *checked)
+
+    try:
+        cpu.execute(max_cycles, hook=hook)
+    except Exception as e:
+        return (type(e).__name__,)
+
+    cpu.output.flush()
+    return ("halted" if not cpu.running else "cycle_limit", output.getvalue())
+
+
+def transfers_checked(cpu, labels, code, strays):
+    """A CPU.execute hook for run_program, checking where each instruction sends the pc and what LD reads."""
+
+    ram, reg = cpu.ram, cpu.reg
+
+    # the pc after each CALL and where each interrupt came in, newest last
+    expected = []
+    # pc, opcode and size of the instruction that ran last, and the pc and stack pointer
+    # before the interrupt controller ran
+    last = None
+    attended = None
+
+    def hook(cycles, pc, entry):
+        nonlocal last, attended
+
+        if last is not None:
+            ran, IR, size = last
+            if IR in RETURNS:
+                if not expected or expected.pop() != cpu.pc:
+                    strays.append(ran)
+            # a JMP to the next instruction is still a jump, the code after a JMP can go
+            elif cpu.pc not in labels and (IR == JMP or cpu.pc != (ran + size) & 0xFF):
+                strays.append(ran)
+            last = None
+
+        # an interrupt taken pushes nine bytes
+        if attended is not None:
+            before, sp = attended
+            if reg[7] == (sp - 9) & 0xFF:
+                expected.append(before)
+            attended = None
+
+        if pc is None:
+            attended = (cpu.pc, reg[7])
+            return
+
+        IR = ram[pc]
+        if IR == CALL:
+            expected.append((pc + 2) & 0xFF)
+        elif IR == LD and reg[entry[2]] in code:
+            strays.append(pc)
+        last = (pc, IR, entry[3])
+
+    return hook
+
+
+def run_inputs(inputs, max_cycles, assembler):
+    """Worker entry point - runs a batch of inputs and returns their results."""
+
+    run = run_source if assembler else run_image
+    results = []
+
+    for data in inputs:
+        try:
+            with alarm(HANG_TIMEOUT):
+                result = run(data, max_cycles)
+        except Timeout:
+            result = {"status": "hang", "failure": None, "mismatch": None, "edges": []}
+        results.append((data, result))
+
+    return results
+
+
+# -- generating and mutating inputs -- #
+
+OPCODE_BYTES = sorted(OPCODES)
+
+
+def random_instruction(rng, size=None):
+    """The bytes of a random valid instruction, with mostly sensible operands."""
+
+    IR = rng.choice(OPCODE_BYTES)
+    operands = []
+
+    for _ in range(OPCODES[IR].size - 1):
+        roll = rng.random()
+        if roll < 0.85:
+            operands.append(rng.randrange(8))
+        elif roll < 0.95:
+            operands.append(rng.randrange(size or MAX_IMAGE))
+        else:
+            operands.append(rng.randrange(256))
+
+    return bytes([IR] + operands)
+
+
+def generate_image(rng):
+    image = bytearray()
+    for _ in range(rng.randrange(1, 24)):
+        image += random_instruction(rng, 64)
+    image.append(BY_NAME["HLT"].code)
+    return bytes(image)
+
+
+def mutate_image(rng, image, corpus):
+    data = bytearray(image)
+
+    for _ in range(rng.choice((1, 1, 2, 4))):
+        roll = rng.random()
+        position = rng.randrange(len(data)) if data else 0
+
+        if roll < 0.2 and data:
+            data[position] ^= 1 << rng.randrange(8)
+        elif roll < 0.35 and data:
+            data[position] = rng.randrange(256)
+        elif roll < 0.45 and data:
+            # an address inside the program, where jump targets come from
+            data[position] = rng.randrange(len(data))
+        elif roll < 0.7:
+            data[position:position] = random_instruction(rng, len(data))
+        elif roll < 0.85 and len(data) > 1:
+            del data[position:position + rng.randrange(1, 4)]
+        else:
+            other = rng.choice(corpus)
+            start = rng.randrange(len(other))
+            data[position:] = other[start:start + rng.randrange(1, 32)]
+
+    return bytes(data[:MAX_IMAGE]) or generate_image(rng)
+
+
+def random_line(rng, labels):
+    """One line of assembly - mostly valid, sometimes not."""
+
+    asm, _ = load_assembler()
+    roll = rng.random()
+
+    if roll < 0.1:
+        label = f"L{rng.randrange(16)}"
+        labels.append(label)
+        return f"{label}:"
+    if roll < 0.15:
+        return f"    DB {', '.join(str(rng.randrange(300)) for _ in range(rng.randrange(1, 4)))}"
+    if roll < 0.2:
+        return f"    DS {rng.choice(['Hello', 'x', 'a b c', ''])}"
+    if roll < 0.25:
+        return rng.choice(["", "; a comment", "    # hash comment", "  \t  ", "LDI", "R0,R1", "FOO R1"])
+
+    name = rng.choice(list(asm.OPCODES))
+    kind = asm.OPCODES[name]["type"]
+
+    def register():
+        return f"R{rng.randrange(9) if rng.random() < 0.1 else rng.randrange(8)}"
+
+    if kind == 0:
+        operands = ""
+    elif kind == 1:
+        operands = register()
+    elif kind == 2:
+        operands = f"{register()},{register()}"
+    else:
+        value = rng.choice([str(rng.randrange(-5, 300)), hex(rng.randrange(256)),
+                            rng.choice(labels or ["Missing"]), f"L{rng.randrange(16)}"])
+        operands = f"{register()},{value}"
+
+    if rng.random() < 0.05:
+        operands = operands.replace(",", " , ") if rng.random() < 0.5 else operands.split(",")[0]
+
+    name = name.lower() if rng.random() < 0.05 else name
+    return f"    {name} {operands}".rstrip()
+
+
+def generate_source(rng):
+    labels = []
+    lines = [random_line(rng, labels) for _ in range(rng.randrange(1, 20))]
+    lines.append("    HLT")
+    return "\n".join(lines) + "\n"
+
+
+def mutate_source(rng, source, corpus):
+    lines = source.splitlines()
+    labels = [line[:-1] for line in lines if line.endswith(":")]
+
+    for _ in range(rng.choice((1, 1, 2, 3))):
+        roll = rng.random()
+        position = rng.randrange(len(lines) + 1)
+
+        if roll < 0.4:
+            lines.insert(position, random_line(rng, labels))
+        elif roll < 0.6 and lines:
+            del lines[min(position, len(lines) - 1)]
+        elif roll < 0.75 and lines:
+            lines.insert(position, rng.choice(lines))
+        elif roll < 0.9 and lines:
+            line = list(lines[min(position, len(lines) - 1)])
+            if line:
+                line[rng.randrange(len(line))] = rng.choice("R0123456789,:; xLDIAB#\t")
+            lines[min(position, len(lines) - 1)] = "".join(line)
+        else:
+            other = rng.choice(corpus).splitlines()
+            lines[position:position] = other[:rng.randrange(1, 8)]
+
+    return "\n".join(lines[:200]) + "\n"
+
+
+def seeds(assembler):
+    """The starting corpus - the example programs and sources."""
+
+    corpus = []
+
+    if assembler:
+        for name in sorted(os.listdir(ASM_DIR)):
+            if name.endswith(".asm"):
+                with open(os.path.join(ASM_DIR, name)) as file:
+                    corpus.append(file.read())
+        return corpus + ASM_REGRESSIONS
+
+    for name in sorted(os.listdir(EXAMPLES)):
+        if name.endswith(".ls8"):
+            cpu = CPU()
+            cpu.load(os.path.join(EXAMPLES, name))
+            used = max((address for address in range(MAX_IMAGE) if cpu.ram[address]), default=0) + 1
+            corpus.append(bytes(cpu.ram[:used]))
+
+    return corpus
+
+
+# -- minimizing and saving findings -- #
+
+def signature(result):
+    """What makes two findings the same finding."""
+    if result["mismatch"] is not None:
+        # the engine (or assembler) and what it got wrong, without the states themselves
+        return ("mismatch", " ".join(result["mismatch"].split(" ")[:2]))
+    if result["status"] == "crash":
+        return ("crash", result["failure"])
+    if result["status"] == "hang":
+        return ("hang", f"no result within {HANG_TIMEOUT:g}s")
+    return None
+
+
+def minimize(data, max_cycles, assembler):
+    """
+    Shrink an input while it still produces the same finding - removing chunks
+    of bytes (or lines), halving the chunk size whenever nothing can go.
+    """
+
+    run = run_source if assembler else run_image
+    wanted = signature(run(data, max_cycles))
+
+    if assembler:
+        units = data.splitlines(keepends=True)
+        join = "".join
+    else:
+        units = [bytes([b]) for b in data]
+        join = b"".join
+
+    chunk = max(len(units) // 2, 1)
+
+    while chunk >= 1:
+        position = 0
+        removed = False
+
+        while position < len(units):
+            candidate = units[:position] + units[position + chunk:]
+            if candidate and signature(run(join(candidate), max_cycles)) == wanted:
+                units = candidate
+                removed = True
+            else:
+                position += chunk
+
+        if not removed:
+            chunk //= 2
+
+    return join(units)
+
+
+def write_reproducer(directory, index, data, result, assembler):
+    """Save a finding as a program that shows it. Returns the filename."""
+
+    os.makedirs(directory, exist_ok=True)
+    kind, detail = signature(result)
+    header = [f"fuzz finding: {kind}", result["mismatch"] or result["failure"] or detail,
+              f"status: {result['status']}"]
+
+    if assembler:
+        filename = os.path.join(directory, f"{kind}-{index:03}.asm")
+        with open(filename, "w") as file:
+            file.write("".join(f"; {line}\n" for line in header) + data)
+        return filename
+
+    filename = os.path.join(directory, f"{kind}-{index:03}.ls8")
+    lines = [f"# {line}" for line in header]
+
+    # a comment at the start of every instruction a straight read of the bytes finds
+    address = 0
+    for position, byte in enumerate(data):
+        if position == address:
+            opcode = OPCODES.get(byte)
+            comment = f" # {position:02X}: {opcode.name if opcode else 'unknown opcode'}"
+            address += opcode.size if opcode else 1
+        else:
+            comment = ""
+        lines.append(f"{byte:08b}{comment}")
+
+    with open(filename, "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+    return filename
+
+
+# -- the fuzzing loop -- #
+
+def fuzz(runs=None, seconds=None, jobs=None, max_cycles=MAX_CYCLES, out="findings",
+         assembler=False, seed=None, report=sys.stderr):
+    """
+    Fuzz until runs inputs have run or seconds have passed. Returns the list of
+    reproducer files written.
+    """
+
+    rng = random.Random(seed)
+    corpus = seeds(assembler)
+    run = run_source if assembler else run_image
+    generate = generate_source if assembler else generate_image
+    mutate = mutate_source if assembler else mutate_image
+    workers = jobs or os.cpu_count() or 1
+
+    covered = set()
+    found = {}
+    written = []
+
+    executed = 0
+    started = last_report = time.monotonic()
+
+    def next_batch():
+        return [mutate(rng, rng.choice(corpus), corpus) if rng.random() < 0.9 else generate(rng)
+                for _ in range(BATCH)]
+
+    def finished():
+        if runs is not None and executed >= runs:
+            return True
+        return seconds is not None and time.monotonic() - started >= seconds
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(run_inputs, corpus, max_cycles, assembler)}
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                for data, result in future.result():
+                    executed += 1
+
+                    new = [edge for edge in result["edges"] if edge not in covered]
+                    if new:
+                        covered.update(new)
+                        corpus.append(data)
+
+                    key = signature(result)
+                    if key is not None and key not in found:
+                        # a hang would hang this process too, so it is saved as it is
+                        if key[0] == "hang":
+                            small = data
+                        else:
+                            small = minimize(data, max_cycles, assembler)
+                            result = run(small, max_cycles)
+                        found[key] = small
+                        filename = write_reproducer(out, len(found), small, result, assembler)
+                        written.append(filename)
+                        print(f"fuzz: {key[0]} {key[1]} -> {filename}", file=report)
+
+            now = time.monotonic()
+            if now - last_report >= 5:
+                last_report = now
+                print(f"fuzz: {executed} runs, {executed / (now - started):.0f}/s, {len(covered)} edges, "
+                      f"corpus {len(corpus)}, {len(found)} findings", file=report)
+
+            while not finished() and len(pending) < 2 * workers:
+                pending.add(pool.submit(run_inputs, next_batch(), max_cycles, assembler))
+
+    print(f"fuzz: done - {executed} runs, {len(covered)} edges, corpus {len(corpus)}, "
+          f"{len(found)} findings", file=report)
+
+    return written
@@ -0,0 +1,112 @@
+"""Host many LS-8 machines in one process on an asyncio event loop."""
+
+# Every machine runs as a task around CPU.run_async(), which executes one slice
+# of instructions and then yields. The event loop runs ready tasks in the order
+# they became ready, so busy machines take turns a slice at a time, while
+# machines that are spinning waiting for a key sleep without costing anything.
+#
+#   python ls8.py --serve examples/keyboard.ls8
+#   nc localhost 8008          # one machine per connection
+#
+# Each connection gets its own CPU. Bytes received are typed on its keyboard
+# and whatever it prints is sent back.
+
+import asyncio
+import sys
+
+from cpu import CPU
+from devices import KeyboardDevice, OutputDevice
+
+# instructions a machine runs before the next machine gets a turn, smaller than
+# cpu.SLICE so a few hundred busy machines still answer quickly
+HOST_SLICE = 1 << 12
+
+
+class Host:
+    """A set of machines sharing the running event loop."""
+
+    def __init__(self, slice_size=HOST_SLICE):
+        self.slice_size = slice_size
+
+        # name -> (cpu, task)
+        self.machines = {}
+
+    def add(self, name, cpu, max_cycles=None):
+        """Start running cpu as a task and return the task."""
+
+        task = asyncio.get_running_loop().create_task(cpu.run_async(self.slice_size, max_cycles))
+        task.add_done_callback(lambda task: self.finished(name, task))
+        self.machines[name] = (cpu, task)
+
+        return task
+
+    def remove(self, name):
+        """Stop a machine, wherever it is in its program."""
+
+        if name in self.machines:
+            cpu, task = self.machines.pop(name)
+            task.cancel()
+
+    def finished(self, name, task):
+        self.machines.pop(name, None)
+
+        if not task.cancelled() and task.exception() is not None:
+            print(f"{name}: {type(task.exception()).__name__}: {task.exception()}", file=sys.stderr)
+
+    async def join(self):
+        """Wait until every machine has halted or been removed."""
+        while self.machines:
+            await asyncio.gather(*(task for cpu, task in list(self.machines.values())), return_exceptions=True)
+
+    def stats(self):
+        """Cycles executed by each machine so far, busiest first."""
+        return sorted(((name, cpu.cycles) for name, (cpu, task) in self.machines.items()),
+                      key=lambda stat: -stat[1])
+
+
+class TransportSink:
+    """Sends output down an asyncio transport."""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def write(self, data):
+        if not self.transport.is_closing():
+            self.transport.write(data)
+
+
+class Session(asyncio.Protocol):
+    """One network connection driving one machine."""
+
+    def __init__(self, host, program):
+        self.host = host
+        self.program = program
+
+    def connection_made(self, transport):
+        self.name = "%s:%d" % transport.get_extra_info("peername")[:2]
+
+        cpu = CPU(OutputDevice(TransportSink(transport)))
+        cpu.load(self.program)
+        self.keyboard = KeyboardDevice(cpu)
+
+        # a program that halts hangs up on its user
+        task = self.host.add(self.name, cpu)
+        task.add_done_callback(lambda task: transport.close())
+
+    def data_received(self, data):
+        self.keyboard.feed(data)
+
+    def connection_lost(self, exc):
+        self.host.remove(self.name)
+
+
+async def serve(program, address="127.0.0.1", port=8008, slice_size=HOST_SLICE):
+    """Accept connections forever, running program for each one."""
+
+    host = Host(slice_size)
+    server = await asyncio.get_running_loop().create_server(lambda: Session(host, program), address, port)
+
+    print(f"serving {program} on {address}:{port}", file=sys.stderr)
+
+    async with server:
+        await server.serve_forever()
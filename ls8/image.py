@@ -0,0 +1,119 @@
+"""Binary program images (.ls8b)."""
+
+# The text .ls8 format needs every line split, sliced and parsed with int(num, 2).
+# A .ls8b image is the same program as raw bytes behind a small header, so it can
+# be read straight into ram.
+#
+# Layout (all fields little endian):
+#
+#   offset  size  field
+#   0       4     magic b"LS8B"
+#   4       1     format version (1)
+#   5       1     entry point - the pc after loading
+#   6       1     load address - where the code goes in ram
+#   7       1     reserved, 0
+#   8       2     code length in bytes
+#   10      2     number of symbols
+#   12      4     offset of the symbol table, 0 if there is none
+#   16      ...   code
+#
+# Each symbol table entry is one address byte, one name length byte and the
+# ascii name. asm/asm.py writes the same layout.
+
+import mmap
+import struct
+
+MAGIC = b"LS8B"
+VERSION = 1
+
+HEADER = struct.Struct("<4sBBBBHHI")
+
+
+class ImageError(Exception):
+    """Raised for files that are not valid .ls8b images."""
+
+
+def is_image(filename):
+    """True if the file starts with the .ls8b magic number."""
+    with open(filename, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def read_header(file):
+    """Read and check the header, returns (entry, load_address, length, symbol_count, symbol_offset)."""
+
+    header = bytearray(HEADER.size)
+    if file.readinto(header) != HEADER.size:
+        raise ImageError("truncated header")
+
+    magic, version, entry, load_address, _, length, symbol_count, symbol_offset = HEADER.unpack(header)
+
+    if magic != MAGIC:
+        raise ImageError("not an .ls8b image")
+
+    if version != VERSION:
+        raise ImageError(f"unsupported image version {version}")
+
+    return entry, load_address, length, symbol_count, symbol_offset
+
+
+def load_into(ram, filename):
+    """
+    Copy the code of an image straight into ram (a bytearray or writable
+    memoryview) with readinto. Returns the entry point and the address after
+    the code.
+    """
+
+    with open(filename, "rb") as file:
+        entry, load_address, length, _, _ = read_header(file)
+
+        if load_address + length > len(ram):
+            raise ImageError(f"{length} bytes at {load_address:02X} don't fit in ram")
+
+        view = memoryview(ram)[load_address:load_address + length]
+        if file.readinto(view) != length:
+            raise ImageError("truncated code")
+
+    return entry, load_address + length
+
+
+def read_symbols(filename):
+    """Return the symbol table of an image as a {name: address} dict."""
+
+    symbols = {}
+
+    with open(filename, "rb") as file:
+        _, _, _, symbol_count, symbol_offset = read_header(file)
+
+        if symbol_count == 0:
+            return symbols
+
+        # the symbol table sits at the end of the file, map it instead of reading the code again
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = symbol_offset
+
+            for _ in range(symbol_count):
+                address, name_length = data[position], data[position + 1]
+                name = data[position + 2:position + 2 + name_length].decode("ascii")
+                symbols[name] = address
+                position += 2 + name_length
+
+    return symbols
+
+
+def write_image(filename, code, entry=0, load_address=0, symbols=None):
+    """Write code (bytes) and an optional {name: address} symbol table as an .ls8b image."""
+
+    symbols = symbols or {}
+
+    table = bytearray()
+    for name, address in symbols.items():
+        encoded = name.encode("ascii")
+        table += bytes([address & 0xFF, len(encoded)]) + encoded
+
+    symbol_offset = HEADER.size + len(code) if symbols else 0
+
+    with open(filename, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, entry, load_address, 0, len(code), len(symbols), symbol_offset))
+        file.write(code)
+        file.write(table)
@@ -0,0 +1,166 @@
+"""Interrupt controller for the LS-8."""
+
+# Devices (and the timer) never touch the cpu's registers themselves. They call
+# request(), which records the interrupt as pending and raises cpu.attention -
+# the one flag the run loop checks between instructions. The run loop then
+# calls cpu.attend(), which lands here in service() to copy the pending bits
+# into IS (R6) and, if IM (R5) allows it, jump to the handler from the vector
+# table at 0xF8-0xFF as described in LS8-spec.md.
+#
+# Input devices such as the keyboard are attached with attach(). They get a
+# poll() call at the start of every service(), on the cpu's own thread, which
+# is where they move their input into ram and set their IS bit - the reading
+# thread only ever queues data and calls wake().
+#
+# The timer (interrupt 0) either runs on a host thread that requests an
+# interrupt every timer_interval seconds, or on the cpu's cycle count when
+# timer_cycles is given, which is deterministic and needs no thread at all.
+
+import threading
+
+# Where the interrupt vector table starts
+VECTOR_TABLE = 0xF8
+
+TIMER = 0
+KEYBOARD = 1
+
+
+class InterruptController:
+    """Pending interrupts, the timer and the interrupt sequence itself."""
+
+    def __init__(self, cpu, timer_interval=1.0, timer_cycles=None):
+        self.cpu = cpu
+
+        # interrupts are disabled between calling a handler and its IRET
+        self.enabled = True
+
+        # interrupt bits raised by devices since the last service()
+        self.pending = 0
+
+        # bits service() has put into IS that haven't been delivered yet, so recheck() can tell
+        # them apart from a program using R6 as an ordinary register
+        self.raised = 0
+        self.lock = threading.Lock()
+
+        self.timer_interval = timer_interval
+        self.timer_cycles = timer_cycles
+
+        # cycle count at which the cycle driven timer fires next, None without one
+        self.deadline = None if timer_cycles is None else cpu.cycles + timer_cycles
+
+        self.timer_thread = None
+        self.timer_stop = threading.Event()
+
+        # devices polled on every service(), see attach()
+        self.devices = []
+
+        # functions called by wake(), for runners that sleep while the program is idle
+        self.wake_listeners = []
+
+    def attach(self, device):
+        """
+        Attach an input device. It needs poll(), called from service() on the
+        cpu's thread, plus start() and stop(), called as the cpu starts and
+        stops running.
+        """
+        self.devices.append(device)
+
+    def wake(self):
+        """Make the run loop call service() before the next instruction. Safe to call from any thread."""
+        self.cpu.attention = True
+
+        for listener in self.wake_listeners:
+            listener()
+
+    def recheck(self):
+        """
+        Wake the cpu if IM lets through an interrupt that was masked when it
+        arrived. Writes to IM don't raise attention, so the run loop calls this
+        every so often instead.
+        """
+        if self.enabled and self.cpu.reg[5] & self.cpu.reg[6] & self.raised:
+            self.wake()
+
+    def request(self, number):
+        """Raise interrupt number. Safe to call from any thread."""
+
+        with self.lock:
+            self.pending |= 1 << number
+
+        self.wake()
+
+    def tick(self, cycles):
+        """Called by the run loop once the cycle count reaches the deadline."""
+
+        self.deadline = cycles + self.timer_cycles
+        self.request(TIMER)
+
+    def start(self, host_timer=True):
+        """
+        Start the devices and, unless host_timer is False, the host timer.
+        Called when the cpu starts running.
+        """
+
+        for device in self.devices:
+            device.start()
+
+        if not host_timer or self.timer_cycles is not None or self.timer_interval is None:
+            return
+
+        self.timer_stop.clear()
+        self.timer_thread = threading.Thread(target=self.run_timer, daemon=True)
+        self.timer_thread.start()
+
+    def stop(self):
+        """Stop the host timer and the devices, called when the cpu stops running."""
+
+        for device in self.devices:
+            device.stop()
+
+        if self.timer_thread is not None:
+            self.timer_stop.set()
+            self.timer_thread.join()
+            self.timer_thread = None
+
+    def run_timer(self):
+        # wait() returns False each time the interval passes without a stop
+        while not self.timer_stop.wait(self.timer_interval):
+            self.request(TIMER)
+
+    def service(self):
+        """Copy pending interrupts into IS and call the handler of the lowest unmasked one."""
+
+        cpu = self.cpu
+
+        with self.lock:
+            pending, self.pending = self.pending, 0
+
+        before = cpu.reg[6]
+        cpu.reg[6] |= pending
+
+        for device in self.devices:
+            device.poll()
+
+        self.raised |= pending | (cpu.reg[6] & ~before)
+
+        if not self.enabled:
+            return
+
+        masked_interrupts = cpu.reg[5] & cpu.reg[6]
+        if not masked_interrupts:
+            return
+
+        # lowest numbered interrupt wins
+        number = (masked_interrupts & -masked_interrupts).bit_length() - 1
+
+        self.enabled = False
+        cpu.reg[6] &= ~(1 << number) & 0xFF
+        self.raised &= ~(1 << number)
+
+        # push PC, FL and R0-R6, in that order
+        cpu.push_value(cpu.pc)
+        cpu.push_value(cpu.fl)
+        for register in range(7):
+            cpu.push_value(cpu.reg[register])
+
+        cpu.pc = cpu.ram_read(VECTOR_TABLE + number)
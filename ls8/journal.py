@@ -0,0 +1,393 @@
+"""Reverse execution for the LS-8 through an undo journal."""
+
+# The journal runs the cpu with a hook in its run loop that, before every
+# instruction, writes down what that instruction is about to overwrite - the pc
+# and flags, the registers it writes and the ram byte it stores to. Stepping
+# back puts those old values back, newest first.
+#
+#   cpu = CPU()
+#   cpu.load("examples/sctest.ls8")
+#   journal = Journal(cpu)
+#   journal.run()
+#   journal.step_back(10)          # the state 10 instructions before the end
+#   journal.back_to_write(0xF3)    # just before the last store to F3
+#   journal.run()                  # and forwards again
+#
+# Everything lives in one array of 32 bit words used as a ring buffer, so the
+# memory taken is fixed however long the program runs - once it is full the
+# oldest instructions are forgotten and can no longer be stepped back over.
+# Output that has been printed stays printed.
+#
+# It isn't free. The hook is a Python call per instruction, and a hooked run
+# can't fuse instructions, so a journaled run is about 2-5x slower than
+# CPU.run - 2.1x on macro/call and 2.3x on macro/mult, up to 5.2x on
+# micro/branch, where fusion does the most for the plain run (benchmark.py).
+# Most instructions take the short ways through the hook, a STEP word alone or
+# a STEP word and one REG word. Recording per block and replaying to step back
+# would be cheaper to run but would replay keyboard input and device stores.
+#
+# Word layout, tag in bits 28-29 - every word stays below 2**30, the most a
+# single digit Python int holds, and those are twice as quick to build and store:
+#
+#   STEP   00 e ffffffff pppppppppppppppp   one per instruction or interrupt (e set),
+#                                           with the old fl and pc
+#   REG    01 rrr vvvvvvvv                  register r held v
+#   RAM    10 aaaaaaaa vvvvvvvv             ram[a] held v
+#   BANK   10 1 bbbbbbbb                    bank b was mapped in, for a store to the
+#                                           bank select port of banked memory
+#   STATE  11 ... pending raised enabled running
+#
+# The words of an instruction follow its STEP word, so undoing one walks back
+# from the newest word to the closest STEP word.
+#
+# Switching back to the old bank is all undoing a bank switch takes. The
+# switch copied the window out to the old bank's page, and everything after it
+# has been undone by then, so the page and the window hold just what they did.
+
+from array import array
+
+from devices import KEY_ADDRESS
+from opcodes import OPCODES
+
+# default size of the ring in words, 4MB - roughly a quarter of a million instructions
+CAPACITY = 1 << 20
+MIN_CAPACITY = 1 << 6
+
+# most words one record takes - an interrupt delivery's STEP, STATE, eight registers,
+# ten ram bytes and a bank
+MAX_RECORD = 21
+
+STEP = 0 << 28
+REG = 1 << 28
+RAM = 2 << 28
+STATE = 3 << 28
+TAGS = 3 << 28
+
+# set in a STEP word for an interrupt being delivered rather than an instruction
+EVENT = 1 << 24
+
+# set in a RAM word that holds the bank mapped in rather than a byte
+SWITCH = 1 << 24
+
+# stands for operand a in WRITES
+A = -1
+
+# registers each instruction writes, by name
+WRITES = {
+    "LDI": (A,), "LD": (A,), "NOT": (A,), "INC": (A,), "DEC": (A,),
+    "ADD": (A,), "SUB": (A,), "MUL": (A,), "DIV": (A,), "MOD": (A,),
+    "AND": (A,), "OR": (A,), "XOR": (A,), "SHL": (A,), "SHR": (A,),
+    "PUSH": (7,), "CALL": (7,), "RET": (7,),
+    # POP R7 ends up with the popped value, so the stack pointer goes first
+    "POP": (7, A),
+    "INT": (6,),
+    "IRET": tuple(range(8)),
+}
+
+# instructions that store to ram below the stack pointer
+PUSHES = {"PUSH", "CALL"}
+
+# instructions that can change running or the interrupt enable
+STATEFUL = {"HLT", "DIV", "MOD", "IRET"}
+
+# how an instruction's record is written - a STEP word alone (jumps, CMP, output), a
+# STEP word and operand a's register (LDI and the ALU), or anything else
+STEP_ONLY = 0
+REGISTER_A = 1
+GENERAL = 2
+
+
+class Journal:
+    """Runs a CPU while keeping enough history to run it backwards."""
+
+    def __init__(self, cpu, capacity=CAPACITY):
+        self.cpu = cpu
+
+        # the ring - capacity is rounded up to a power of two so positions can be masked,
+        # and is never smaller than the words an interrupt delivery takes
+        self.capacity = 1 << (max(capacity, MIN_CAPACITY) - 1).bit_length()
+        self.mask = self.capacity - 1
+        self.words = array("I", bytes(4 * self.capacity))
+
+        # absolute positions of the oldest and one past the newest word
+        self.start = 0
+        self.end = 0
+
+        # instructions that can be stepped back over
+        self.steps = 0
+
+        # opcode -> (registers written, stores below the stack pointer, stores to ram[reg[a]], stateful)
+        self.effects = [None] * 256
+        # opcode -> how its record is written, so the commonest instructions take a short way
+        self.plans = bytearray([GENERAL] * 256)
+        for IR, opcode in OPCODES.items():
+            effects = (
+                WRITES.get(opcode.name, ()),
+                opcode.name in PUSHES,
+                opcode.name == "ST",
+                opcode.name in STATEFUL,
+            )
+            self.effects[IR] = effects
+            if effects == ((), False, False, False):
+                self.plans[IR] = STEP_ONLY
+            elif effects == ((A,), False, False, False):
+                self.plans[IR] = REGISTER_A
+
+    def put(self, word):
+        self.words[self.end & self.mask] = word
+        self.end += 1
+
+    # drops the oldest record to make room, a record being a STEP word and everything
+    # after it. returns 1 if that was an instruction, 0 for an interrupt delivery
+    def forget(self):
+        words, mask = self.words, self.mask
+        dropped = 0 if words[self.start & mask] & EVENT else 1
+
+        self.start += 1
+        while self.start < self.end and words[self.start & mask] & TAGS != STEP:
+            self.start += 1
+
+        return dropped
+
+    def state_word(self):
+        cpu = self.cpu
+        interrupts = cpu.interrupts
+        return (STATE | interrupts.pending << 16 | interrupts.raised << 8 |
+                interrupts.enabled << 1 | cpu.running)
+
+    # everything the interrupt controller can touch - the registers, the nine bytes
+    # it pushes, and the byte the keyboard stores its key in
+    def record_event(self):
+        cpu = self.cpu
+        reg, ram, put = cpu.reg, cpu.ram, self.put
+
+        put(STEP | EVENT | cpu.fl << 16 | cpu.pc)
+        put(self.state_word())
+        for register in range(8):
+            put(REG | register << 8 | reg[register])
+        for offset in range(1, 10):
+            address = (reg[7] - offset) & 0xFF
+            put(RAM | address << 8 | ram[address])
+        put(RAM | KEY_ADDRESS << 8 | ram[KEY_ADDRESS])
+
+        # a push can land on the bank select port like any other store
+        banks = cpu.banks
+        if banks is not None and 0 < (reg[7] - banks.port) & 0xFF < 10:
+            put(RAM | SWITCH | banks.bank)
+
+    def run(self, max_cycles=None, deadline=None):
+        """Run the CPU like CPU.run, journaling every instruction. Returns a RunResult."""
+
+        cpu = self.cpu
+        reg = cpu.reg
+        ram = cpu.ram
+        effects = self.effects
+        plans = self.plans
+        words = self.words
+        mask = self.mask
+        banks = cpu.banks
+        port = None if banks is None else banks.port
+
+        # the ring is written straight from the hook, which only has to make room
+        # for one whole instruction's words before each instruction - which it does
+        # once end gets past limit
+        room = self.capacity - MAX_RECORD
+        end = self.end
+        steps = self.steps
+        limit = self.start + room
+
+        def record(cycles, pc, entry):
+            nonlocal end, steps, limit
+
+            if end > limit:
+                while end - self.start > room:
+                    self.end = end
+                    steps -= self.forget()
+                limit = self.start + room
+
+            # the cpu is about to take an interrupt
+            if pc is None:
+                self.end = end
+                self.record_event()
+                end = self.end
+                return
+
+            IR = ram[pc]
+            plan = plans[IR]
+            steps += 1
+
+            if plan == REGISTER_A:
+                register = entry[1]
+                words[end & mask] = STEP | cpu.fl << 16 | pc
+                words[(end + 1) & mask] = REG | register << 8 | reg[register]
+                end += 2
+                return
+
+            words[end & mask] = STEP | cpu.fl << 16 | pc
+            end += 1
+            if plan == STEP_ONLY:
+                return
+
+            registers, pushes, stores, stateful = effects[IR]
+            if stateful:
+                words[end & mask] = self.state_word()
+                end += 1
+            for register in registers:
+                if register == A:
+                    register = entry[1]
+                words[end & mask] = REG | register << 8 | reg[register]
+                end += 1
+            if pushes:
+                address = (reg[7] - 1) & 0xFF
+            elif stores:
+                address = reg[entry[1]]
+            else:
+                return
+
+            words[end & mask] = RAM | address << 8 | ram[address]
+            end += 1
+            if address == port:
+                words[end & mask] = RAM | SWITCH | banks.bank
+                end += 1
+
+        try:
+            return cpu.run(max_cycles, deadline, hook=record)
+        finally:
+            self.steps = steps
+            self.end = end
+
+    def undo(self):
+        """
+        Undo the newest record. Returns (instructions undone, ram addresses
+        restored), the first being 0 for an interrupt delivery.
+        """
+
+        cpu = self.cpu
+        words, mask = self.words, self.mask
+        restored = []
+
+        while self.end > self.start:
+            self.end -= 1
+            word = words[self.end & mask]
+            tag = word & TAGS
+
+            if tag == REG:
+                cpu.reg[word >> 8 & 0b111] = word & 0xFF
+
+            elif tag == RAM and word & SWITCH:
+                banks = cpu.banks
+                if banks.bank != word & 0xFF:
+                    banks.switch(word & 0xFF)
+                    # neither the switch undone nor this one count
+                    banks.switches -= 2
+
+            elif tag == RAM:
+                address = word >> 8 & 0xFF
+                # straight into ram rather than through ram_write - putting a byte back isn't a store,
+                # so the devices on the bus mustn't hear about it. any code cached from the byte is
+                # still dropped
+                cpu.ram[address] = word & 0xFF
+                if cpu.code_map[address]:
+                    cpu.invalidate(address)
+                restored.append(address)
+
+            elif tag == STATE:
+                interrupts = cpu.interrupts
+                cpu.running = bool(word & 1)
+                interrupts.enabled = bool(word & 2)
+                interrupts.raised = word >> 8 & 0xFF
+                with interrupts.lock:
+                    interrupts.pending = word >> 16 & 0xFF
+
+            else:
+                cpu.pc = word & 0xFFFF
+                cpu.fl = word >> 16 & 0xFF
+                # the controller has a look at the restored state before the next instruction
+                cpu.attention = True
+
+                if word & EVENT:
+                    return 0, restored
+
+                # the stack watchdog stops the cpu in the middle of the store it catches, which has to
+                # be the newest instruction - undoing that undoes the stop
+                if cpu.stack_overflow is not None:
+                    cpu.stack_overflow = None
+                    cpu.running = True
+
+                cpu.cycles -= 1
+                self.steps -= 1
+                return 1, restored
+
+        return 0, restored
+
+    def step_back(self, n=1):
+        """Run backwards n instructions, or as many as the journal still has. Returns how many."""
+
+        done = 0
+        while done < n and self.steps:
+            undone, _ = self.undo()
+            done += undone
+
+        # interrupts delivered right before the last instruction undone go too, so the
+        # cpu is left exactly as it was after the instruction before
+        while self.newest_is_event():
+            self.undo()
+
+        return done
+
+    def newest_is_event(self):
+        words, mask = self.words, self.mask
+
+        position = self.end - 1
+        while position >= self.start:
+            word = words[position & mask]
+            if word & TAGS == STEP:
+                return bool(word & EVENT)
+            position -= 1
+
+        return False
+
+    def back_to_write(self, address):
+        """
+        Run backwards to just before the last instruction (or interrupt) that
+        stored to address. Returns False, having gone back as far as the
+        journal goes, if there is no such store in it.
+        """
+
+        while self.end > self.start:
+            _, restored = self.undo()
+            if address in restored:
+                return True
+
+        return False
+
+
+def trace_back(journal, n, file):
+    """
+    Write the last n instructions to file, one line each and oldest first - the
+    pc, the instruction bytes and the registers before it ran. The cpu and the
+    journal are left where they were.
+    """
+
+    cpu = journal.cpu
+    lines = []
+
+    # stepping back is how the journal finds the old states, so go back and then return to the end
+    blob = cpu.snapshot()
+    end, steps = journal.end, journal.steps
+    overflow = cpu.stack_overflow
+
+    try:
+        while len(lines) < n and journal.step_back(1):
+            pc = cpu.pc
+            code = " ".join(f"{cpu.ram[(pc + offset) & 0xFF]:02X}" for offset in range(3))
+            registers = " ".join(f"{value:02X}" for value in cpu.reg)
+            lines.append(f"{cpu.cycles:>10} | {pc:02X} | {code} | {cpu.fl:02X} | {registers}")
+    finally:
+        cpu.restore(blob)
+        journal.end, journal.steps = end, steps
+        cpu.stack_overflow = overflow
+
+    for line in reversed(lines):
+        print(line, file=file)
+
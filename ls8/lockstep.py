@@ -0,0 +1,266 @@
+"""Lockstep batch engine that runs many LS-8 machines at once with NumPy."""
+
+# Every lane is a complete LS-8 - its own ram, registers, pc and flags - but all
+# lanes share one program image. Each step the lanes are grouped by the
+# instruction they are about to execute (pc, opcode and operand bytes) and every
+# group executes that instruction as a handful of vectorized NumPy operations.
+# As long as the lanes follow the same path this is a single group per step;
+# when branches diverge the groups split and join again by pc.
+#
+#   machines = LockstepCPU(1000)
+#   machines.load("examples/mult.ls8")
+#   machines.reg[:, 0] = np.arange(1000) % 256
+#   machines.run()
+#   machines.outputs[3], machines.cycles[3]
+#
+# Final registers, flags, ram, outputs and cycle counts are the same as running
+# every lane on its own CPU through CPU.run(). The lanes have no interrupts and
+# no banked memory, so programs that need either are refused rather than run
+# differently - INT and IRET raise when a lane gets to them, and load() rejects
+# BANK sections.
+#
+# Requires numpy, which the plain CPU does not need.
+
+import numpy as np
+
+from cpu import CPU
+from opcodes import OPCODES, UnknownOpcode
+
+
+class LockstepCPU:
+    """N LS-8 machines stepped together."""
+
+    def __init__(self, lanes):
+        """Construct lanes machines in their power on state."""
+        self.lanes = lanes
+
+        self.ram = np.zeros((lanes, 0x100), dtype=np.uint8)
+        self.reg = np.zeros((lanes, 8), dtype=np.uint8)
+        self.reg[:, 7] = 0xF4
+
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.fl = np.zeros(lanes, dtype=np.uint8)
+        self.running = np.ones(lanes, dtype=bool)
+        self.cycles = np.zeros(lanes, dtype=np.int64)
+
+        # bytes printed by every lane, the same bytes an OutputDevice would receive
+        self.output = [bytearray() for _ in range(lanes)]
+
+        # the opcode table is the interpreter's too so both engines always agree on
+        # the instruction set - every opcode maps to the op_ method of the same name
+        self.size = {}
+        self.pc_set = {}
+        self.handlers = {}
+        for IR, opcode in OPCODES.items():
+            self.size[IR] = opcode.size
+            self.pc_set[IR] = opcode.pc_set
+            self.handlers[IR] = getattr(self, "op_" + opcode.name, None)
+
+    @property
+    def outputs(self):
+        """Everything each lane has printed, as bytes."""
+        return [bytes(out) for out in self.output]
+
+    def load(self, filename):
+        """Load the same program into the ram of every lane."""
+        cpu = CPU()
+        cpu.load(filename)
+
+        # the banked bytes went into pages only the cpu has
+        if cpu.banks is not None:
+            raise ValueError(f"{filename} has BANK sections, the lockstep engine has no banked memory")
+
+        self.load_image(cpu.ram)
+
+    def load_image(self, image, address=0):
+        """Copy the bytes of a program image into every lane starting at address."""
+        image = np.frombuffer(bytes(image), dtype=np.uint8)
+        self.ram[:, address:address + len(image)] = image
+
+    def step(self):
+        """Execute one instruction on every running lane."""
+
+        active = np.flatnonzero(self.running)
+        if len(active) == 0:
+            return
+
+        pc = self.pc[active]
+        IR = self.ram[active, pc].astype(np.int64)
+        operand_a = self.ram[active, (pc + 1) & 0xFF].astype(np.int64)
+        operand_b = self.ram[active, (pc + 2) & 0xFF].astype(np.int64)
+
+        # lanes that are at the same pc running the same bytes form one group
+        key = (pc << 24) | (IR << 16) | (operand_a << 8) | operand_b
+        order = np.argsort(key, kind="stable")
+        key = key[order]
+        splits = np.flatnonzero(key[1:] != key[:-1]) + 1
+
+        for group in np.split(order, splits):
+            first = group[0]
+            lanes = active[group]
+            op = int(IR[first])
+
+            if op not in self.handlers:
+                raise UnknownOpcode(op, int(pc[first]))
+
+            handler = self.handlers[op]
+            if handler is None:
+                raise NotImplementedError(f"{OPCODES[op].name} at address {int(pc[first]):02X}, "
+                                          f"the lockstep engine has no interrupts")
+
+            size = self.size[op]
+            a = int(operand_a[first]) if size > 1 else 0
+            b = int(operand_b[first]) if size > 2 else 0
+
+            handler(lanes, a, b)
+
+            if not self.pc_set[op]:
+                self.pc[lanes] = (self.pc[lanes] + size) & 0xFF
+
+        self.cycles[active] += 1
+
+    def run(self, max_cycles=None):
+        """Step until every lane has halted, or until max_cycles steps."""
+
+        steps = 0
+        while self.running.any():
+            if max_cycles is not None and steps >= max_cycles:
+                break
+
+            self.step()
+            steps += 1
+
+    # instruction handlers - each one runs on the lanes of a group with the shared operands #
+
+    def op_HLT(self, lanes, _a, _b):
+        self.running[lanes] = False
+
+    def op_LDI(self, lanes, a, b):
+        self.reg[lanes, a] = b
+
+    def op_ADD(self, lanes, a, b):
+        # uint8 arithmetic wraps around on its own
+        self.reg[lanes, a] = self.reg[lanes, a] + self.reg[lanes, b]
+
+    def op_SUB(self, lanes, a, b):
+        self.reg[lanes, a] = self.reg[lanes, a] - self.reg[lanes, b]
+
+    def op_INC(self, lanes, a, _):
+        self.reg[lanes, a] += 1
+
+    def op_DEC(self, lanes, a, _):
+        self.reg[lanes, a] -= 1
+
+    def op_NOP(self, lanes, _a, _b):
+        pass
+
+    def op_MUL(self, lanes, a, b):
+        self.reg[lanes, a] = self.reg[lanes, a] * self.reg[lanes, b]
+
+    def op_AND(self, lanes, a, b):
+        self.reg[lanes, a] = self.reg[lanes, a] & self.reg[lanes, b]
+
+    def op_OR(self, lanes, a, b):
+        self.reg[lanes, a] = self.reg[lanes, a] | self.reg[lanes, b]
+
+    def op_XOR(self, lanes, a, b):
+        self.reg[lanes, a] = self.reg[lanes, a] ^ self.reg[lanes, b]
+
+    def op_NOT(self, lanes, a, _):
+        self.reg[lanes, a] = ~self.reg[lanes, a]
+
+    def op_SHL(self, lanes, a, b):
+        # shifting by 8 or more clears the byte, which numpy won't promise for uint8
+        value = self.reg[lanes, a].astype(np.int64)
+        shift = self.reg[lanes, b].astype(np.int64)
+        self.reg[lanes, a] = np.where(shift < 8, (value << np.minimum(shift, 8)) & 0xFF, 0)
+
+    def op_SHR(self, lanes, a, b):
+        value = self.reg[lanes, a].astype(np.int64)
+        shift = self.reg[lanes, b].astype(np.int64)
+        self.reg[lanes, a] = np.where(shift < 8, value >> np.minimum(shift, 8), 0)
+
+    def op_MOD(self, lanes, a, b):
+        ok = self.divisible(lanes, b)
+        self.reg[ok, a] = self.reg[ok, a] % self.reg[ok, b]
+
+    def op_DIV(self, lanes, a, b):
+        ok = self.divisible(lanes, b)
+        self.reg[ok, a] = self.reg[ok, a] // self.reg[ok, b]
+
+    # halts the lanes dividing by zero the way the cpu does and returns the rest
+    def divisible(self, lanes, b):
+        zero = self.reg[lanes, b] == 0
+
+        for lane in lanes[zero]:
+            self.output[lane] += b"ERROR: Cannot divide by 0\n"
+        self.running[lanes[zero]] = False
+
+        return lanes[~zero]
+
+    def op_CMP(self, lanes, a, b):
+        x = self.reg[lanes, a]
+        y = self.reg[lanes, b]
+        self.fl[lanes] = np.where(x == y, 0b00000001, np.where(x > y, 0b00000010, 0b00000100))
+
+    def op_PRN(self, lanes, a, _):
+        for lane, value in zip(lanes.tolist(), self.reg[lanes, a].tolist()):
+            self.output[lane] += b"%d\n" % value
+
+    def op_PRA(self, lanes, a, _):
+        for lane, value in zip(lanes.tolist(), self.reg[lanes, a].tolist()):
+            self.output[lane].append(value)
+
+    def op_ST(self, lanes, a, b):
+        self.ram[lanes, self.reg[lanes, a]] = self.reg[lanes, b]
+
+    def op_LD(self, lanes, a, b):
+        self.reg[lanes, a] = self.ram[lanes, self.reg[lanes, b]]
+
+    def op_PUSH(self, lanes, a, _):
+        self.reg[lanes, 7] -= 1
+        self.ram[lanes, self.reg[lanes, 7]] = self.reg[lanes, a]
+
+    def op_POP(self, lanes, a, _):
+        sp = self.reg[lanes, 7]
+        self.reg[lanes, a] = self.ram[lanes, sp]
+        self.reg[lanes, 7] += 1
+
+    def op_CALL(self, lanes, a, _):
+        return_address = (self.pc[lanes] + 2) & 0xFF
+        self.reg[lanes, 7] -= 1
+        self.ram[lanes, self.reg[lanes, 7]] = return_address
+        self.pc[lanes] = self.reg[lanes, a]
+
+    def op_RET(self, lanes, _a, _b):
+        sp = self.reg[lanes, 7]
+        self.pc[lanes] = self.ram[lanes, sp]
+        self.reg[lanes, 7] = sp + 1
+
+    def op_JMP(self, lanes, a, _):
+        self.pc[lanes] = self.reg[lanes, a]
+
+    def op_JEQ(self, lanes, a, _):
+        taken = (self.fl[lanes] & 0b00000001) != 0
+        self.pc[lanes] = np.where(taken, self.reg[lanes, a], (self.pc[lanes] + 2) & 0xFF)
+
+    def op_JNE(self, lanes, a, _):
+        taken = (self.fl[lanes] & 0b00000001) == 0
+        self.pc[lanes] = np.where(taken, self.reg[lanes, a], (self.pc[lanes] + 2) & 0xFF)
+
+    def op_JGT(self, lanes, a, _):
+        self.jump_if(lanes, a, 0b00000010)
+
+    def op_JGE(self, lanes, a, _):
+        self.jump_if(lanes, a, 0b00000011)
+
+    def op_JLT(self, lanes, a, _):
+        self.jump_if(lanes, a, 0b00000100)
+
+    def op_JLE(self, lanes, a, _):
+        self.jump_if(lanes, a, 0b00000101)
+
+    # jumps the lanes with any of the flags in mask set, the rest go on to the next instruction
+    def jump_if(self, lanes, a, mask):
+        taken = (self.fl[lanes] & mask) != 0
+        self.pc[lanes] = np.where(taken, self.reg[lanes, a], (self.pc[lanes] + 2) & 0xFF)
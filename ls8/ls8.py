@@ -3,9 +3,252 @@
 """Main."""
 
 import sys
+import argparse
 from cpu import *
 
-cpu = CPU()
 
-cpu.load()
-cpu.run()
\ No newline at end of file
+def batch_main(argv):
+    """
+    Usage: ls8.py --batch [options] program.ls8|'glob/*.ls8' ...
+    """
+
+    from batch import expand_programs, run_batch, write_summary, print_table
+
+    parser = argparse.ArgumentParser(prog="ls8.py --batch")
+    parser.add_argument("programs", nargs="+", help="program files or globs, e.g. 'examples/*.ls8'")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds before a program is stopped")
+    parser.add_argument("--max-cycles", type=int, default=None, help="instructions before a program is stopped")
+    parser.add_argument("-o", "--summary", default=None, help="write a .json or .csv summary here")
+    parser.add_argument("--input", default=None, help="file typed on the keyboard of every program")
+    parser.add_argument("--watchdog", action="store_true", help="stop a program whose stack runs into its code")
+    args = parser.parse_args(argv)
+
+    programs = expand_programs(args.programs)
+    if not programs:
+        print("No programs found.")
+        return 1
+
+    results = run_batch(programs, args.jobs, args.max_cycles, args.timeout, args.input, args.watchdog)
+    print_table(results)
+
+    if args.summary:
+        write_summary(results, args.summary)
+
+    return 0
+
+
+def fuzz_main(argv):
+    """
+    Usage: ls8.py --fuzz [--asm] [options]
+    """
+
+    from fuzz import MAX_CYCLES, fuzz
+
+    parser = argparse.ArgumentParser(prog="ls8.py --fuzz")
+    parser.add_argument("--asm", action="store_true", help="fuzz the assembler instead of the cpu")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    parser.add_argument("--runs", type=int, default=None, help="stop after this many inputs")
+    parser.add_argument("--seconds", type=float, default=None, help="stop after this long (default: run until interrupted)")
+    parser.add_argument("--max-cycles", type=int, default=MAX_CYCLES, help="instructions before an input counts as a hang")
+    parser.add_argument("--out", default="findings", help="directory for the minimized reproducers")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the input generator")
+    args = parser.parse_args(argv)
+
+    written = fuzz(args.runs, args.seconds, args.jobs, args.max_cycles, args.out, args.asm, args.seed)
+
+    return 1 if written else 0
+
+
+def profile_main(argv):
+    """
+    Usage: ls8.py --profile [-o stacks.folded] program.ls8
+    """
+
+    from profiler import Profiler, load_symbols
+
+    parser = argparse.ArgumentParser(prog="ls8.py --profile")
+    parser.add_argument("program")
+    parser.add_argument("-o", "--collapsed", default=None, help="write collapsed call stacks here for flame graphs")
+    parser.add_argument("--top", type=int, default=10, help="entries per section of the report")
+    args = parser.parse_args(argv)
+
+    cpu = CPU()
+    cpu.load(args.program)
+
+    profiler = Profiler(cpu, load_symbols(args.program))
+    profiler.run()
+
+    print(profiler.report(args.top), file=sys.stderr)
+
+    if args.collapsed:
+        profiler.write_collapsed(args.collapsed)
+
+    return 0
+
+
+def serve_main(argv):
+    """
+    Usage: ls8.py --serve [--port 8008] program.ls8
+    """
+
+    import asyncio
+    from host import HOST_SLICE, serve
+
+    parser = argparse.ArgumentParser(prog="ls8.py --serve")
+    parser.add_argument("program")
+    parser.add_argument("--address", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8008, help="port to listen on")
+    parser.add_argument("--slice", type=int, default=HOST_SLICE, help="instructions per turn of each machine")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.program, args.address, args.port, args.slice))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def run_main(argv):
+    """
+    Usage: ls8.py [--input keys.txt] [--check] [--blocks cfg.json] [--banks] [--devices] [--watchdog] [--back N | --trace run.ls8t] [--max-cycles N] [--timeout S] [--save state.ls8s] program.ls8|state.ls8s
+    """
+
+    import snapshot
+    from devices import KeyboardDevice
+
+    parser = argparse.ArgumentParser(prog="ls8.py")
+    parser.add_argument("program", help="a program, or a snapshot to resume")
+    parser.add_argument("--input", default=None, help="file typed on the keyboard instead of stdin")
+    parser.add_argument("--max-cycles", type=int, default=None, help="instructions before the program is stopped")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds before the program is stopped")
+    parser.add_argument("--watchdog", action="store_true",
+                        help="stop the program if its stack runs into its code (see watchdog.py)")
+    parser.add_argument("--save", default=None, help="snapshot the machine here if it is stopped before it halts")
+    parser.add_argument("--stats", action="store_true", help="print cycle and fusion counts when the program stops")
+    parser.add_argument("--check", action="store_true",
+                        help="refuse a program that might run into a byte that isn't an instruction (see cfg.py)")
+    parser.add_argument("--blocks", default=None, help="block map written by cfg.py, decoded before the program starts")
+    parser.add_argument("--banks", action="store_true",
+                        help="give the machine banked memory, switched with the port at F5 (see banks.py)")
+    parser.add_argument("--devices", action="store_true",
+                        help="put the console at F6 and the timer and counter at F7 on the memory bus (see bus.py)")
+    parser.add_argument("--back", type=int, default=None, metavar="N",
+                        help="journal the run and print the last N instructions when it stops")
+    parser.add_argument("--trace", default=None, help="record a binary trace of the run here (see recorder.py)")
+    parser.add_argument("--trace-pcs", default=None, metavar="FIRST:LAST",
+                        help="only trace instructions at these hex addresses, e.g. 10:3F")
+    parser.add_argument("--trace-ops", default=None, metavar="NAMES", help="only trace these opcodes, e.g. CALL,RET")
+    parser.add_argument("--trace-every", type=int, default=1, metavar="N", help="only trace every Nth instruction")
+    parser.add_argument("--trace-compress", action="store_true", help="compress the trace")
+    args = parser.parse_args(argv)
+
+    if args.trace and args.back:
+        parser.error("--trace and --back each hook into the run their own way, pick one")
+
+    cpu = CPU()
+
+    # programs with BANK sections get banked memory when they are loaded anyway
+    if args.banks:
+        from banks import BankedMemory
+        BankedMemory(cpu)
+
+    if args.devices:
+        from devices import ConsoleDevice, CounterDevice, TimerDevice
+        ConsoleDevice(cpu)
+        TimerDevice(cpu)
+        CounterDevice(cpu)
+
+    if args.program.endswith(".ls8s"):
+        cpu.restore(snapshot.load(args.program))
+    elif args.blocks:
+        from cfg import load_block_map
+        cpu.load(args.program, load_block_map(args.blocks), args.check)
+    else:
+        cpu.load(args.program, check=args.check)
+
+    # the watchdog hears about pushes through the code map, so it works however the program is run
+    if args.watchdog:
+        from watchdog import StackWatchdog
+        StackWatchdog(cpu)
+
+    # with --back every instruction is journaled, so the end of the run can be shown afterwards
+    journal = None
+    run = cpu.run
+    if args.back:
+        from journal import Journal, trace_back
+        journal = Journal(cpu)
+        run = journal.run
+
+    recorder = None
+    if args.trace:
+        from recorder import TraceRecorder
+        pcs = None if args.trace_pcs is None else tuple(int(pc, 16) for pc in args.trace_pcs.split(":"))
+        opcodes = None if args.trace_ops is None else set(args.trace_ops.upper().split(","))
+        recorder = TraceRecorder(cpu, args.trace, pcs, opcodes, args.trace_every, args.trace_compress)
+        run = recorder.run
+
+    deadline = None
+    if args.timeout is not None:
+        import time
+        deadline = time.monotonic() + args.timeout
+
+    try:
+        if args.input is None:
+            KeyboardDevice(cpu, sys.stdin)
+            result = run(args.max_cycles, deadline)
+        else:
+            with open(args.input, "rb") as keys:
+                KeyboardDevice(cpu, keys)
+                result = run(args.max_cycles, deadline)
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+        if journal is not None:
+            print(f"last {args.back} instructions:", file=sys.stderr)
+            trace_back(journal, args.back, sys.stderr)
+
+    if cpu.stack_overflow is not None:
+        print(f"stack overflow: pushed into the program at {cpu.stack_overflow:02X}", file=sys.stderr)
+
+    if result.error is not None:
+        print(f"error: {result.error}", file=sys.stderr)
+
+    if args.save and cpu.running:
+        snapshot.save(args.save, cpu.snapshot())
+
+    if args.stats:
+        stats = cpu.stats()
+        print(f"{stats['cycles']} cycles, {stats['fused_instructions']} fused "
+              f"({stats['fusion_rate']:.1%})", file=sys.stderr)
+        for pattern, hits in stats["fusions"].items():
+            print(f"  {pattern:<16} {hits}", file=sys.stderr)
+        print(f"stopped: {result.reason}, {result.ips:,.0f} instructions/s", file=sys.stderr)
+        if cpu.banks is not None:
+            banks = cpu.banks.stats()
+            print(f"bank {banks['bank']}, {banks['switches']} switches, {banks['pages']} pages "
+                  f"({banks['bytes']} of {banks['capacity']} bytes)", file=sys.stderr)
+        if cpu.bus is not None:
+            bus = cpu.bus.stats()
+            devices = ", ".join(f"{name} {start:02X}" for name, start, end in bus["devices"])
+            print(f"{bus['reads']} device loads, {bus['writes']} device stores ({devices})", file=sys.stderr)
+
+    return 1 if result.error is not None else 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        sys.exit(batch_main(sys.argv[2:]))
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--fuzz":
+        sys.exit(fuzz_main(sys.argv[2:]))
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--profile":
+        sys.exit(profile_main(sys.argv[2:]))
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        sys.exit(serve_main(sys.argv[2:]))
+
+    sys.exit(run_main(sys.argv[1:]))
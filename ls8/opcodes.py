@@ -0,0 +1,89 @@
+"""The LS-8 instruction set."""
+
+# Every opcode the assembler knows, in one table. The cpu builds its branchtable
+# from it - each opcode dispatches to the CPU method of the same name - and the
+# other engines and tools (lockstep.py, cfg.py) read names and sizes from here
+# too, so there is exactly one place that says what an opcode is.
+#
+# format of an opcode is AABCDDDD
+# AA - Number of operands for this opcode, 0-2
+# B - 1 if this is an ALU operation
+# C - 1 if this instruction sets the PC
+# DDDD - Instruction identifier
+
+from collections import namedtuple
+
+SPEC = [
+    ("NOP",  0b00000000),
+    ("HLT",  0b00000001),
+    ("RET",  0b00010001),
+    ("IRET", 0b00010011),
+    ("PUSH", 0b01000101),
+    ("POP",  0b01000110),
+    ("PRN",  0b01000111),
+    ("PRA",  0b01001000),
+    ("CALL", 0b01010000),
+    ("INT",  0b01010010),
+    ("JMP",  0b01010100),
+    ("JEQ",  0b01010101),
+    ("JNE",  0b01010110),
+    ("JGT",  0b01010111),
+    ("JLT",  0b01011000),
+    ("JLE",  0b01011001),
+    ("JGE",  0b01011010),
+    ("INC",  0b01100101),
+    ("DEC",  0b01100110),
+    ("NOT",  0b01101001),
+    ("LDI",  0b10000010),
+    ("LD",   0b10000011),
+    ("ST",   0b10000100),
+    ("ADD",  0b10100000),
+    ("SUB",  0b10100001),
+    ("MUL",  0b10100010),
+    ("DIV",  0b10100011),
+    ("MOD",  0b10100100),
+    ("CMP",  0b10100111),
+    ("AND",  0b10101000),
+    ("OR",   0b10101010),
+    ("XOR",  0b10101011),
+    ("SHL",  0b10101100),
+    ("SHR",  0b10101101),
+]
+
+# registers is how many of the operands name a register - all of them, except
+# that LDI's second operand is the value it loads
+Opcode = namedtuple("Opcode", "name code size alu pc_set registers")
+
+# opcode byte -> Opcode
+OPCODES = {
+    code: Opcode(name, code, 1 + (code >> 6), code >> 5 & 1, code >> 4 & 1,
+                 1 if name == "LDI" else code >> 6)
+    for name, code in SPEC
+}
+
+# instruction name -> Opcode
+BY_NAME = {opcode.name: opcode for opcode in OPCODES.values()}
+
+
+class InvalidInstruction(Exception):
+    """Raised when the cpu gets to bytes that can't be executed."""
+
+
+class UnknownOpcode(InvalidInstruction):
+    """Raised for a byte that would be executed but is not an instruction."""
+
+    def __init__(self, IR, address):
+        super().__init__(f"Unknown opcode {IR:08b} at address {address:02X}")
+        self.IR = IR
+        self.address = address
+
+
+class UnknownRegister(InvalidInstruction):
+    """Raised for an instruction with a register operand past R7."""
+
+    def __init__(self, IR, address, register):
+        super().__init__(f"{OPCODES[IR].name} at address {address:02X} names register {register}, "
+                         f"there are only R0-R7")
+        self.IR = IR
+        self.address = address
+        self.register = register
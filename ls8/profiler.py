@@ -0,0 +1,164 @@
+"""Execution profiler for the LS-8."""
+
+# The profiler runs the cpu with a hook in its run loop that counts every
+# instruction by opcode and by address, and keeps a shadow call stack to time
+# every CALL target. Without a hook CPU.run has no profiling code in its way, so
+# a normal run pays nothing for any of this.
+#
+#   cpu = CPU()
+#   cpu.load("examples/call.ls8")
+#   profiler = Profiler(cpu, load_symbols("examples/call.ls8"))
+#   profiler.run()
+#   print(profiler.report())
+#   profiler.write_collapsed("call.folded")   # for flamegraph.pl / speedscope
+
+import re
+
+from image import read_symbols
+
+CALL = 0b01010000
+RET = 0b00010001
+
+# label lines the assembler writes into .ls8 files
+LABEL_LINE = re.compile(r"#\s*(\w+)\s*\(address (\d+)\):")
+
+
+def load_symbols(filename):
+    """Read the labels of a program as an {address: name} dict."""
+
+    if filename.endswith(".ls8b"):
+        return {address: name for name, address in read_symbols(filename).items()}
+
+    symbols = {}
+    with open(filename) as file:
+        for line in file:
+            m = LABEL_LINE.match(line.strip())
+            if m is not None:
+                symbols[int(m.group(2))] = m.group(1)
+
+    return symbols
+
+
+class Profiler:
+    """Counts executions per opcode, per pc and per CALL target."""
+
+    def __init__(self, cpu, symbols=None):
+        self.cpu = cpu
+        self.symbols = symbols or {}
+
+        # opcode and pc are both bytes, so plain 256 entry lists cover every value
+        self.op_counts = [0] * 256
+        self.pc_counts = [0] * 256
+
+        # per CALL target: number of calls, inclusive cycles, exclusive cycles
+        self.calls = {}
+
+        # cycles spent in each distinct call stack, keyed by the tuple of frame names
+        self.stacks = {}
+
+    def name(self, address):
+        return self.symbols.get(address, f"0x{address:02X}")
+
+    def run(self, max_cycles=None, deadline=None):
+        """Run the CPU like CPU.run, counting everything as it goes. Returns a RunResult."""
+
+        cpu = self.cpu
+        ram = cpu.ram
+        op_counts = self.op_counts
+        pc_counts = self.pc_counts
+
+        # shadow call stack - [target, cycles at entry, cycles spent in callees]
+        frames = [[cpu.pc, cpu.cycles, 0]]
+        path = (self.symbols.get(cpu.pc, "main"),)
+        last_switch = cpu.cycles
+
+        # a CALL or RET that has run, looked at once it is done - at the next hook call or the end of the run
+        called = None
+
+        def switch(cycles):
+            nonlocal path, last_switch
+
+            # the collapsed stacks only change when the call stack does
+            self.stacks[path] = self.stacks.get(path, 0) + cycles - last_switch
+            last_switch = cycles
+
+            if called == CALL:
+                frames.append([cpu.pc, cycles, 0])
+                path = path + (self.name(cpu.pc),)
+            else:
+                target, start, children = frames.pop()
+                inclusive = cycles - start
+                frames[-1][2] += inclusive
+                path = path[:-1]
+
+                count, total, own = self.calls.get(target, (0, 0, 0))
+                self.calls[target] = (count + 1, total + inclusive, own + inclusive - children)
+
+        def count(cycles, pc, entry):
+            nonlocal called
+
+            if called is not None:
+                switch(cycles)
+                called = None
+
+            if pc is None:
+                return
+
+            IR = ram[pc]
+            op_counts[IR] += 1
+            pc_counts[pc] += 1
+
+            if IR == CALL or (IR == RET and len(frames) > 1):
+                called = IR
+
+        try:
+            result = cpu.run(max_cycles, deadline, hook=count)
+            # the last instruction is done too now
+            count(cpu.cycles, None, None)
+            return result
+        finally:
+            self.stacks[path] = self.stacks.get(path, 0) + cpu.cycles - last_switch
+
+    def opcode_names(self):
+        return {IR: handler.__name__ for IR, handler in self.cpu.branchtable.items()}
+
+    def report(self, top=10):
+        """Return a text report of the hottest opcodes, addresses and subroutines."""
+
+        names = self.opcode_names()
+        total = sum(self.op_counts) or 1
+        lines = []
+
+        lines.append(f"{sum(self.op_counts)} instructions")
+        lines.append("")
+        lines.append("opcode       count      %")
+        ops = sorted(range(256), key=lambda IR: -self.op_counts[IR])
+        for IR in ops[:top]:
+            if self.op_counts[IR]:
+                lines.append(f"{names.get(IR, f'{IR:08b}'):<6} {self.op_counts[IR]:>11} {100 * self.op_counts[IR] / total:6.2f}")
+
+        lines.append("")
+        lines.append("address            count      %")
+        pcs = sorted(range(256), key=lambda pc: -self.pc_counts[pc])
+        for pc in pcs[:top]:
+            if self.pc_counts[pc]:
+                symbol = self.symbols.get(pc, "")
+                lines.append(f"{pc:02X} {symbol:<12} {self.pc_counts[pc]:>11} {100 * self.pc_counts[pc] / total:6.2f}")
+
+        if self.calls:
+            lines.append("")
+            lines.append("subroutine         calls   inclusive   exclusive")
+            targets = sorted(self.calls, key=lambda target: -self.calls[target][1])
+            for target in targets[:top]:
+                count, inclusive, exclusive = self.calls[target]
+                lines.append(f"{self.name(target):<15} {count:>8} {inclusive:>11} {exclusive:>11}")
+
+        return "\n".join(lines)
+
+    def write_collapsed(self, filename):
+        """Write the call stacks in the collapsed format flame graph tools read."""
+
+        with open(filename, "w") as file:
+            for path, cycles in sorted(self.stacks.items()):
+                if cycles:
+                    file.write(f"{';'.join(path)} {cycles}\n")
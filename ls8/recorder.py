@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+"""Binary execution traces (.ls8t) for the LS-8."""
+
+# CPU.trace() prints a line of text per instruction, which on a long run costs
+# far more than running the program. The recorder runs the cpu with a hook in its
+# run loop that packs the state before every instruction into a fixed size record
+# instead, buffering them and writing a large chunk at a time.
+#
+#   cpu = CPU()
+#   cpu.load("examples/sctest.ls8")
+#   with TraceRecorder(cpu, "sctest.ls8t", compress=True, pcs=(0x10, 0x40)) as recorder:
+#       recorder.run()
+#
+#   for record in read_trace("sctest.ls8t"):
+#       print(record.cycle, record.pc, record.reg)
+#
+#   python recorder.py show sctest.ls8t
+#   python recorder.py diff before.ls8t after.ls8t
+#
+# File layout (little endian): an 8 byte header - magic b"LS8T", format version,
+# flags (bit 0 compressed), record size - then chunks. Each chunk is its stored
+# length and the length of the records in it (both 4 bytes) followed by the
+# records, zlib compressed if the file is.
+#
+# Record (22 bytes): cycle (8), pc (2), opcode, operand a, operand b, the eight
+# registers and fl, all as they were before the instruction ran.
+
+import argparse
+import struct
+import sys
+import zlib
+from collections import namedtuple
+
+from opcodes import OPCODES
+
+MAGIC = b"LS8T"
+VERSION = 1
+
+COMPRESSED = 0b1
+
+HEADER = struct.Struct("<4sBBH")
+CHUNK = struct.Struct("<II")
+RECORD = struct.Struct("<QHBBB8sB")
+
+# records buffered before a chunk is written, about 1.4MB
+CHUNK_RECORDS = 1 << 16
+
+Record = namedtuple("Record", "cycle pc IR a b reg fl")
+
+
+class TraceError(Exception):
+    """Raised for a file that is not a valid trace."""
+
+
+class TraceRecorder:
+    """Runs a CPU and writes a record for every instruction that passes the filters."""
+
+    def __init__(self, cpu, filename, pcs=None, opcodes=None, every=1, compress=False):
+        """
+        pcs is a (first, last) range of addresses to record, inclusive, opcodes a
+        set of names like {"CALL", "RET"}, and every records only every Nth
+        instruction that passes those two. All instructions still run.
+        """
+
+        self.cpu = cpu
+        self.every = every
+        self.compress = compress
+
+        # instructions that passed the filters since the last one recorded
+        self.skipped = every - 1
+
+        # one flag per pc and per opcode byte, so the filters cost two list lookups
+        first, last = pcs if pcs is not None else (0, 0xFF)
+        self.wanted_pc = [first <= pc <= last for pc in range(0x100)]
+        self.wanted_op = [opcodes is None or (IR in OPCODES and OPCODES[IR].name in opcodes)
+                          for IR in range(0x100)]
+
+        self.buffer = bytearray(RECORD.size * CHUNK_RECORDS)
+        self.count = 0
+
+        self.file = open(filename, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, COMPRESSED if compress else 0, RECORD.size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def flush(self):
+        """Write the buffered records out as one chunk."""
+
+        if not self.count:
+            return
+
+        data = bytes(memoryview(self.buffer)[:self.count * RECORD.size])
+        if self.compress:
+            data = zlib.compress(data, 1)
+
+        self.file.write(CHUNK.pack(len(data), self.count * RECORD.size))
+        self.file.write(data)
+        self.count = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def run(self, max_cycles=None, deadline=None):
+        """Run the CPU like CPU.run, recording as it goes. Returns a RunResult."""
+
+        cpu = self.cpu
+        reg = cpu.reg
+        ram = cpu.ram
+        wanted_pc = self.wanted_pc
+        wanted_op = self.wanted_op
+        pack_into = RECORD.pack_into
+        buffer = self.buffer
+        every = self.every
+
+        # the sampling count and where the next record goes are kept in locals while running
+        skipped = self.skipped
+        offset = self.count * RECORD.size
+        end = len(buffer)
+
+        def record(cycles, pc, entry):
+            nonlocal skipped, offset
+
+            if pc is None:
+                return
+
+            IR = ram[pc]
+            if wanted_pc[pc] and wanted_op[IR]:
+                skipped += 1
+                if skipped == every:
+                    skipped = 0
+                    pack_into(buffer, offset, cycles, pc, IR, entry[1], entry[2], bytes(reg), cpu.fl)
+                    offset += RECORD.size
+                    if offset == end:
+                        self.count = CHUNK_RECORDS
+                        self.flush()
+                        offset = 0
+
+        try:
+            return cpu.run(max_cycles, deadline, hook=record)
+        finally:
+            self.skipped = skipped
+            self.count = offset // RECORD.size
+
+
+def read_trace(filename):
+    """Yield the Records of a trace one at a time, a chunk in memory at once."""
+
+    with open(filename, "rb") as file:
+        header = file.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise TraceError("truncated header")
+
+        magic, version, flags, size = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise TraceError("not an .ls8t trace")
+        if version != VERSION or size != RECORD.size:
+            raise TraceError(f"unsupported trace version {version}")
+
+        while True:
+            chunk = file.read(CHUNK.size)
+            if not chunk:
+                return
+            if len(chunk) != CHUNK.size:
+                raise TraceError("truncated chunk")
+
+            stored, length = CHUNK.unpack(chunk)
+            data = file.read(stored)
+            if len(data) != stored:
+                raise TraceError("truncated chunk")
+
+            if flags & COMPRESSED:
+                data = zlib.decompress(data)
+            if len(data) != length or length % RECORD.size:
+                raise TraceError("corrupt chunk")
+
+            for fields in RECORD.iter_unpack(data):
+                yield Record._make(fields)
+
+
+def diff_traces(first, second):
+    """
+    Compare two traces record by record. Returns (index, record, record) for the
+    first place they differ - None for the trace that ended first - or None if
+    they are the same.
+    """
+
+    index = 0
+    a_records, b_records = read_trace(first), read_trace(second)
+
+    while True:
+        a = next(a_records, None)
+        b = next(b_records, None)
+
+        if a != b:
+            return index, a, b
+        if a is None:
+            return None
+
+        index += 1
+
+
+def format_record(record):
+    name = OPCODES[record.IR].name if record.IR in OPCODES else f"{record.IR:08b}"
+    registers = " ".join(f"{value:02X}" for value in record.reg)
+    return (f"{record.cycle:>10} | {record.pc:02X} | {name:<4} {record.a:02X} {record.b:02X} | "
+            f"{record.fl:02X} | {registers}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Read LS-8 execution traces")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    show = commands.add_parser("show", help="print the records of a trace")
+    show.add_argument("trace")
+    show.add_argument("--limit", type=int, default=None, help="stop after this many records")
+
+    diff = commands.add_parser("diff", help="find where two traces part ways")
+    diff.add_argument("first")
+    diff.add_argument("second")
+
+    args = parser.parse_args(argv[1:])
+
+    if args.command == "show":
+        for index, record in enumerate(read_trace(args.trace)):
+            if index == args.limit:
+                break
+            print(format_record(record))
+        return 0
+
+    difference = diff_traces(args.first, args.second)
+    if difference is None:
+        print("traces are the same")
+        return 0
+
+    index, a, b = difference
+    print(f"traces differ at record {index}")
+    print(f"  {args.first}: {format_record(a) if a else 'ends'}")
+    print(f"  {args.second}: {format_record(b) if b else 'ends'}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,208 @@
+"""Machine snapshots (.ls8s)."""
+
+# A snapshot is the complete state of a machine as one bytes blob - small enough
+# to keep thousands in memory and restored by copying straight into the cpu's
+# existing ram and register buffers.
+#
+# Layout (all fields little endian):
+#
+#   offset  size  field
+#   0       4     magic b"LS8S"
+#   4       1     format version (2)
+#   5       1     flags - bit 0 running, bit 1 interrupts enabled, bit 2 banked
+#   6       2     pc
+#   8       1     fl
+#   9       1     interrupts pending in the controller, not yet copied to IS
+#   10      1     interrupts in IS that the controller raised and hasn't delivered
+#   11      1     reserved, 0
+#   12      4     length of the buffered, not yet flushed output
+#   16      8     cycles
+#   24      8     cycle count the cycle driven timer fires at, -1 if there is none
+#   32      8     registers
+#   40      256   ram
+#   296     ...   buffered output
+#
+# followed, for a machine with banked memory (see banks.py), by
+#
+#   0       1     window start
+#   1       1     window size
+#   2       1     bank select port
+#   3       1     bank mapped in
+#   4       2     number of pages
+#   6       ...   every page - its bank number, then window size bytes
+#
+# Version 1 snapshots, which have no banks, are still read.
+#
+# Keys queued on a keyboard but not yet delivered are host input rather than
+# machine state and are not part of a snapshot.
+
+import struct
+
+from banks import BankedMemory
+
+MAGIC = b"LS8S"
+VERSION = 2
+VERSIONS = (1, 2)
+
+HEADER = struct.Struct("<4sBBHBBBBIQq")
+BANKS = struct.Struct("<BBBBH")
+
+RUNNING = 0b001
+ENABLED = 0b010
+BANKED = 0b100
+
+REGISTERS = 8
+RAM = 0x100
+
+
+class SnapshotError(Exception):
+    """Raised for data that is not a valid snapshot."""
+
+
+def is_snapshot(filename):
+    """True if the file starts with the .ls8s magic number."""
+    with open(filename, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def capture(cpu):
+    """Return the state of cpu as bytes."""
+
+    interrupts = cpu.interrupts
+
+    banks = cpu.banks
+
+    flags = ((RUNNING if cpu.running else 0) | (ENABLED if interrupts.enabled else 0) |
+             (BANKED if banks is not None else 0))
+    deadline = -1 if interrupts.deadline is None else interrupts.deadline
+    buffered = cpu.output.buffer
+
+    parts = [
+        HEADER.pack(MAGIC, VERSION, flags, cpu.pc, cpu.fl, interrupts.pending, interrupts.raised, 0,
+                    len(buffered), cpu.cycles, deadline),
+        cpu.reg,
+        cpu.ram,
+        buffered,
+    ]
+
+    # the window is in ram already, the pages switched out are only here
+    if banks is not None:
+        parts.append(BANKS.pack(banks.start, banks.size, banks.port, banks.bank, len(banks.pages)))
+        for bank, page in banks.pages.items():
+            parts.append(bytes((bank,)))
+            parts.append(page)
+
+    return b"".join(parts)
+
+
+def restore_into(cpu, snapshot):
+    """Put cpu back into the state captured in snapshot."""
+
+    view = memoryview(snapshot)
+
+    if len(view) < HEADER.size + REGISTERS + RAM:
+        raise SnapshotError("truncated snapshot")
+
+    magic, version, flags, pc, fl, pending, raised, _, buffered, cycles, deadline = HEADER.unpack_from(view)
+
+    if magic != MAGIC:
+        raise SnapshotError("not an .ls8s snapshot")
+
+    if version not in VERSIONS:
+        raise SnapshotError(f"unsupported snapshot version {version}")
+
+    position = HEADER.size
+    reg = view[position:position + REGISTERS]
+    position += REGISTERS
+    ram = view[position:position + RAM]
+    position += RAM
+    output = view[position:position + buffered]
+
+    if len(output) != buffered:
+        raise SnapshotError("truncated output")
+    position += buffered
+
+    pages = None
+    if flags & BANKED:
+        pages, bank, geometry = read_banks(view, position)
+
+        if cpu.banks is not None and (cpu.banks.start, cpu.banks.size, cpu.banks.port) != geometry:
+            raise SnapshotError("the snapshot's bank window doesn't match the cpu's banked memory")
+
+    # the new ram is copied in one go, which bypasses ram_write - so any decoded
+    # instruction whose bytes are changing has to be invalidated here instead
+    if cpu.ram != ram:
+        code_map = cpu.code_map
+        old = cpu.ram
+        for address in range(RAM):
+            if code_map[address] and old[address] != ram[address]:
+                cpu.invalidate(address)
+
+        cpu.ram[:] = ram
+
+    cpu.reg[:] = reg
+    cpu.pc = pc
+    cpu.fl = fl
+    cpu.cycles = cycles
+    cpu.running = bool(flags & RUNNING)
+
+    interrupts = cpu.interrupts
+    interrupts.enabled = bool(flags & ENABLED)
+    interrupts.raised = raised
+    with interrupts.lock:
+        interrupts.pending = pending
+    if interrupts.timer_cycles is not None:
+        interrupts.deadline = deadline if deadline >= 0 else cycles + interrupts.timer_cycles
+
+    cpu.output.buffer[:] = output
+
+    # the window came back with ram, which only leaves the pages switched out
+    if pages is not None:
+        start, size, port = geometry
+        banks = cpu.banks if cpu.banks is not None else BankedMemory(cpu, start, size, port)
+        banks.pages = pages
+        banks.bank = bank
+
+    # a machine without banks has nothing switched out, whatever is at the port is what is mapped in
+    elif cpu.banks is not None:
+        cpu.banks.pages = {}
+        cpu.banks.bank = cpu.ram[cpu.banks.port]
+
+    # whatever the restored state is waiting for gets looked at before the next instruction
+    cpu.attention = True
+
+
+def read_banks(view, position):
+    """The banked memory after the output. Returns (pages, bank mapped in, (start, size, port))."""
+
+    if len(view) < position + BANKS.size:
+        raise SnapshotError("truncated banks")
+
+    start, size, port, bank, count = BANKS.unpack_from(view, position)
+    position += BANKS.size
+
+    if size == 0:
+        raise SnapshotError("empty bank window")
+
+    pages = {}
+    for _ in range(count):
+        page = view[position + 1:position + 1 + size]
+        if len(page) != size:
+            raise SnapshotError("truncated page")
+
+        pages[view[position]] = bytearray(page)
+        position += 1 + size
+
+    return pages, bank, (start, size, port)
+
+
+def save(filename, snapshot):
+    """Write a snapshot to disk."""
+    with open(filename, "wb") as file:
+        file.write(snapshot)
+
+
+def load(filename):
+    """Read a snapshot written by save()."""
+    with open(filename, "rb") as file:
+        return file.read()
@@ -0,0 +1,302 @@
+"""Basic-block translator for the LS-8."""
+
+# Instead of dispatching every instruction through the branchtable, the translator
+# cuts the program into straight-line basic blocks, writes the Python source for
+# each block, compiles it once and then runs the whole block as one function call.
+#
+#   cpu = CPU()
+#   cpu.load("examples/mult.ls8")
+#   BlockTranslator(cpu).run()
+#
+# The register, flag, ram and output state afterwards is the same as after cpu.run().
+
+# longest run of instructions compiled into one block
+MAX_BLOCK_INSTRUCTIONS = 64
+
+# blocks run between checks for output that has been buffered too long
+EXPIRE_BLOCKS = 4096
+
+# straight-line templates for the common instructions, keyed by the name of the
+# handler in the cpu's branchtable. {a} and {b} are the operands, {next} is the
+# address of the following instruction, wrapped round to 0 past the end of ram. anything not listed here is compiled as a
+# call to the cpu's own handler so the semantics always stay the same, and so is
+# a handler that something else has put in the branchtable - bus.py's LD, say.
+TEMPLATES = {
+    "LDI": ["reg[{a}] = {b}"],
+    "LD":  ["reg[{a}] = ram[reg[{b}]]"],
+    "ADD": ["reg[{a}] = (reg[{a}] + reg[{b}]) & 0xFF"],
+    "SUB": ["reg[{a}] = (reg[{a}] - reg[{b}]) & 0xFF"],
+    "MUL": ["reg[{a}] = (reg[{a}] * reg[{b}]) & 0xFF"],
+    "AND": ["reg[{a}] = reg[{a}] & reg[{b}]"],
+    "OR":  ["reg[{a}] = reg[{a}] | reg[{b}]"],
+    "XOR": ["reg[{a}] = reg[{a}] ^ reg[{b}]"],
+    "SHL": ["reg[{a}] = (reg[{a}] << reg[{b}]) & 0xFF"],
+    "SHR": ["reg[{a}] = reg[{a}] >> reg[{b}]"],
+    "NOT": ["reg[{a}] = ~reg[{a}] & 0xFF"],
+    "INC": ["reg[{a}] = (reg[{a}] + 1) & 0xFF"],
+    "DEC": ["reg[{a}] = (reg[{a}] - 1) & 0xFF"],
+    "NOP": [],
+    "CMP": [
+        "x = reg[{a}]",
+        "y = reg[{b}]",
+        "cpu.fl = 0b00000001 if x == y else (0b00000010 if x > y else 0b00000100)",
+    ],
+    "POP": [
+        "sp = reg[7]",
+        "reg[{a}] = ram[sp]",
+        "reg[7] = (reg[7] + 1) & 0xFF",
+    ],
+}
+
+# instructions that write to ram - after the write the block checks whether it
+# just overwrote its own remaining code and if so hands control back to the
+# dispatcher, which recompiles from the next instruction. it hands control back
+# too if the write needs the cpu's attention - a device on the bus, or the
+# stack watchdog stopping the cpu
+WRITE_TEMPLATES = {
+    "PUSH": [
+        "reg[7] = (reg[7] - 1) & 0xFF",
+        "sp = reg[7]",
+        "write(reg[{a}], sp)",
+    ],
+    "ST": [
+        "sp = reg[{a}]",
+        "write(reg[{b}], sp)",
+    ],
+}
+
+# templates for the instructions that end a block, each one returns the next pc
+EXIT_TEMPLATES = {
+    "JMP": ["return reg[{a}]"],
+    "JEQ": ["return reg[{a}] if cpu.fl & 0b00000001 else {next}"],
+    "JNE": ["return {next} if cpu.fl & 0b00000001 else reg[{a}]"],
+    "JGT": ["return reg[{a}] if cpu.fl & 0b00000010 else {next}"],
+    "JGE": ["return reg[{a}] if cpu.fl & 0b00000011 else {next}"],
+    "JLT": ["return reg[{a}] if cpu.fl & 0b00000100 else {next}"],
+    "JLE": ["return reg[{a}] if cpu.fl & 0b00000101 else {next}"],
+    "CALL": [
+        "reg[7] = (reg[7] - 1) & 0xFF",
+        "write({next} & 0xFF, reg[7])",
+        "return reg[{a}]",
+    ],
+    "RET": [
+        "sp = reg[7]",
+        "return_address = ram[sp]",
+        "reg[7] = (sp + 1) & 0xFF",
+        "return return_address",
+    ],
+    "HLT": [
+        "cpu.running = False",
+        "cpu.output.flush()",
+        "return {next}",
+    ],
+}
+
+
+class BlockTranslator:
+    """Runs a CPU by compiling its program into Python functions, one per basic block."""
+
+    def __init__(self, cpu, blocks=None):
+        self.cpu = cpu
+
+        # compiled block function for every block start address
+        self.blocks = [None] * len(cpu.ram)
+        # end address (exclusive) of each compiled block
+        self.block_end = {}
+        # for every ram address, the starts of the compiled blocks that were built from it
+        self.covering = [set() for _ in range(len(cpu.ram))]
+
+        # code objects keyed by (start address, block bytes, handlers called) so a block that is
+        # invalidated and then comes back unchanged doesn't have to be compiled again
+        self.code_cache = {}
+        # generated source of each block start, handy when debugging the translator
+        self.sources = {}
+
+        cpu.code_listeners.append(self.invalidate)
+
+        # a block map from cfg.py gets every block compiled before the first dispatch
+        for start, end in blocks or []:
+            try:
+                self.compile(start)
+            except Exception:
+                pass
+
+    # drops every compiled block that includes the byte at address
+    def invalidate(self, address):
+        for start in list(self.covering[address]):
+            self.blocks[start] = None
+            for covered in range(start, self.block_end.pop(start)):
+                self.covering[covered & 0xFF].discard(start)
+
+    def scan(self, start):
+        """
+        Find the basic block that starts at start. Returns the decoded instructions
+        as (address, handler, operand_a, operand_b, size, pc_set) tuples.
+        """
+
+        cpu = self.cpu
+        instructions = []
+        address = start
+
+        while address < len(cpu.ram) and len(instructions) < MAX_BLOCK_INSTRUCTIONS:
+            entry = cpu.decoded[address]
+
+            if entry is None:
+                try:
+                    entry = cpu.decode(address)
+                except Exception:
+                    # the interpreter only complains about a bad opcode once it gets
+                    # there, so end the block before it and let the next dispatch raise
+                    if not instructions:
+                        raise
+                    break
+
+            handler, operand_a, operand_b, size, pc_set = entry
+            instructions.append((address, handler, operand_a, operand_b, size, pc_set))
+            address += size
+
+            if pc_set or handler.__name__ == "HLT":
+                break
+
+        return instructions
+
+    def generate(self, start, instructions):
+        """Generate the Python source for a block, plus the handlers it calls."""
+
+        end = instructions[-1][0] + instructions[-1][4]
+        lines = []
+        handlers = {}
+
+        def emit(line, executed):
+            # every way out of the block first adds the instructions it ran to the cycle count
+            stripped = line.lstrip()
+            if stripped.startswith("return "):
+                indent = line[:len(line) - len(stripped)]
+                lines.append(f"{indent}cpu.cycles += {executed}")
+            lines.append(line)
+
+        for executed, (address, handler, operand_a, operand_b, size, pc_set) in enumerate(instructions, 1):
+            name = handler.__name__
+            fields = {"a": operand_a, "b": operand_b, "next": (address + size) & 0xFF}
+
+            lines.append(f"# {address:02X}: {name} {operand_a} {operand_b}")
+
+            # the templates only describe the cpu's own handlers
+            templated = getattr(handler, "__self__", None) is self.cpu
+
+            if templated and name in EXIT_TEMPLATES:
+                for line in EXIT_TEMPLATES[name]:
+                    emit(line.format(**fields), executed)
+
+            elif templated and name in TEMPLATES:
+                for line in TEMPLATES[name]:
+                    emit(line.format(**fields), executed)
+
+            elif templated and name in WRITE_TEMPLATES:
+                for line in WRITE_TEMPLATES[name]:
+                    emit(line.format(**fields), executed)
+                # only the bytes after this instruction can still change what the block does
+                if address + size < end:
+                    lines.append(f"if cpu.attention or {address + size} <= sp < {end}:")
+                    emit(f"    return {(address + size) & 0xFF}", executed)
+
+            else:
+                # no template - fall back to the cpu's own handler
+                handler_name = f"h_{name}"
+                handlers[handler_name] = handler
+                lines.append(f"cpu.pc = {address}")
+                lines.append(f"{handler_name}({operand_a}, {operand_b})")
+
+                if pc_set:
+                    emit("return cpu.pc", executed)
+                elif address + size < end:
+                    # a divide by zero halts, a store can reach a device - the rest of the block
+                    # waits until the dispatcher has seen to whatever needs attention
+                    lines.append("if cpu.attention:")
+                    emit(f"    return {(address + size) & 0xFF}", executed)
+
+        # a block that was cut short by its length falls through to the next one
+        last_handler, last_pc_set = instructions[-1][1], instructions[-1][5]
+        if not last_pc_set and last_handler.__name__ != "HLT":
+            emit(f"return {end & 0xFF}", len(instructions))
+
+        args = ", ".join(["cpu=cpu", "reg=reg", "ram=ram", "write=write"] +
+                         [f"{name}={name}" for name in handlers])
+        source = f"def block_{start:02X}({args}):\n" + "".join(f"    {line}\n" for line in lines)
+
+        return source, handlers
+
+    def compile(self, start):
+        """Compile the block at start and remember it in the block cache."""
+
+        cpu = self.cpu
+        instructions = self.scan(start)
+        end = instructions[-1][0] + instructions[-1][4]
+
+        source, handlers = self.generate(start, instructions)
+        # the last instruction can read its operands from the start of ram
+        covered = [address & 0xFF for address in range(start, end)]
+        key = (start, bytes(cpu.ram[address] for address in covered), tuple(handlers))
+
+        code = self.code_cache.get(key)
+        if code is None:
+            code = compile(source, f"<ls8 block {start:02X}>", "exec")
+            self.code_cache[key] = code
+
+        namespace = {
+            "cpu": cpu,
+            "reg": cpu.reg,
+            "ram": cpu.ram,
+            "write": cpu.ram_write,
+        }
+        namespace.update(handlers)
+        exec(code, namespace)
+
+        block = namespace[f"block_{start:02X}"]
+        self.blocks[start] = block
+        self.block_end[start] = end
+        self.sources[start] = source
+
+        for address in covered:
+            self.covering[address].add(start)
+            cpu.code_map[address] = 1
+
+        return block
+
+    def run(self):
+        """Run the CPU until it halts."""
+
+        cpu = self.cpu
+        blocks = self.blocks
+        interrupts = cpu.interrupts
+        pc = cpu.pc
+        count = 0
+
+        interrupts.start()
+
+        try:
+            while cpu.running:
+                count += 1
+                if count == EXPIRE_BLOCKS:
+                    count = 0
+                    cpu.output.expire()
+                    interrupts.recheck()
+
+                # interrupts and the cycle timer are taken at block boundaries
+                if cpu.attention or (interrupts.deadline is not None and cpu.cycles >= interrupts.deadline):
+                    cpu.pc = pc
+                    if not cpu.attention:
+                        interrupts.tick(cpu.cycles)
+                    cpu.attend()
+                    pc = cpu.pc
+                    continue
+
+                block = blocks[pc]
+                if block is None:
+                    block = self.compile(pc)
+
+                pc = block()
+        finally:
+            interrupts.stop()
+            cpu.pc = pc
+            cpu.output.flush()
@@ -0,0 +1,52 @@
+"""Stack watchdog for the LS-8."""
+
+# The stack grows down from F4 towards the program, and nothing stops it from
+# running on into the code - stackoverflow.ls8 does exactly that, and what
+# happens next depends on which instruction it overwrites. The watchdog stops
+# the cpu at the first push that lands in the program image instead.
+#
+#   cpu.load("examples/stackoverflow.ls8")
+#   result = cpu.run(watchdog=True)
+#   result.reason                   # "stack_overflow"
+#
+#   StackWatchdog(cpu)              # or with any engine
+#   BlockTranslator(cpu).run()
+#   cpu.stack_overflow              # address of the push, None if there was none
+#
+# Every push goes through ram_write at the new stack pointer, so the watchdog
+# marks the image in the code map and listens for writes there - the run loop
+# checks nothing extra. A write to the image at the stack pointer is a push
+# that has run into the program. The byte is already written when the cpu
+# stops, and the cpu stops as if it had halted.
+
+
+class StackWatchdog:
+    """Halts the cpu when the stack runs into the program image."""
+
+    def __init__(self, cpu, end=None):
+        """
+        Watch the image from address 0 to end - the end of the program that was
+        loaded, or else the last byte below the stack that isn't 0.
+        """
+
+        if end is None:
+            end = cpu.image_end
+        if end is None:
+            end = max((address + 1 for address in range(cpu.reg[7]) if cpu.ram[address]), default=0)
+
+        self.cpu = cpu
+        self.end = end
+
+        cpu.code_map[:end] = b'\x01' * end
+        cpu.code_listeners.append(self.written)
+
+    def written(self, address):
+        cpu = self.cpu
+        if address < self.end and address == cpu.reg[7]:
+            cpu.stack_overflow = address
+            cpu.running = False
+            cpu.attention = True
+
+    def detach(self):
+        """Stop watching. The image stays marked in the code map, which only costs a little on writes to it."""
+        self.cpu.code_listeners.remove(self.written)